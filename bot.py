@@ -1,21 +1,44 @@
 import os
+import socket
 import time
+import asyncio
+import heapq
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 import random
-import io
-import csv
-from dataclasses import dataclass
-from typing import List, Optional, Tuple
-
-import psycopg
+import re
+import gzip
+import tempfile
+import zipfile
+from datetime import datetime, timedelta, timezone
+import calendar
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from functools import lru_cache, wraps
+from typing import Dict, List, Optional, Tuple
+
+from psycopg import AsyncConnection
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb, set_json_dumps
+from psycopg_pool import AsyncConnectionPool
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputFile, InputMediaPhoto, Message
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
+    BasePersistence,
+    BaseRateLimiter,
+    PersistenceInput,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
@@ -30,9 +53,96 @@ ADMIN_IDS = {int(x.strip()) for x in ADMIN_IDS_RAW.split(",") if x.strip().isdig
 # сколько вопросов брать за одно прохождение (по умолчанию 10)
 QUESTIONS_PER_RUN = int(os.environ.get("QUESTIONS_PER_RUN", "10"))
 
+# внешний банк вопросов (JSON); если не задан — используются QUESTIONS/THEORY_TEXT ниже
+QUESTION_BANK_PATH = os.environ.get("QUESTION_BANK_PATH", "")
+
 # штраф за неправильный ответ (по умолчанию +5 сек)
 WRONG_PENALTY_MS = int(os.environ.get("WRONG_PENALTY_MS", "5000"))
 
+# реплика для аналитики админов (статистика, экспорт): свой маленький пул и таймаут;
+# если не задана, недоступна или отстаёт больше DB_READ_MAX_LAG_S — читаем с основной базы
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL", "")
+DB_READ_POOL_MAX_SIZE = int(os.environ.get("DB_READ_POOL_MAX_SIZE", "3"))
+DB_READ_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_READ_STATEMENT_TIMEOUT_MS", "30000"))
+# потоковый экспорт законно идёт долго: свой лимит, 0 — без лимита
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.environ.get("EXPORT_STATEMENT_TIMEOUT_MS", "0"))
+DB_READ_MAX_LAG_S = float(os.environ.get("DB_READ_MAX_LAG_S", "30"))
+DB_READ_CHECK_INTERVAL_S = float(os.environ.get("DB_READ_CHECK_INTERVAL_S", "10"))
+
+# пул соединений с Postgres (один на процесс)
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))        # сек ожидания свободного соединения
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))     # сек простоя до закрытия лишнего соединения
+
+# отложенная запись events/answers пачками
+WRITE_BUFFER_MAX = int(os.environ.get("WRITE_BUFFER_MAX", "10000"))     # максимум строк в очереди
+WRITE_FLUSH_ROWS = int(os.environ.get("WRITE_FLUSH_ROWS", "500"))       # сбрасывать каждые N строк
+WRITE_FLUSH_MS = int(os.environ.get("WRITE_FLUSH_MS", "500"))           # ... или каждые M мс
+
+# кэш "касаний" пользователя: last_seen_ts обновляется не чаще, чем раз в N сек
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "50000"))
+USER_TOUCH_GRANULARITY_S = int(os.environ.get("USER_TOUCH_GRANULARITY_S", "60"))
+
+# таблица лидеров: сколько строк показывать и сколько живёт кэш (страховка от смены имён)
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", "10"))
+LEADERBOARD_CACHE_TTL_S = int(os.environ.get("LEADERBOARD_CACHE_TTL_S", "300"))
+
+# сводка для админов пересчитывается не чаще, чем раз в N сек
+OVERVIEW_CACHE_TTL_S = int(os.environ.get("OVERVIEW_CACHE_TTL_S", "30"))
+
+# почасовые счётчики по вопросам (для окон 24ч/7д) храним N дней
+QUESTION_STATS_KEEP_DAYS = int(os.environ.get("QUESTION_STATS_KEEP_DAYS", "30"))
+
+# события: дневные партиции, старше EVENTS_RETENTION_DAYS сворачиваются в events_daily и удаляются
+EVENTS_RETENTION_DAYS = int(os.environ.get("EVENTS_RETENTION_DAYS", "90"))
+EVENTS_PARTITIONS_AHEAD_DAYS = int(os.environ.get("EVENTS_PARTITIONS_AHEAD_DAYS", "7"))
+EVENTS_MAINTENANCE_INTERVAL_S = int(os.environ.get("EVENTS_MAINTENANCE_INTERVAL_S", "3600"))
+
+# сессии теста хранятся в Postgres и переживают рестарт
+SESSION_FLUSH_INTERVAL_S = float(os.environ.get("SESSION_FLUSH_INTERVAL_S", "10"))  # как часто сбрасывать изменения
+ATTEMPT_TIMEOUT_S = int(os.environ.get("ATTEMPT_TIMEOUT_S", "3600"))      # started дольше этого -> timeout
+REAPER_INTERVAL_S = int(os.environ.get("REAPER_INTERVAL_S", "300"))
+
+# сессии в памяти: простаивающие дольше SESSION_IDLE_TTL_S выселяются (незаконченная
+# попытка закрывается как abandoned), всего держим не больше SESSION_MAX_USERS
+SESSION_IDLE_TTL_S = int(os.environ.get("SESSION_IDLE_TTL_S", "1800"))
+SESSION_MAX_USERS = int(os.environ.get("SESSION_MAX_USERS", "20000"))
+SESSION_SWEEP_INTERVAL_S = int(os.environ.get("SESSION_SWEEP_INTERVAL_S", "60"))
+
+# режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.environ.get("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")                          # публичный адрес https://..., обязателен для webhook
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8080")))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or None                # заголовок X-Telegram-Bot-Api-Secret-Token, обязателен для webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# несколько процессов бота за одним вебхуком: сессии читаются/пишутся в Postgres на
+# каждом апдейте под advisory-локом пользователя, кэши сбрасываются через LISTEN/NOTIFY
+MULTI_WORKER = os.environ.get("MULTI_WORKER", "0").strip().lower() in ("1", "true", "yes")
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# сколько апдейтов обрабатывать одновременно; апдейты одного пользователя
+# всё равно идут строго по очереди (см. UserLocks)
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "32"))
+
+# тест и экраны меню в одном сообщении: нажатие кнопки правит это сообщение,
+# а не присылает новое (1 — включено)
+EDIT_IN_PLACE = os.environ.get("EDIT_IN_PLACE", "0").strip().lower() in ("1", "true", "yes")
+
+# исходящие сообщения: общий лимит бота и лимит на один чат (сообщений в секунду)
+SEND_RATE_GLOBAL = float(os.environ.get("SEND_RATE_GLOBAL", "30"))
+SEND_RATE_PER_CHAT = float(os.environ.get("SEND_RATE_PER_CHAT", "1"))
+SEND_BURST_PER_CHAT = int(os.environ.get("SEND_BURST_PER_CHAT", "3"))     # сколько можно отправить в чат подряд
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", "3"))           # повторов после 429 (RetryAfter)
+
+# Prometheus: /metrics на отдельном порту, по умолчанию выключено (0).
+# Слушает только localhost; наружу (в контейнере) — METRICS_ADDR=0.0.0.0
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_ADDR = os.environ.get("METRICS_ADDR", "127.0.0.1")
+
 # ==========================================================
 # ========================= ТЕОРИЯ =========================
 # Вставляй одним большим текстом (можно в ENV, но проще здесь)
@@ -257,6 +367,12 @@ def chunk_text(text: str, max_chars: int = 900) -> List[str]:
         pages.append(buf)
     return pages
 
+CAPTION_MAX_CHARS = 1024   # лимиты Telegram: подпись к фото
+TEXT_MAX_CHARS = 4096      # и текст сообщения
+
+def clip_text(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
 def fmt_ms(ms: int) -> str:
     sec = ms / 1000.0
     m = int(sec // 60)
@@ -264,9 +380,10 @@ def fmt_ms(ms: int) -> str:
     return f"{m}:{s:06.3f}"
 
 def build_quiz_order() -> List[int]:
-    if len(QUESTIONS) < QUESTIONS_PER_RUN:
-        raise RuntimeError(f"В QUESTIONS={len(QUESTIONS)} вопросов, но QUESTIONS_PER_RUN={QUESTIONS_PER_RUN}. Добавь вопросы или уменьши QUESTIONS_PER_RUN.")
-    return random.sample(range(len(QUESTIONS)), k=QUESTIONS_PER_RUN)
+    total = len(CONTENT.questions)
+    if total < QUESTIONS_PER_RUN:
+        raise RuntimeError(f"В QUESTIONS={total} вопросов, но QUESTIONS_PER_RUN={QUESTIONS_PER_RUN}. Добавь вопросы или уменьши QUESTIONS_PER_RUN.")
+    return random.sample(range(total), k=QUESTIONS_PER_RUN)
 
 def total_time_ms(context: ContextTypes.DEFAULT_TYPE) -> int:
     t0 = float(context.user_data.get("t0", time.time()))
@@ -281,103 +398,834 @@ async def send(update: Update, text: str, reply_markup=None):
         await update.message.reply_text(text, reply_markup=reply_markup)
 
 async def send_photo(update: Update, path: str, caption: str, reply_markup=None):
+    # первый раз грузим файл, дальше шлём file_id, который вернул Telegram;
+    # если файл на диске поменялся (другой хэш) — грузим заново
+    content_hash = photo_hash(path)
+    target = update.callback_query.message if update.callback_query else update.message
+
+    file_id = PHOTO_CACHE.get(path, content_hash)
+    if file_id:
+        try:
+            await target.reply_photo(photo=file_id, caption=caption, reply_markup=reply_markup)
+            return
+        except BadRequest as e:
+            print("WARN: cached file_id rejected:", path, repr(e))
+            PHOTO_CACHE.forget(path)
+
     with open(path, "rb") as f:
-        if update.callback_query:
-            await update.callback_query.message.reply_photo(photo=f, caption=caption, reply_markup=reply_markup)
-        else:
-            await update.message.reply_photo(photo=f, caption=caption, reply_markup=reply_markup)
+        msg = await target.reply_photo(photo=f, caption=caption, reply_markup=reply_markup)
+    if msg.photo:
+        await PHOTO_CACHE.put(path, content_hash, msg.photo[-1].file_id)
+
+async def edit_screen(message: Message, text: str, reply_markup=None, photo_path: Optional[str] = None) -> bool:
+    # False — правкой не обойтись (фото нельзя превратить в текст и наоборот)
+    if photo_path:
+        if not message.photo:
+            return False
+        content_hash = photo_hash(photo_path)
+        file_id = PHOTO_CACHE.get(photo_path, content_hash)
+        if file_id:
+            await message.edit_media(InputMediaPhoto(file_id, caption=text), reply_markup=reply_markup)
+            return True
+        with open(photo_path, "rb") as f:
+            msg = await message.edit_media(InputMediaPhoto(f, caption=text), reply_markup=reply_markup)
+        if isinstance(msg, Message) and msg.photo:
+            await PHOTO_CACHE.put(photo_path, content_hash, msg.photo[-1].file_id)
+        return True
+    if message.photo:
+        return False
+    await message.edit_text(text, reply_markup=reply_markup)
+    return True
+
+async def show(update: Update, text: str, reply_markup=None, photo_path: Optional[str] = None):
+    # экран: при EDIT_IN_PLACE правим сообщение с нажатой кнопкой, иначе (или если
+    # правка невозможна — сообщение старое, удалено, другого типа) шлём новое
+    query = update.callback_query
+    if EDIT_IN_PLACE and query and query.message:
+        try:
+            if await edit_screen(query.message, text, reply_markup, photo_path):
+                return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            print("WARN: edit failed, sending new message:", repr(e))
+
+    if photo_path:
+        await send_photo(update, photo_path, caption=text, reply_markup=reply_markup)
+        return
+    await send(update, text, reply_markup=reply_markup)
+
+# ==========================================================
+# ====================== МЕТРИКИ ===========================
+# ==========================================================
+# время обработки клика/команды, обращений к БД и вызовов Bot API;
+# по ним видно, что именно съедает задержку ответа
+HANDLER_SECONDS = Histogram("quizbot_handler_seconds", "Время обработки апдейта", ["action"])
+HANDLER_ERRORS = Counter("quizbot_handler_errors_total", "Ошибки в обработчиках", ["error"])
+DB_SECONDS = Histogram("quizbot_db_seconds", "Время работы хелперов БД", ["op"])
+DB_ERRORS = Counter("quizbot_db_errors_total", "Ошибки хелперов БД", ["op"])
+TG_API_SECONDS = Histogram("quizbot_telegram_api_seconds", "Время вызовов Bot API", ["method"])
+TG_API_ERRORS = Counter("quizbot_telegram_api_errors_total", "Ошибки вызовов Bot API", ["method"])
+
+DB_POOL_SIZE = Gauge("quizbot_db_pool_size", "Соединений в пуле (занятые + свободные)")
+DB_POOL_AVAILABLE = Gauge("quizbot_db_pool_available", "Свободных соединений в пуле")
+DB_POOL_WAITING = Gauge("quizbot_db_pool_waiting", "Запросов, ждущих соединение")
+WRITE_QUEUE_DEPTH = Gauge("quizbot_write_queue_depth", "Строк в буфере отложенной записи")
+
+# у callback_data есть параметр (номер страницы/вопроса) — в метку он не попадает
+CALLBACK_ACTIONS = {"noop", "menu", "help", "leaderboard", "start_quiz", "quit"}
+
+def callback_action(data: str) -> str:
+    if data in CALLBACK_ACTIONS:
+        return data
+    prefix, _, rest = data.partition(":")
+    if prefix in ("ans", "theory"):
+        return prefix
+    if prefix == "stats":
+        return f"stats:{rest}" if rest.isalpha() or rest.replace("_", "").isalnum() else "stats"
+    return "other"
+
+def timed_db(func):
+    # декоратор для async-хелперов БД: время и ошибки по имени функции
+    op = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.labels(op).inc()
+            raise
+        finally:
+            DB_SECONDS.labels(op).observe(time.perf_counter() - t0)
+
+    return wrapper
+
+def timed_handler(action: str):
+    def decorate(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with HANDLER_SECONDS.labels(action).time():
+                return await func(*args, **kwargs)
+
+        return wrapper
+    return decorate
+
+class MetricsRequest(HTTPXRequest):
+    # все вызовы Bot API идут через do_request — метод берём из хвоста URL
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TG_API_ERRORS.labels(api_method).inc()
+            raise
+        finally:
+            TG_API_SECONDS.labels(api_method).observe(time.perf_counter() - t0)
+
+def pool_stat(key: str) -> float:
+    if DB_POOL is None:
+        return 0.0
+    return float(DB_POOL.get_stats().get(key, 0))
+
+DB_POOL_SIZE.set_function(lambda: pool_stat("pool_size"))
+DB_POOL_AVAILABLE.set_function(lambda: pool_stat("pool_available"))
+DB_POOL_WAITING.set_function(lambda: pool_stat("requests_waiting"))
+WRITE_QUEUE_DEPTH.set_function(lambda: float(WRITER.depth()) if WRITER is not None else 0.0)
+
+def metrics_start() -> None:
+    if METRICS_PORT <= 0:
+        return
+    start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+    print("BOOT: metrics on", f"{METRICS_ADDR}:{METRICS_PORT}/metrics")
+
+# ==========================================================
+# ====================== ОТПРАВКА ==========================
+# Все вызовы Bot API с chat_id проходят через SendLimiter: сначала
+# лимит своего чата, потом общий лимит бота. Общую очередь первыми
+# проходят сообщения теста, последними — админка (статистика, экспорт).
+# ==========================================================
+SEND_PRIORITY_HIGH = 0      # ход теста: следующий вопрос, верно/неверно
+SEND_PRIORITY_NORMAL = 1    # меню, теория, лидеры
+SEND_PRIORITY_LOW = 2       # админка
+SEND_LANES = {SEND_PRIORITY_HIGH: "high", SEND_PRIORITY_NORMAL: "normal", SEND_PRIORITY_LOW: "low"}
+
+# приоритет текущего апдейта. При UPDATE_CONCURRENCY=1 PTB обрабатывает апдейты
+# прямо в задаче, которая их получает, поэтому значение выставляет on_any_update
+# (группа -1) заново для каждого апдейта — иначе приоритет протекал бы в следующий
+SEND_PRIORITY: ContextVar[int] = ContextVar("send_priority", default=SEND_PRIORITY_NORMAL)
+
+SEND_QUEUE_DEPTH = Gauge("quizbot_send_queue_depth", "Сообщений, ждущих отправки", ["lane"])
+SEND_WAIT_SECONDS = Histogram("quizbot_send_wait_seconds", "Ожидание в очереди отправки", ["lane"])
+SEND_RETRY_AFTER = Counter("quizbot_send_retry_after_total", "Ответы 429 (RetryAfter) от Telegram", ["method"])
+
+def send_priority(action: str) -> int:
+    if action in ("ans", "start_quiz", "quit"):
+        return SEND_PRIORITY_HIGH
+    if action.startswith("stats"):
+        return SEND_PRIORITY_LOW
+    return SEND_PRIORITY_NORMAL
+
+ADMIN_COMMANDS = ("/stats", "/reload", "/export")
+
+def update_priority(update: Update) -> int:
+    if update.callback_query is not None:
+        return send_priority(callback_action(update.callback_query.data or ""))
+    msg = update.effective_message
+    text = (msg.text or "") if msg is not None else ""
+    if text.startswith("/") and text.split(maxsplit=1)[0].split("@")[0] in ADMIN_COMMANDS:
+        return SEND_PRIORITY_LOW
+    return SEND_PRIORITY_NORMAL
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        need = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(need, self.paused_until - now)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def reserve(self) -> float:
+        # бронируем токен сразу (баланс может уйти в минус), ждём сколько скажут
+        wait = self.wait_time()
+        self.take()
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+class SendLimiter(BaseRateLimiter[Dict[str, int]]):
+    MAX_CHATS = 10000   # выше — выкидываем простаивающие бакеты чатов
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, max_retries: int):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = max(1, chat_burst)
+        self.max_retries = max_retries
+        self.chats: Dict[object, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = 0
+        self._pump: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.MAX_CHATS:
+                self.chats = {k: b for k, b in self.chats.items() if not b.idle()}
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _global_turn(self, priority: int) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, self._seq, fut))
+        self._seq += 1
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await fut
+
+    async def _run_pump(self) -> None:
+        # одна задача раздаёт токены общего бакета: всегда самому приоритетному
+        while self._waiters:
+            wait = self.global_bucket.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающего отменили
+                continue
+            self.global_bucket.take()
+            fut.set_result(None)
+
+    async def _acquire(self, chat_id, lane: str, priority: int) -> None:
+        t0 = time.monotonic()
+        SEND_QUEUE_DEPTH.labels(lane).inc()
+        try:
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._global_turn(priority)
+        finally:
+            SEND_QUEUE_DEPTH.labels(lane).dec()
+            SEND_WAIT_SECONDS.labels(lane).observe(time.monotonic() - t0)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # без chat_id (answerCallbackQuery, getMe, getUpdates...) — без очереди
+        chat_id = data.get("chat_id")
+        priority = (rate_limit_args or {}).get("priority", SEND_PRIORITY.get())
+        lane = SEND_LANES.get(priority, "normal")
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(chat_id, lane, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                SEND_RETRY_AFTER.labels(endpoint).inc()
+                delay = float(e.retry_after)
+                print("WARN: flood control:", endpoint, chat_id, "retry after", delay)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(delay)
+                else:
+                    await asyncio.sleep(delay)
 
 # ==========================================================
 # ====================== POSTGRES ==========================
 # ==========================================================
-def db_connect():
+DB_POOL: Optional[AsyncConnectionPool] = None
+# MULTI_WORKER: соединения, на которых держится advisory-лок пользователя, пока
+# обрабатывается его апдейт (по одному на апдейт — отдельно от DB_POOL, иначе
+# держатели локов могут выбрать весь пул и ждать сами себя)
+LOCK_POOL: Optional[AsyncConnectionPool] = None
+READ_POOL: Optional[AsyncConnectionPool] = None
+
+def db_pool_create() -> AsyncConnectionPool:
+    # пул создаётся в main(), а открывается уже внутри event loop (post_init)
+    global DB_POOL
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL не задан (Railway Variables).")
-    return psycopg.connect(DATABASE_URL, row_factory=dict_row)
-
-def db_init():
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                full_name TEXT,
-                first_seen_ts BIGINT NOT NULL,
-                last_seen_ts BIGINT NOT NULL
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id BIGSERIAL PRIMARY KEY,
-                ts BIGINT NOT NULL,
-                user_id BIGINT NOT NULL,
-                event_type TEXT NOT NULL,
-                payload_json TEXT
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS attempts (
-                id BIGSERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                started_ts BIGINT NOT NULL,
-                ended_ts BIGINT,
-                status TEXT NOT NULL, -- started|finished|quit
-                questions_per_run INT NOT NULL,
-                wrong_penalty_ms INT NOT NULL,
-                wrong_count INT NOT NULL DEFAULT 0,
-                penalty_ms INT NOT NULL DEFAULT 0,
-                elapsed_ms INT,
-                total_ms INT
+    DB_POOL = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        kwargs={"row_factory": dict_row},
+        check=AsyncConnectionPool.check_connection,   # проверка соединения перед выдачей
+        name="quiz-bot",
+        open=False,
+    )
+    if MULTI_WORKER:
+        global LOCK_POOL
+        LOCK_POOL = AsyncConnectionPool(
+            DATABASE_URL,
+            min_size=1,
+            max_size=UPDATE_CONCURRENCY,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            kwargs={"row_factory": dict_row, "autocommit": True},
+            name="quiz-bot-locks",
+            open=False,
+        )
+    if DATABASE_READ_URL:
+        global READ_POOL
+        READ_POOL = AsyncConnectionPool(
+            DATABASE_READ_URL,
+            min_size=1,
+            max_size=DB_READ_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            kwargs={
+                "row_factory": dict_row,
+                "autocommit": True,    # только чтение — транзакции не нужны
+                "options": "-c default_transaction_read_only=on",
+            },
+            check=AsyncConnectionPool.check_connection,
+            name="quiz-bot-read",
+            open=False,
+        )
+    return DB_POOL
+
+async def db_pool_open() -> None:
+    if DB_POOL is None:
+        raise RuntimeError("Пул соединений не создан (db_pool_create).")
+    await DB_POOL.open(wait=True, timeout=DB_POOL_TIMEOUT)
+    if LOCK_POOL is not None:
+        await LOCK_POOL.open(wait=True, timeout=DB_POOL_TIMEOUT)
+    if READ_POOL is not None:
+        # реплика не обязательна для старта: пул подключится в фоне
+        await READ_POOL.open(wait=False)
+
+async def db_pool_close() -> None:
+    global DB_POOL, _DB_READY
+    _DB_READY = False
+    if DB_POOL is not None:
+        await DB_POOL.close()
+        DB_POOL = None
+    global LOCK_POOL, READ_POOL
+    if LOCK_POOL is not None:
+        await LOCK_POOL.close()
+        LOCK_POOL = None
+    if READ_POOL is not None:
+        await READ_POOL.close()
+        READ_POOL = None
+    READ_ROUTER.reset()
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag_s
+"""
+
+DB_READ_LAG = Gauge("quizbot_db_read_lag_seconds", "Отставание реплики для аналитики (-1 — недоступна)")
+DB_READ_ROUTED = Counter("quizbot_db_read_routed_total", "Куда ушли запросы аналитики", ["target"])
+
+class ReadRouter:
+    # раз в DB_READ_CHECK_INTERVAL_S меряем отставание реплики и решаем, читать ли с неё
+    def __init__(self, max_lag_s: float, check_interval_s: float):
+        self.max_lag_s = max_lag_s
+        self.check_interval_s = check_interval_s
+        self.reset()
+
+    def reset(self) -> None:
+        self.healthy: Optional[bool] = None    # None — ещё не проверяли
+        self.checked = float("-inf")
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def replica_ok(self) -> bool:
+        if READ_POOL is None:
+            return False
+        if time.monotonic() - self.checked >= self.check_interval_s:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if time.monotonic() - self.checked >= self.check_interval_s:
+                    await self._check()
+        return bool(self.healthy)
+
+    async def _check(self) -> None:
+        try:
+            async with READ_POOL.connection(timeout=2) as con, con.cursor() as cur:
+                await cur.execute(REPLICA_LAG_SQL)
+                lag = float((await cur.fetchone())["lag_s"])
+        except Exception as e:
+            self._set(False, f"недоступна: {e!r}")
+            DB_READ_LAG.set(-1)
+            return
+        DB_READ_LAG.set(lag)
+        if lag > self.max_lag_s:
+            self._set(False, f"отстаёт на {lag:.1f} сек")
+        else:
+            self._set(True, f"отставание {lag:.1f} сек")
+
+    def _set(self, healthy: bool, why: str) -> None:
+        if healthy != self.healthy:
+            print("DB: read replica", "in use" if healthy else "skipped", "—", why)
+        self.healthy = healthy
+        self.checked = time.monotonic()
+
+    def failed(self, e: Exception) -> None:
+        self._set(False, f"ошибка соединения: {e!r}")
+
+READ_ROUTER = ReadRouter(DB_READ_MAX_LAG_S, DB_READ_CHECK_INTERVAL_S)
+
+@asynccontextmanager
+async def db_read_connect(statement_timeout_ms: Optional[int] = None):
+    # тяжёлые запросы админов: реплика, если она есть и не отстаёт, иначе основная база.
+    # Лимит времени запроса (по умолчанию DB_READ_STATEMENT_TIMEOUT_MS, 0 — без лимита)
+    # действует только на эту транзакцию
+    if statement_timeout_ms is None:
+        statement_timeout_ms = DB_READ_STATEMENT_TIMEOUT_MS
+    if await READ_ROUTER.replica_ok():
+        try:
+            con = await READ_POOL.getconn()
+        except Exception as e:
+            READ_ROUTER.failed(e)
+        else:
+            DB_READ_ROUTED.labels("replica").inc()
+            try:
+                async with con.transaction():
+                    await con.execute(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+                    yield con
+            finally:
+                await READ_POOL.putconn(con)
+            return
+
+    DB_READ_ROUTED.labels("primary").inc()
+    async with db_connect() as con:
+        await con.execute(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+        yield con
+
+def db_connect():
+    # соединение берётся из пула и возвращается в него при выходе из async with;
+    # все запросы неблокирующие, event loop не простаивает на ожидании Postgres
+    if DB_POOL is None:
+        raise RuntimeError("Пул соединений не открыт (db_pool_open).")
+    return DB_POOL.connection()
+
+# ==========================================================
+# ====================== МИГРАЦИИ ==========================
+# Новые изменения схемы — только новой записью в конец списка.
+# Применённые версии хранятся в schema_version.
+# ==========================================================
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "initial tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            first_seen_ts BIGINT NOT NULL,
+            last_seen_ts BIGINT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id BIGSERIAL PRIMARY KEY,
+            ts BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            event_type TEXT NOT NULL,
+            payload_json TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS attempts (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            started_ts BIGINT NOT NULL,
+            ended_ts BIGINT,
+            status TEXT NOT NULL, -- started|finished|quit|timeout|abandoned
+            questions_per_run INT NOT NULL,
+            wrong_penalty_ms INT NOT NULL,
+            wrong_count INT NOT NULL DEFAULT 0,
+            penalty_ms INT NOT NULL DEFAULT 0,
+            elapsed_ms INT,
+            total_ms INT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS answers (
+            id BIGSERIAL PRIMARY KEY,
+            attempt_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            ts BIGINT NOT NULL,
+            pos INT NOT NULL,
+            question_index INT NOT NULL,
+            option_index INT NOT NULL,
+            is_correct BOOLEAN NOT NULL,
+            penalty_ms_after INT NOT NULL,
+            total_ms_now INT NOT NULL
+        )
+        """,
+    ]),
+    (2, "indexes for leaderboard/stats", [
+        "CREATE INDEX IF NOT EXISTS attempts_user_id_idx ON attempts (user_id)",
+        "CREATE INDEX IF NOT EXISTS attempts_status_total_ms_idx ON attempts (status, total_ms)",
+        "CREATE INDEX IF NOT EXISTS answers_attempt_id_idx ON answers (attempt_id)",
+        "CREATE INDEX IF NOT EXISTS answers_question_index_idx ON answers (question_index)",
+        "CREATE INDEX IF NOT EXISTS events_user_id_idx ON events (user_id)",
+        "CREATE INDEX IF NOT EXISTS users_last_seen_ts_idx ON users (last_seen_ts DESC)",
+    ]),
+    (3, "best_scores for leaderboard", [
+        """
+        CREATE TABLE IF NOT EXISTS best_scores (
+            user_id BIGINT PRIMARY KEY,
+            best_total_ms INT NOT NULL,
+            attempt_id BIGINT NOT NULL,
+            achieved_ts BIGINT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS best_scores_best_total_ms_idx ON best_scores (best_total_ms, user_id)",
+        """
+        INSERT INTO best_scores(user_id, best_total_ms, attempt_id, achieved_ts)
+        SELECT DISTINCT ON (user_id) user_id, total_ms, id, COALESCE(ended_ts, started_ts)
+        FROM attempts
+        WHERE status='finished' AND total_ms IS NOT NULL
+        ORDER BY user_id, total_ms ASC, id ASC
+        ON CONFLICT (user_id) DO NOTHING
+        """,
+    ]),
+    (4, "persistent quiz sessions", [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_ts BIGINT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS attempts_started_idx ON attempts (started_ts) WHERE status='started'",
+    ]),
+    (5, "telegram file_id cache for photos", [
+        """
+        CREATE TABLE IF NOT EXISTS photo_cache (
+            photo_path TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_ts BIGINT NOT NULL
+        )
+        """,
+    ]),
+    (6, "per-question rolling stats", [
+        """
+        CREATE TABLE IF NOT EXISTS question_stats (
+            question_index INT PRIMARY KEY,
+            answers BIGINT NOT NULL DEFAULT 0,
+            wrongs BIGINT NOT NULL DEFAULT 0,
+            corrects BIGINT NOT NULL DEFAULT 0,
+            first_try_correct BIGINT NOT NULL DEFAULT 0,
+            ttc_count BIGINT NOT NULL DEFAULT 0,      -- сколько верных ответов с замером времени
+            ttc_sum_ms BIGINT NOT NULL DEFAULT 0      -- сумма времени от показа вопроса до верного ответа
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS question_stats_hourly (
+            question_index INT NOT NULL,
+            hour_ts BIGINT NOT NULL,
+            answers BIGINT NOT NULL DEFAULT 0,
+            wrongs BIGINT NOT NULL DEFAULT 0,
+            corrects BIGINT NOT NULL DEFAULT 0,
+            first_try_correct BIGINT NOT NULL DEFAULT 0,
+            ttc_count BIGINT NOT NULL DEFAULT 0,
+            ttc_sum_ms BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (question_index, hour_ts)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS question_stats_hourly_hour_ts_idx ON question_stats_hourly (hour_ts)",
+        """
+        INSERT INTO question_stats(question_index, answers, wrongs, corrects, first_try_correct)
+        SELECT a.question_index, COUNT(*),
+               COUNT(*) FILTER (WHERE NOT a.is_correct),
+               COUNT(*) FILTER (WHERE a.is_correct),
+               COUNT(*) FILTER (WHERE a.is_correct AND NOT EXISTS (
+                   SELECT 1 FROM answers w WHERE w.attempt_id=a.attempt_id AND w.pos=a.pos AND NOT w.is_correct))
+        FROM answers a
+        GROUP BY a.question_index
+        ON CONFLICT (question_index) DO NOTHING
+        """,
+        """
+        INSERT INTO question_stats_hourly(question_index, hour_ts, answers, wrongs, corrects, first_try_correct)
+        SELECT a.question_index, a.ts - a.ts % 3600, COUNT(*),
+               COUNT(*) FILTER (WHERE NOT a.is_correct),
+               COUNT(*) FILTER (WHERE a.is_correct),
+               COUNT(*) FILTER (WHERE a.is_correct AND NOT EXISTS (
+                   SELECT 1 FROM answers w WHERE w.attempt_id=a.attempt_id AND w.pos=a.pos AND NOT w.is_correct))
+        FROM answers a
+        GROUP BY a.question_index, a.ts - a.ts % 3600
+        ON CONFLICT (question_index, hour_ts) DO NOTHING
+        """,
+    ]),
+    (7, "partition events by day", [
+        "ALTER TABLE events RENAME TO events_legacy",
+        "ALTER INDEX events_pkey RENAME TO events_legacy_pkey",
+        "ALTER INDEX IF EXISTS events_user_id_idx RENAME TO events_legacy_user_id_idx",
+        """
+        CREATE TABLE events (
+            id BIGINT NOT NULL DEFAULT nextval('events_id_seq'),
+            ts BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            event_type TEXT NOT NULL,
+            payload_json TEXT,
+            PRIMARY KEY (id, ts)
+        ) PARTITION BY RANGE (ts)
+        """,
+        "CREATE TABLE events_default PARTITION OF events DEFAULT",
+        "CREATE INDEX events_user_id_idx ON events (user_id)",
+        """
+        CREATE OR REPLACE FUNCTION events_ensure_partitions(from_day DATE, to_day DATE) RETURNS void AS $$
+        DECLARE
+            d DATE := from_day;
+        BEGIN
+            WHILE d <= to_day LOOP
+                IF to_regclass('events_p' || to_char(d, 'YYYYMMDD')) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF events FOR VALUES FROM (%s) TO (%s)',
+                        'events_p' || to_char(d, 'YYYYMMDD'),
+                        extract(epoch FROM d::timestamp AT TIME ZONE 'UTC')::bigint,
+                        extract(epoch FROM (d + 1)::timestamp AT TIME ZONE 'UTC')::bigint
+                    );
+                END IF;
+                d := d + 1;
+            END LOOP;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        SELECT events_ensure_partitions(
+            COALESCE((SELECT (to_timestamp(MIN(ts)) AT TIME ZONE 'UTC')::date FROM events_legacy),
+                     (now() AT TIME ZONE 'UTC')::date),
+            (now() AT TIME ZONE 'UTC')::date + 7
+        )
+        """,
+        "INSERT INTO events(id, ts, user_id, event_type, payload_json) SELECT id, ts, user_id, event_type, payload_json FROM events_legacy",
+        "ALTER SEQUENCE events_id_seq OWNED BY events.id",
+        "DROP TABLE events_legacy",
+        """
+        CREATE TABLE IF NOT EXISTS events_daily (
+            day DATE NOT NULL,
+            event_type TEXT NOT NULL,
+            events BIGINT NOT NULL,
+            users BIGINT NOT NULL,
+            PRIMARY KEY (day, event_type)
+        )
+        """,
+    ]),
+    (8, "typed event payloads", [
+        """
+        ALTER TABLE events
+            ADD COLUMN IF NOT EXISTS payload JSONB,
+            ADD COLUMN IF NOT EXISTS attempt_id BIGINT,
+            ADD COLUMN IF NOT EXISTS q INT,
+            ADD COLUMN IF NOT EXISTS opt INT
+        """,
+        """
+        CREATE OR REPLACE FUNCTION try_jsonb(t TEXT) RETURNS JSONB AS $$
+        BEGIN
+            RETURN t::jsonb;
+        EXCEPTION WHEN others THEN
+            RETURN jsonb_build_object('raw', t);
+        END
+        $$ LANGUAGE plpgsql IMMUTABLE
+        """,
+        "UPDATE events SET payload = try_jsonb(payload_json) WHERE payload_json IS NOT NULL AND payload IS NULL",
+        """
+        UPDATE events SET
+            attempt_id = CASE WHEN jsonb_typeof(payload->'attempt_id')='number' THEN (payload->>'attempt_id')::bigint END,
+            q = CASE WHEN jsonb_typeof(payload->'q')='number' THEN (payload->>'q')::int END,
+            opt = CASE WHEN jsonb_typeof(payload->'opt')='number' THEN (payload->>'opt')::int END,
+            payload = NULLIF(payload - 'attempt_id' - 'q' - 'opt', '{}'::jsonb)
+        WHERE payload IS NOT NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS events_attempt_id_idx ON events (attempt_id) WHERE attempt_id IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS events_type_q_idx ON events (event_type, q) WHERE q IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS events_payload_idx ON events USING GIN (payload jsonb_path_ops)",
+    ]),
+    (9, "question stats per bank version", [
+        # индекс вопроса без версии банка после /reload указывает на другой вопрос;
+        # накопленные до миграции счётчики относятся к неизвестной версии — 'legacy'
+        "ALTER TABLE question_stats ADD COLUMN IF NOT EXISTS bank_version TEXT NOT NULL DEFAULT 'legacy'",
+        "ALTER TABLE question_stats ALTER COLUMN bank_version DROP DEFAULT",
+        "ALTER TABLE question_stats DROP CONSTRAINT question_stats_pkey",
+        "ALTER TABLE question_stats ADD PRIMARY KEY (bank_version, question_index)",
+        "ALTER TABLE question_stats_hourly ADD COLUMN IF NOT EXISTS bank_version TEXT NOT NULL DEFAULT 'legacy'",
+        "ALTER TABLE question_stats_hourly ALTER COLUMN bank_version DROP DEFAULT",
+        "ALTER TABLE question_stats_hourly DROP CONSTRAINT question_stats_hourly_pkey",
+        "ALTER TABLE question_stats_hourly ADD PRIMARY KEY (bank_version, question_index, hour_ts)",
+    ]),
+]
+
+# ключ advisory lock, чтобы два процесса не мигрировали одновременно
+MIGRATIONS_LOCK_KEY = 7_310_001
+
+@timed_db
+async def db_init():
+    async with db_connect() as con, con.cursor() as cur:
+        # CREATE TABLE IF NOT EXISTS тоже гоняется сам с собой: два процесса на пустой базе
+        # получают unique violation в pg_type, поэтому и его делаем под локом
+        await cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+        await cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_ts BIGINT NOT NULL
             )
         """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS answers (
-                id BIGSERIAL PRIMARY KEY,
-                attempt_id BIGINT NOT NULL,
-                user_id BIGINT NOT NULL,
-                ts BIGINT NOT NULL,
-                pos INT NOT NULL,
-                question_index INT NOT NULL,
-                option_index INT NOT NULL,
-                is_correct BOOLEAN NOT NULL,
-                penalty_ms_after INT NOT NULL,
-                total_ms_now INT NOT NULL
+        await con.commit()
+
+        for version, name, statements in MIGRATIONS:
+            await cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            await cur.execute("SELECT 1 FROM schema_version WHERE version=%s", (version,))
+            if await cur.fetchone() is not None:
+                await con.commit()
+                continue
+            for sql in statements:
+                await cur.execute(sql)
+            await cur.execute(
+                "INSERT INTO schema_version(version, name, applied_ts) VALUES(%s,%s,%s)",
+                (version, name, now_ts()),
             )
-        """)
-        con.commit()
+            await con.commit()
+            print(f"BOOT: migration {version} applied ({name})")
+
+_DB_READY = False
 
-def upsert_user(u) -> Tuple[int, Optional[str], Optional[str]]:
+async def db_startup() -> None:
+    # пул + миграции; persistence грузит сессии раньше post_init, поэтому вызов идемпотентен
+    global _DB_READY
+    if _DB_READY:
+        return
+    await db_pool_open()
+    print("BOOT: db_pool OK", f"(min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+    await db_init()
+    print("BOOT: db_init OK")
+    _DB_READY = True
+
+class UserTouchCache:
+    """LRU: user_id -> (username, full_name, last_seen_ts), последнее записанное в users."""
+
+    def __init__(self, max_size: int, granularity_s: int):
+        self.max_size = max(1, max_size)
+        self.granularity_s = granularity_s
+        self._items: "OrderedDict[int, Tuple[Optional[str], Optional[str], int]]" = OrderedDict()
+
+    def needs_write(self, uid: int, username: Optional[str], full_name: Optional[str], ts: int) -> bool:
+        cached = self._items.get(uid)
+        if cached is None:
+            return True
+        self._items.move_to_end(uid)
+        c_username, c_full_name, c_ts = cached
+        return c_username != username or c_full_name != full_name or ts - c_ts >= self.granularity_s
+
+    def remember(self, uid: int, username: Optional[str], full_name: Optional[str], ts: int) -> None:
+        self._items[uid] = (username, full_name, ts)
+        self._items.move_to_end(uid)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+USER_CACHE = UserTouchCache(USER_CACHE_SIZE, USER_TOUCH_GRANULARITY_S)
+
+USER_UPSERT_SQL = """
+    INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts)
+    VALUES(%(uid)s, %(username)s, %(full_name)s, %(ts)s, %(ts)s)
+    ON CONFLICT (user_id) DO UPDATE
+    SET username=EXCLUDED.username, full_name=EXCLUDED.full_name, last_seen_ts=EXCLUDED.last_seen_ts
+"""
+
+@timed_db
+async def upsert_user(u) -> Tuple[int, Optional[str], Optional[str]]:
     uid = int(u.id)
     username = u.username
     full_name = u.full_name
     ts = now_ts()
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("SELECT user_id FROM users WHERE user_id=%s", (uid,))
-        row = cur.fetchone()
-        if row is None:
-            cur.execute(
-                "INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts) VALUES(%s,%s,%s,%s,%s)",
-                (uid, username, full_name, ts, ts),
-            )
-        else:
-            cur.execute(
-                "UPDATE users SET username=%s, full_name=%s, last_seen_ts=%s WHERE user_id=%s",
-                (username, full_name, ts, uid),
-            )
-        con.commit()
+    if not USER_CACHE.needs_write(uid, username, full_name, ts):
+        return uid, username, full_name
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute(USER_UPSERT_SQL, {"uid": uid, "username": username, "full_name": full_name, "ts": ts})
+        await con.commit()
+    USER_CACHE.remember(uid, username, full_name, ts)
     return uid, username, full_name
 
-def log_event(user_id: int, event_type: str, payload_json: Optional[str] = None) -> None:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute(
-            "INSERT INTO events(ts, user_id, event_type, payload_json) VALUES(%s,%s,%s,%s)",
-            (now_ts(), user_id, event_type, payload_json),
-        )
-        con.commit()
+@timed_db
+async def log_event(user_id: int, event_type: str, **fields) -> None:
+    await writer().put("events", event_row(now_ts(), user_id, event_type, fields))
 
-def attempt_start(user_id: int) -> int:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute(
+@timed_db
+async def attempt_start(user_id: int) -> int:
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute(
             """
             INSERT INTO attempts(user_id, started_ts, status, questions_per_run, wrong_penalty_ms)
             VALUES(%s,%s,%s,%s,%s)
@@ -385,110 +1233,1011 @@ def attempt_start(user_id: int) -> int:
             """,
             (user_id, now_ts(), "started", QUESTIONS_PER_RUN, WRONG_PENALTY_MS),
         )
-        attempt_id = int(cur.fetchone()["id"])
-        con.commit()
+        attempt_id = int((await cur.fetchone())["id"])
+        await con.commit()
         return attempt_id
 
-def attempt_update_progress(attempt_id: int, wrong_count: int, penalty_ms: int) -> None:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("UPDATE attempts SET wrong_count=%s, penalty_ms=%s WHERE id=%s",
-                    (wrong_count, penalty_ms, attempt_id))
-        con.commit()
-
-def attempt_finish(attempt_id: int, status: str, elapsed_ms: int, penalty_ms: int, wrong_count: int) -> None:
+@timed_db
+async def attempt_finish(attempt_id: int, status: str, elapsed_ms: int, penalty_ms: int, wrong_count: int) -> None:
+    # закрываем попытку и, если это личный рекорд, обновляем best_scores тем же запросом
     total = elapsed_ms + penalty_ms
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute(
+    ts = now_ts()
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute(
             """
-            UPDATE attempts
-            SET ended_ts=%s, status=%s, elapsed_ms=%s, penalty_ms=%s, wrong_count=%s, total_ms=%s
-            WHERE id=%s
+            WITH fin AS (
+                UPDATE attempts
+                SET ended_ts=%(ts)s, status=%(status)s, elapsed_ms=%(elapsed)s, penalty_ms=%(penalty)s,
+                    wrong_count=%(wrong)s, total_ms=%(total)s
+                WHERE id=%(id)s AND status='started'   -- уже закрытую (timeout/abandoned) не переписываем
+                RETURNING user_id, status, total_ms
+            )
+            INSERT INTO best_scores(user_id, best_total_ms, attempt_id, achieved_ts)
+            SELECT user_id, total_ms, %(id)s, %(ts)s FROM fin WHERE status='finished'
+            ON CONFLICT (user_id) DO UPDATE
+            SET best_total_ms=EXCLUDED.best_total_ms, attempt_id=EXCLUDED.attempt_id, achieved_ts=EXCLUDED.achieved_ts
+            WHERE EXCLUDED.best_total_ms < best_scores.best_total_ms
+            RETURNING user_id, best_total_ms
             """,
-            (now_ts(), status, elapsed_ms, penalty_ms, wrong_count, total, attempt_id),
+            {"ts": ts, "status": status, "elapsed": elapsed_ms, "penalty": penalty_ms,
+             "wrong": wrong_count, "total": total, "id": attempt_id},
         )
-        con.commit()
+        best = await cur.fetchone()
+        await con.commit()
+    if best is not None:
+        LEADERBOARD_CACHE.note_best(int(best["user_id"]), int(best["best_total_ms"]))
+        await notify_workers("leaderboard")
+
+def _question_stats_upsert(table: str, keys: str, values: str) -> str:
+    # инкремент счётчиков вопроса (общих или почасовых) значениями из параметров record_answer
+    return f"""
+        INSERT INTO {table} AS s({keys}, answers, wrongs, corrects, first_try_correct, ttc_count, ttc_sum_ms)
+        VALUES({values}, 1, %(wrong_inc)s, %(correct_inc)s, %(first_try_inc)s, %(ttc_inc)s, %(ttc_ms)s)
+        ON CONFLICT ({keys}) DO UPDATE SET
+            answers=s.answers + 1,
+            wrongs=s.wrongs + EXCLUDED.wrongs,
+            corrects=s.corrects + EXCLUDED.corrects,
+            first_try_correct=s.first_try_correct + EXCLUDED.first_try_correct,
+            ttc_count=s.ttc_count + EXCLUDED.ttc_count,
+            ttc_sum_ms=s.ttc_sum_ms + EXCLUDED.ttc_sum_ms
+    """
+
+QUESTION_STATS_SQL = _question_stats_upsert("question_stats", "bank_version, question_index", "%(bank_version)s, %(q)s")
+QUESTION_STATS_HOURLY_SQL = _question_stats_upsert("question_stats_hourly", "bank_version, question_index, hour_ts",
+                                                   "%(bank_version)s, %(q)s, %(hour_ts)s")
+
+@timed_db
+async def record_answer(u, attempt_id: int, pos: int, question_index: int, option_index: int,
+                        is_correct: bool, wrong_count: int, penalty_ms_after: int, total_ms_now: int,
+                        bank_version: str, first_try: bool = False, time_to_correct_ms: Optional[int] = None) -> None:
+    # один клик по ответу = один запрос: касание пользователя, прогресс попытки,
+    # строка answers, счётчики вопроса и событие answer_clicked пишутся CTE в одной транзакции
+    ts = now_ts()
+    uid = int(u.id)
+    params = {
+        "uid": uid, "username": u.username, "full_name": u.full_name, "ts": ts,
+        "attempt_id": attempt_id, "pos": pos, "q": question_index, "opt": option_index,
+        "bank_version": bank_version, "is_correct": is_correct, "wrong_count": wrong_count, "penalty_ms": penalty_ms_after,
+        "total_ms": total_ms_now,
+        "hour_ts": ts - ts % 3600,
+        "wrong_inc": 0 if is_correct else 1,
+        "correct_inc": 1 if is_correct else 0,
+        "first_try_inc": 1 if is_correct and first_try else 0,
+        "ttc_inc": 1 if time_to_correct_ms is not None else 0,
+        "ttc_ms": time_to_correct_ms or 0,
+    }
+    touch = USER_CACHE.needs_write(uid, u.username, u.full_name, ts)
+    touch_cte = f"touch AS ({USER_UPSERT_SQL})," if touch else ""
+    async with db_connect() as con, con.cursor() as cur:
+        async with con.pipeline():   # BEGIN + запрос + COMMIT уходят одним пакетом
+            await cur.execute(
+                f"""
+                WITH {touch_cte}
+                progress AS (
+                    UPDATE attempts SET wrong_count=%(wrong_count)s, penalty_ms=%(penalty_ms)s
+                    WHERE id=%(attempt_id)s AND NOT %(is_correct)s
+                ),
+                answer AS (
+                    INSERT INTO answers(attempt_id, user_id, ts, pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now)
+                    VALUES(%(attempt_id)s, %(uid)s, %(ts)s, %(pos)s, %(q)s, %(opt)s, %(is_correct)s, %(penalty_ms)s, %(total_ms)s)
+                ),
+                qstats AS ({QUESTION_STATS_SQL}),
+                qstats_hourly AS ({QUESTION_STATS_HOURLY_SQL})
+                INSERT INTO events(ts, user_id, event_type, attempt_id, q, opt)
+                VALUES(%(ts)s, %(uid)s, 'answer_clicked', %(attempt_id)s, %(q)s, %(opt)s)
+                """,
+                params,
+            )
+            await con.commit()
+    if touch:
+        USER_CACHE.remember(uid, u.username, u.full_name, ts)
+
+@timed_db
+async def db_clear_all() -> None:
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute("TRUNCATE TABLE answers RESTART IDENTITY")
+        await cur.execute("TRUNCATE TABLE attempts RESTART IDENTITY")
+        await cur.execute("TRUNCATE TABLE events RESTART IDENTITY")
+        await cur.execute("TRUNCATE TABLE users RESTART IDENTITY")
+        await cur.execute("TRUNCATE TABLE best_scores")
+        await cur.execute("TRUNCATE TABLE question_stats")
+        await cur.execute("TRUNCATE TABLE question_stats_hourly")
+        await cur.execute("TRUNCATE TABLE events_daily")
+        await con.commit()
+    drop_local_caches()
+    await notify_workers("clear")
+
+# ==========================================================
+# ====================== СОБЫТИЯ ===========================
+# Каждый event_type объявлен здесь со своими полями. attempt_id/q/opt
+# пишутся в отдельные колонки (по ним есть индексы), остальное — в payload JSONB.
+# ==========================================================
+EVENT_TYPES: Dict[str, Dict[str, type]] = {
+    "menu_open": {},
+    "help_open": {},
+    "theory_open": {"page": int},
+    "leaderboard_open": {},
+    "quiz_start_clicked": {},
+    "quiz_quit_clicked": {},
+    "attempt_started": {"attempt_id": int},
+    "attempt_ended": {"attempt_id": int, "status": str, "wrong": int, "penalty_ms": int, "total_ms": int},
+    "answer_clicked": {"attempt_id": int, "q": int, "opt": int},
+    "callback": {"data": str},
+    "cmd_myid": {},
+    "cmd_stats": {},
+    "cmd_reload": {},
+    "cmd_export": {},
+}
+
+EVENT_HOT_FIELDS = ("attempt_id", "q", "opt")
+
+# один компактный JSON-энкодер на весь процесс (Jsonb для events и sessions)
+json_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+set_json_dumps(json_dumps)
+
+def event_row(ts: int, user_id: int, event_type: str, fields: dict) -> tuple:
+    schema = EVENT_TYPES.get(event_type)
+    if schema is None:
+        raise ValueError(f"неизвестный event_type: {event_type}")
+    unknown = set(fields) - set(schema)
+    if unknown:
+        raise ValueError(f"{event_type}: лишние поля {sorted(unknown)}")
+    for name, value in fields.items():
+        if value is not None and not isinstance(value, schema[name]):
+            raise TypeError(f"{event_type}.{name}: ожидается {schema[name].__name__}, получено {type(value).__name__}")
+
+    rest = {k: v for k, v in fields.items() if k not in EVENT_HOT_FIELDS and v is not None}
+    return (
+        ts, user_id, event_type,
+        Jsonb(rest) if rest else None,
+        fields.get("attempt_id"), fields.get("q"), fields.get("opt"),
+    )
 
-def log_answer(attempt_id: int, user_id: int, pos: int, question_index: int, option_index: int,
-               is_correct: bool, penalty_ms_after: int, total_ms_now: int) -> None:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute(
+# ==========================================================
+# ====================== БУФЕР ЗАПИСИ ======================
+# события не пишутся на пути запроса: строки копятся в очереди
+# и уходят в Postgres одним COPY каждые WRITE_FLUSH_ROWS строк / WRITE_FLUSH_MS мс
+# ==========================================================
+WRITE_COLUMNS = {
+    "events": ("ts", "user_id", "event_type", "payload", "attempt_id", "q", "opt"),
+}
+
+_WRITE_STOP = object()
+
+class WriteBehind:
+    def __init__(self, max_rows: int, flush_rows: int, flush_ms: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_rows)
+        self.flush_rows = max(1, flush_rows)
+        self.flush_s = max(1, flush_ms) / 1000.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def put(self, table: str, row: tuple) -> None:
+        # если очередь полна — ждём (backpressure), память не растёт без предела
+        await self.queue.put((table, row))
+
+    async def close(self) -> None:
+        # дописываем всё, что осталось в очереди, и останавливаемся
+        if self._task is None:
+            return
+        await self.queue.put(_WRITE_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            item = await self.queue.get()
+            if item is _WRITE_STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_s
+            while len(batch) < self.flush_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _WRITE_STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            with DB_SECONDS.labels("write_flush").time():
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[str, tuple]]) -> None:
+        by_table: dict = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+
+        for attempt in range(3):
+            try:
+                async with db_connect() as con, con.cursor() as cur:
+                    for table, rows in by_table.items():
+                        cols = ", ".join(WRITE_COLUMNS[table])
+                        async with cur.copy(f"COPY {table} ({cols}) FROM STDIN") as copy:
+                            for row in rows:
+                                await copy.write_row(row)
+                    await con.commit()
+                return
+            except Exception as e:
+                print("ERROR: write-behind flush:", repr(e))
+                await asyncio.sleep(0.5 * (attempt + 1))
+        print("ERROR: write-behind dropped rows:", len(batch))
+
+WRITER: Optional[WriteBehind] = None
+
+def writer() -> WriteBehind:
+    if WRITER is None:
+        raise RuntimeError("Буфер записи не запущен (post_init).")
+    return WRITER
+
+# ==========================================================
+# ====================== СЕССИИ ============================
+# context.user_data хранится в таблице sessions. PTB сам отмечает,
+# чьи данные менялись; сюда приходят только они, и пишутся
+# одной пачкой раз в SESSION_FLUSH_INTERVAL_S.
+# ==========================================================
+SESSION_KEYS = ("order", "pos", "t0", "penalty_ms", "wrong_count", "attempt_id", "wrong_opts", "bank_version",
+                "q_shown_at")
+
+class QuizSession(MutableMapping):
+    # context.user_data: ведёт себя как dict, но хранит только SESSION_KEYS в слотах —
+    # без __dict__ и хэш-таблицы на каждого пользователя
+    __slots__ = SESSION_KEYS
+
+    def __getitem__(self, key):
+        if key not in SESSION_KEYS:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in SESSION_KEYS:
+            raise KeyError(f"{key!r} не входит в SESSION_KEYS")
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in SESSION_KEYS:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return (k for k in SESSION_KEYS if hasattr(self, k))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"QuizSession({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        # копии списков: сохранённое состояние не должно меняться вместе с сессией
+        return {k: list(v) if isinstance(v, list) else v for k, v in self.items()}
+
+    def load(self, data: dict) -> None:
+        # заменить содержимое сохранённым состоянием (лишние ключи игнорируются)
+        self.clear()
+        for k in SESSION_KEYS:
+            if k in data:
+                self[k] = data[k]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuizSession":
+        session = cls()
+        session.load(data)
+        return session
+
+class PostgresPersistence(BasePersistence):
+    def __init__(self, update_interval: float):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._saved: dict = {}       # user_id -> последнее записанное состояние
+        self._pending: dict = {}     # user_id -> состояние к записи (None = удалить)
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get_user_data(self) -> dict:
+        await db_startup()
+        if MULTI_WORKER:
+            return {}   # сессии читаются по одной под локом пользователя (user_turn)
+        async with db_connect() as con, con.cursor() as cur:
+            await cur.execute("SELECT user_id, data FROM sessions")
+            rows = await cur.fetchall()
+        self._saved = {int(r["user_id"]): r["data"] for r in rows}
+        print("BOOT: sessions restored:", len(self._saved))
+        return {uid: QuizSession.from_dict(data) for uid, data in self._saved.items()}
+
+    async def update_user_data(self, user_id: int, data: QuizSession) -> None:
+        if MULTI_WORKER:
+            # сессию пишет write_now под локом пользователя; фоновый сброс снял бы копию
+            # посреди чужого хода и перетёр бы строку, которую уже обновил другой воркер
+            return
+        state = data.to_dict() or None
+        if self._saved.get(user_id) == state:
+            self._pending.pop(user_id, None)
+            return
+        self._pending[user_id] = state
+        await self._flush_soon()
+
+    async def write_now(self, cur, user_id: int, data: Optional[QuizSession]) -> None:
+        # MULTI_WORKER: запись сразу, на соединении с локом; updated_ts — время активности
+        state = data.to_dict() if data is not None else None
+        if state:
+            await cur.execute(
+                """
+                INSERT INTO sessions(user_id, data, updated_ts) VALUES(%s,%s,%s)
+                ON CONFLICT (user_id) DO UPDATE SET data=EXCLUDED.data, updated_ts=EXCLUDED.updated_ts
+                """,
+                (user_id, Jsonb(state), now_ts()),
+            )
+            self._saved[user_id] = state
+        else:
+            await cur.execute("DELETE FROM sessions WHERE user_id=%s", (user_id,))
+            self._saved.pop(user_id, None)
+        self._pending.pop(user_id, None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if MULTI_WORKER:
+            # строку sessions мог уже переписать другой воркер: забываем только локальную копию,
+            # брошенные попытки закрывает abandon_idle_sessions по updated_ts
+            self._saved.pop(user_id, None)
+            self._pending.pop(user_id, None)
+            return
+        if user_id in self._saved:
+            self._pending[user_id] = None
+            await self._flush_soon()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self._write_pending()
+
+    async def _flush_soon(self) -> None:
+        # update_persistence вызывает update_user_data пачкой через gather —
+        # все вызовы ждут одну общую запись
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+        await asyncio.shield(self._flush_task)
+
+    async def _write_pending(self) -> None:
+        await asyncio.sleep(0)
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            try:
+                with DB_SECONDS.labels("session_write").time():
+                    await self._write(pending)
+            except Exception:
+                # не теряем изменения: вернём их в очередь (более свежие не перетираем)
+                self._pending = {**pending, **self._pending}
+                raise
+            for uid, state in pending.items():
+                if state is None:
+                    self._saved.pop(uid, None)
+                else:
+                    self._saved[uid] = state
+
+    async def _write(self, pending: dict) -> None:
+        upserts = [(uid, Jsonb(state), now_ts()) for uid, state in pending.items() if state is not None]
+        deletes = [(uid,) for uid, state in pending.items() if state is None]
+        async with db_connect() as con, con.cursor() as cur:
+            if upserts:
+                await cur.executemany(
+                    """
+                    INSERT INTO sessions(user_id, data, updated_ts) VALUES(%s,%s,%s)
+                    ON CONFLICT (user_id) DO UPDATE SET data=EXCLUDED.data, updated_ts=EXCLUDED.updated_ts
+                    """,
+                    upserts,
+                )
+            if deletes:
+                await cur.executemany("DELETE FROM sessions WHERE user_id=%s", deletes)
+            await con.commit()
+
+    # остальное (chat/bot/callback/conversations) не храним
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+@timed_db
+async def reap_stale_attempts(app: Application) -> int:
+    # брошенные попытки (status='started' дольше ATTEMPT_TIMEOUT_S) закрываем как timeout
+    ts = now_ts()
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute(
+            """
+            WITH timed_out AS (
+                UPDATE attempts SET status='timeout', ended_ts=%(ts)s
+                WHERE status='started' AND started_ts < %(cutoff)s
+                RETURNING id, user_id
+            ), dropped AS (
+                -- сессия могла остаться только в БД (другой воркер, рестарт)
+                DELETE FROM sessions s USING timed_out t
+                WHERE s.user_id = t.user_id AND s.data->>'attempt_id' = t.id::text
+            )
+            SELECT id, user_id FROM timed_out
+            """,
+            {"ts": ts, "cutoff": ts - ATTEMPT_TIMEOUT_S},
+        )
+        rows = await cur.fetchall()
+        await con.commit()
+
+    for r in rows:
+        uid = int(r["user_id"])
+        # под локом пользователя: его апдейт мог как раз читать или менять сессию
+        async with USER_LOCKS.hold(uid):
+            ud = app.user_data.get(uid)
+            if ud is not None and ud.get("attempt_id") == int(r["id"]):
+                for k in SESSION_KEYS:
+                    ud.pop(k, None)
+                app.mark_data_for_update_persistence(user_ids=uid)
+    return len(rows)
+
+@timed_db
+async def prune_question_stats_hourly() -> None:
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute("DELETE FROM question_stats_hourly WHERE hour_ts < %s",
+                          (now_ts() - QUESTION_STATS_KEEP_DAYS * 86400,))
+        await con.commit()
+
+class SessionJanitor:
+    # когда пользователь последний раз присылал апдейт (от давних к свежим)
+    def __init__(self, idle_ttl_s: int, max_users: int):
+        self.idle_ttl_s = idle_ttl_s
+        self.max_users = max_users
+        self.seen: "OrderedDict[int, float]" = OrderedDict()
+        self._sweeping = False
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def touch(self, user_id: int) -> None:
+        self.seen[user_id] = time.time()
+        self.seen.move_to_end(user_id)
+
+    def forget(self, user_id: int) -> None:
+        self.seen.pop(user_id, None)
+
+    def over_limit(self) -> bool:
+        return len(self.seen) > self.max_users
+
+    def victims(self, user_ids) -> List[Tuple[int, float]]:
+        # сессии, восстановленные из БД, ещё не отмечены — считаем, что их видели сейчас
+        now = time.time()
+        for uid in user_ids:
+            if uid not in self.seen:
+                self.seen[uid] = now
+        cutoff = now - self.idle_ttl_s
+        excess = len(self.seen) - self.max_users
+        out = []
+        for uid, ts in self.seen.items():
+            if ts >= cutoff and len(out) >= excess:
+                break
+            out.append((uid, ts))
+        return out
+
+    def kick(self, app: Application) -> None:
+        # внеочередная уборка из обработчика апдейта: одна задача за раз, ошибки — в лог
+        if self._sweep_task is not None and not self._sweep_task.done():
+            return
+        self._sweep_task = asyncio.create_task(self.sweep(app))
+        self._sweep_task.add_done_callback(self._sweep_done)
+
+    @staticmethod
+    def _sweep_done(task: "asyncio.Task") -> None:
+        if not task.cancelled() and task.exception() is not None:
+            print("ERROR: session sweep:", repr(task.exception()))
+
+    async def sweep(self, app: Application) -> Tuple[int, int]:
+        if self._sweeping:
+            return 0, 0
+        self._sweeping = True
+        try:
+            return await evict_sessions(app, self.victims(list(app.user_data.keys())))
+        finally:
+            self._sweeping = False
+
+SESSIONS = SessionJanitor(SESSION_IDLE_TTL_S, SESSION_MAX_USERS)
+
+async def abandon_attempt(user_id: int, ud: QuizSession) -> bool:
+    attempt_id = ud.get("attempt_id")
+    if attempt_id is None:
+        return False
+    wrong = int(ud.get("wrong_count", 0))
+    penalty = int(ud.get("penalty_ms", 0))
+    elapsed = int((time.time() - float(ud.get("t0", time.time()))) * 1000)
+    await attempt_finish(int(attempt_id), status="abandoned", elapsed_ms=elapsed, penalty_ms=penalty, wrong_count=wrong)
+    await log_event(user_id, "attempt_ended", attempt_id=int(attempt_id), status="abandoned",
+                    wrong=wrong, penalty_ms=penalty, total_ms=elapsed + penalty)
+    return True
+
+async def evict_sessions(app: Application, victims: List[Tuple[int, float]]) -> Tuple[int, int]:
+    # выселяем из памяти (и из sessions): незаконченную попытку закрываем как abandoned
+    dropped = abandoned = 0
+    for uid, ts in victims:
+        async with USER_LOCKS.hold(uid):
+            if SESSIONS.seen.get(uid) != ts:
+                continue  # пока ждали лок, пользователь снова что-то нажал
+            # MULTI_WORKER: пользователь мог продолжить на другом воркере — попытку не закрываем,
+            # а drop_user_data в PostgresPersistence не трогает строку sessions
+            ud = app.user_data.get(uid)
+            if not MULTI_WORKER and ud is not None and await abandon_attempt(uid, ud):
+                abandoned += 1
+            app.drop_user_data(uid)
+            SESSIONS.forget(uid)
+            dropped += 1
+    return dropped, abandoned
+
+async def on_any_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # группа -1: видит каждый апдейт раньше основных обработчиков
+    SEND_PRIORITY.set(update_priority(update))
+    u = update.effective_user
+    if u is None:
+        return
+    SESSIONS.touch(int(u.id))
+    if SESSIONS.over_limit():
+        SESSIONS.kick(context.application)
+
+async def session_janitor_loop(app: Application) -> None:
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_S)
+        try:
+            dropped, abandoned = await SESSIONS.sweep(app)
+            if dropped:
+                print("SESSIONS: evicted:", dropped, "abandoned attempts:", abandoned, "in memory:", len(app.user_data))
+        except Exception as e:
+            print("ERROR: session janitor:", repr(e))
+
+async def reaper_loop(app: Application) -> None:
+    while True:
+        try:
+            n = await reap_stale_attempts(app)
+            if n:
+                print("REAPER: attempts timed out:", n)
+            if MULTI_WORKER:
+                n = await abandon_idle_sessions()
+                if n:
+                    print("REAPER: idle attempts abandoned:", n)
+            await prune_question_stats_hourly()
+        except Exception as e:
+            print("ERROR: reaper:", repr(e))
+        await asyncio.sleep(REAPER_INTERVAL_S)
+
+# ==========================================================
+# ====================== НЕСКОЛЬКО ВОРКЕРОВ ================
+# MULTI_WORKER=1: апдейты одного пользователя могут прийти в любой процесс.
+# Пока апдейт обрабатывается, процесс держит advisory-лок пользователя,
+# перед обработкой перечитывает его сессию из sessions, после — сразу пишет.
+# Локальные кэши (лидеры, сводка, касания, банк) сбрасываются по NOTIFY.
+# ==========================================================
+USER_LOCK_CLASS = 7_310_003     # первый ключ двухключевого advisory-лока, второй — user_id
+CACHE_CHANNEL = "quizbot_cache"
+
+def user_lock_key(user_id: int) -> Tuple[int, int]:
+    # второй ключ — int4; совпадение у двух пользователей лишь сериализует их апдейты
+    return USER_LOCK_CLASS, user_id % 2147483647
+
+@asynccontextmanager
+async def user_turn(app: Application, user_id: int):
+    # очередь апдейтов пользователя: в процессе — asyncio-лок, между процессами — advisory-лок
+    async with USER_LOCKS.hold(user_id):
+        if not MULTI_WORKER:
+            yield
+            return
+        key = user_lock_key(user_id)
+        async with LOCK_POOL.connection() as con, con.cursor() as cur:
+            await cur.execute("SELECT pg_advisory_lock(%s, %s)", key)
+            try:
+                await cur.execute("SELECT data FROM sessions WHERE user_id=%s", (user_id,))
+                row = await cur.fetchone()
+                app.user_data[user_id].load(row["data"] if row else {})
+                yield
+                await app.persistence.write_now(cur, user_id, app.user_data.get(user_id))
+            finally:
+                await cur.execute("SELECT pg_advisory_unlock(%s, %s)", key)
+
+@timed_db
+async def abandon_idle_sessions() -> int:
+    # MULTI_WORKER: брошенные попытки закрываем по общему времени активности (sessions.updated_ts);
+    # занятых прямо сейчас пользователей (лок у воркера) пропускаем
+    ts = now_ts()
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute(
             """
-            INSERT INTO answers(attempt_id, user_id, ts, pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now)
-            VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            WITH idle AS (
+                DELETE FROM sessions
+                WHERE updated_ts < %(cutoff)s
+                  AND pg_try_advisory_xact_lock(%(lock_class)s, (user_id %% 2147483647)::int)
+                RETURNING user_id, data
+            ), fin AS (
+                UPDATE attempts a
+                SET status='abandoned', ended_ts=%(ts)s,
+                    elapsed_ms=GREATEST(0, (%(ts)s - (i.data->>'t0')::float8) * 1000)::int,
+                    penalty_ms=COALESCE((i.data->>'penalty_ms')::int, 0),
+                    wrong_count=COALESCE((i.data->>'wrong_count')::int, 0),
+                    total_ms=GREATEST(0, (%(ts)s - (i.data->>'t0')::float8) * 1000)::int
+                             + COALESCE((i.data->>'penalty_ms')::int, 0)
+                FROM idle i
+                WHERE a.id = (i.data->>'attempt_id')::bigint AND a.status='started'
+                RETURNING a.id, a.user_id, a.wrong_count, a.penalty_ms, a.total_ms
+            )
+            INSERT INTO events(ts, user_id, event_type, attempt_id, payload)
+            SELECT %(ts)s, user_id, 'attempt_ended', id,
+                   jsonb_build_object('status', 'abandoned', 'wrong', wrong_count,
+                                      'penalty_ms', penalty_ms, 'total_ms', total_ms)
+            FROM fin
             """,
-            (attempt_id, user_id, now_ts(), pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now),
+            {"ts": ts, "cutoff": ts - SESSION_IDLE_TTL_S, "lock_class": USER_LOCK_CLASS},
         )
-        con.commit()
+        n = cur.rowcount
+        await con.commit()
+    return max(n, 0)
+
+def drop_local_caches() -> None:
+    USER_CACHE.clear()
+    LEADERBOARD_CACHE.invalidate()
+    _OVERVIEW_CACHE["text"] = None
+
+async def notify_workers(kind: str, **fields) -> None:
+    if not MULTI_WORKER:
+        return
+    payload = json_dumps({"kind": kind, "worker": WORKER_ID, **fields})
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, payload))
+        await con.commit()
+
+async def on_cache_notify(app: Application, payload: str) -> None:
+    msg = json.loads(payload)
+    if msg.get("worker") == WORKER_ID:
+        return
+    kind = msg.get("kind")
+    if kind == "leaderboard":
+        LEADERBOARD_CACHE.invalidate()
+    elif kind == "clear":
+        drop_local_caches()
+    elif kind == "bank" and QUESTION_BANK_PATH and msg.get("version") != CONTENT.version:
+        store = await asyncio.to_thread(load_bank, QUESTION_BANK_PATH)
+        if store.version != msg.get("version"):
+            print("WARN: bank reload from", msg.get("worker"), "->", msg.get("version"), "but local file is", store.version)
+            return
+        old_version = CONTENT.version
+        install_bank(store)
+        await prune_banks(app, keep=old_version)
+        print("BANK: reloaded by", msg.get("worker"), "->", store.version)
+
+async def cache_listener_loop(app: Application) -> None:
+    # отдельное соединение вне пула: LISTEN живёт, пока живо соединение
+    while True:
+        try:
+            async with await AsyncConnection.connect(DATABASE_URL, autocommit=True) as con:
+                await con.execute(f"LISTEN {CACHE_CHANNEL}")
+                drop_local_caches()   # пока не слушали, уведомления могли потеряться
+                async for n in con.notifies():
+                    try:
+                        await on_cache_notify(app, n.payload)
+                    except Exception as e:
+                        print("ERROR: cache notify:", repr(e), n.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("ERROR: cache listener:", repr(e))
+            await asyncio.sleep(5)
+
+# ==========================================================
+# ====================== ХРАНЕНИЕ СОБЫТИЙ ==================
+# events разбита на дневные партиции events_pYYYYMMDD (UTC).
+# Партиции создаются заранее; истёкшие сворачиваются в events_daily
+# (день, тип, число событий, число пользователей) и удаляются целиком.
+# ==========================================================
+EVENTS_MAINTENANCE_LOCK_KEY = 7_310_002
+
+EVENTS_ROLLUP_SQL = """
+    INSERT INTO events_daily(day, event_type, events, users)
+    SELECT (to_timestamp(ts) AT TIME ZONE 'UTC')::date, event_type, COUNT(*), COUNT(DISTINCT user_id)
+    FROM {source}
+    WHERE ts < %(cutoff)s
+    GROUP BY 1, 2
+    ON CONFLICT (day, event_type) DO UPDATE
+    SET events=events_daily.events + EXCLUDED.events, users=events_daily.users + EXCLUDED.users
+"""
+
+@timed_db
+async def events_maintenance() -> Tuple[int, int]:
+    today = datetime.fromtimestamp(now_ts(), timezone.utc).date()
+    cutoff_day = today - timedelta(days=EVENTS_RETENTION_DAYS)
+    cutoff_ts = calendar.timegm(cutoff_day.timetuple())
+    today_ts = calendar.timegm(today.timetuple())
+    ahead_end_ts = calendar.timegm((today + timedelta(days=EVENTS_PARTITIONS_AHEAD_DAYS + 1)).timetuple())
+    dropped = 0
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute("SELECT pg_advisory_xact_lock(%s)", (EVENTS_MAINTENANCE_LOCK_KEY,))
+        # строки за дни без партиции лежат в default, и Postgres не создаст партицию,
+        # пока они там: на время создания переносим их во временную таблицу
+        await cur.execute("SELECT 1 FROM events_default WHERE ts >= %s AND ts < %s LIMIT 1",
+                          (today_ts, ahead_end_ts))
+        stranded = await cur.fetchone() is not None
+        if stranded:
+            await cur.execute("CREATE TEMP TABLE events_stranded (LIKE events) ON COMMIT DROP")
+            await cur.execute("""
+                WITH moved AS (DELETE FROM events_default WHERE ts >= %s AND ts < %s RETURNING *)
+                INSERT INTO events_stranded SELECT * FROM moved
+            """, (today_ts, ahead_end_ts))
+        await cur.execute("SELECT events_ensure_partitions(%s, %s)",
+                          (today, today + timedelta(days=EVENTS_PARTITIONS_AHEAD_DAYS)))
+        if stranded:
+            await cur.execute("INSERT INTO events SELECT * FROM events_stranded")
+        await cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'events'::regclass AND c.relname LIKE 'events_p%'
+        """)
+        expired = []
+        for r in await cur.fetchall():
+            try:
+                day = datetime.strptime(r["relname"][len("events_p"):], "%Y%m%d").date()
+            except ValueError:
+                continue
+            if day < cutoff_day:
+                expired.append(r["relname"])
+
+        for name in sorted(expired):
+            await cur.execute(EVENTS_ROLLUP_SQL.format(source=name), {"cutoff": cutoff_ts})
+            await cur.execute(f"DROP TABLE {name}")
+            dropped += 1
+
+        # в default попадает только то, что не легло в дневные партиции
+        await cur.execute(EVENTS_ROLLUP_SQL.format(source="events_default"), {"cutoff": cutoff_ts})
+        await cur.execute("DELETE FROM events_default WHERE ts < %s", (cutoff_ts,))
+        purged = cur.rowcount
+        await con.commit()
+    return dropped, purged
+
+async def events_maintenance_loop() -> None:
+    while True:
+        try:
+            dropped, purged = await events_maintenance()
+            if dropped or purged:
+                print("EVENTS: partitions rolled up and dropped:", dropped, "default rows purged:", purged)
+        except Exception as e:
+            print("ERROR: events maintenance:", repr(e))
+        await asyncio.sleep(EVENTS_MAINTENANCE_INTERVAL_S)
+
+# ==========================================================
+# ====================== КАРТИНКИ ==========================
+# photo_path + sha256 содержимого -> file_id в Telegram
+# ==========================================================
+_PHOTO_HASHES: dict = {}   # path -> ((mtime_ns, size), sha256)
+
+def photo_hash(path: str) -> str:
+    # хэш пересчитывается только если поменялись mtime/размер файла
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _PHOTO_HASHES.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _PHOTO_HASHES[path] = (key, digest)
+    return digest
+
+class PhotoCache:
+    def __init__(self):
+        self._items: dict = {}   # path -> (content_hash, file_id)
+
+    async def load(self) -> None:
+        async with db_connect() as con, con.cursor() as cur:
+            await cur.execute("SELECT photo_path, content_hash, file_id FROM photo_cache")
+            rows = await cur.fetchall()
+        self._items = {r["photo_path"]: (r["content_hash"], r["file_id"]) for r in rows}
+
+    def get(self, path: str, content_hash: str) -> Optional[str]:
+        cached = self._items.get(path)
+        if cached is None or cached[0] != content_hash:
+            return None
+        return cached[1]
+
+    async def put(self, path: str, content_hash: str, file_id: str) -> None:
+        self._items[path] = (content_hash, file_id)
+        async with db_connect() as con, con.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO photo_cache(photo_path, content_hash, file_id, updated_ts) VALUES(%s,%s,%s,%s)
+                ON CONFLICT (photo_path) DO UPDATE
+                SET content_hash=EXCLUDED.content_hash, file_id=EXCLUDED.file_id, updated_ts=EXCLUDED.updated_ts
+                """,
+                (path, content_hash, file_id, now_ts()),
+            )
+            await con.commit()
+
+    def forget(self, path: str) -> None:
+        self._items.pop(path, None)
 
-def db_clear_all() -> None:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("TRUNCATE TABLE answers RESTART IDENTITY")
-        cur.execute("TRUNCATE TABLE attempts RESTART IDENTITY")
-        cur.execute("TRUNCATE TABLE events RESTART IDENTITY")
-        cur.execute("TRUNCATE TABLE users RESTART IDENTITY")
-        con.commit()
+PHOTO_CACHE = PhotoCache()
 
 # ==========================================================
 # ====================== ЛИДЕРЫ ============================
-# Лучший total_ms по пользователю
+# Лучший total_ms по пользователю хранится в best_scores
+# (обновляется в attempt_finish), готовый текст — в памяти
 # ==========================================================
-def leaderboard_top(limit: int = 10) -> List[Tuple[str, int]]:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("""
-            SELECT COALESCE(u.username, u.full_name, u.user_id::text) AS name,
-                   MIN(a.total_ms) AS best_total
-            FROM attempts a
-            JOIN users u ON u.user_id = a.user_id
-            WHERE a.status='finished' AND a.total_ms IS NOT NULL
-            GROUP BY a.user_id, name
-            ORDER BY best_total ASC
+@timed_db
+async def leaderboard_top(limit: int = 10) -> List[Tuple[int, str, int]]:
+    async with db_connect() as con, con.cursor() as cur:
+        await cur.execute("""
+            SELECT b.user_id,
+                   COALESCE(u.username, u.full_name, u.user_id::text) AS name,
+                   b.best_total_ms
+            FROM best_scores b
+            JOIN users u ON u.user_id = b.user_id
+            ORDER BY b.best_total_ms ASC, b.user_id ASC
             LIMIT %s
         """, (limit,))
-        rows = cur.fetchall()
-    return [(r["name"], int(r["best_total"])) for r in rows]
+        rows = await cur.fetchall()
+    return [(int(r["user_id"]), r["name"], int(r["best_total_ms"])) for r in rows]
+
+def render_leaderboard(rows: List[Tuple[int, str, int]]) -> Optional[str]:
+    if not rows:
+        return None
+    lines = ["Лидеры (лучшее итоговое время):"]
+    for i, (_, name, ms) in enumerate(rows, 1):
+        lines.append(f"{i}. {name} — {fmt_ms(ms)}")
+    return "\n".join(lines)
+
+class LeaderboardCache:
+    """Топ-N и его текст; сбрасывается, только когда новый рекорд меняет топ."""
+
+    def __init__(self, size: int, ttl_s: int):
+        self.size = size
+        self.ttl_s = ttl_s
+        self._rows: Optional[List[Tuple[int, str, int]]] = None
+        self._text: Optional[str] = None
+        self._ts = 0.0
+
+    async def text(self) -> Optional[str]:
+        if self._rows is None or time.monotonic() - self._ts > self.ttl_s:
+            self._rows = await leaderboard_top(self.size)
+            self._text = render_leaderboard(self._rows)
+            self._ts = time.monotonic()
+        return self._text
+
+    def note_best(self, user_id: int, best_ms: int) -> None:
+        rows = self._rows
+        if rows is None:
+            return
+        if len(rows) < self.size or best_ms <= rows[-1][2] or any(r[0] == user_id for r in rows):
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        self._rows = None
+        self._text = None
+
+LEADERBOARD_CACHE = LeaderboardCache(LEADERBOARD_SIZE, LEADERBOARD_CACHE_TTL_S)
 
 # ==========================================================
 # ====================== STATS (ADMIN) =====================
 # ==========================================================
-def stats_overview_text() -> str:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("SELECT COUNT(*) AS c FROM users")
-        users = int(cur.fetchone()["c"])
-        cur.execute("SELECT COUNT(*) AS c FROM attempts")
-        attempts = int(cur.fetchone()["c"])
-        cur.execute("SELECT COUNT(*) AS c FROM attempts WHERE status='finished'")
-        finished = int(cur.fetchone()["c"])
-        cur.execute("SELECT COUNT(*) AS c FROM attempts WHERE status='quit'")
-        quits = int(cur.fetchone()["c"])
-        cur.execute("SELECT AVG(total_ms) AS a FROM attempts WHERE status='finished' AND total_ms IS NOT NULL")
-        avg_total = cur.fetchone()["a"]
-        cur.execute("SELECT AVG(wrong_count) AS a FROM attempts WHERE status='finished'")
-        avg_wrong = cur.fetchone()["a"]
-
-    avg_total_s = fmt_ms(int(avg_total)) if avg_total is not None else "—"
-    avg_wrong_s = f"{float(avg_wrong):.2f}" if avg_wrong is not None else "—"
+_OVERVIEW_CACHE: dict = {"ts": 0.0, "text": None}
+
+@timed_db
+async def stats_overview_row() -> dict:
+    # один проход по attempts (FILTER вместо отдельных COUNT/AVG)
+    async with db_read_connect() as con, con.cursor() as cur:
+        await cur.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM users) AS users,
+                COUNT(*) AS attempts,
+                COUNT(*) FILTER (WHERE status='finished') AS finished,
+                COUNT(*) FILTER (WHERE status='quit') AS quits,
+                COUNT(*) FILTER (WHERE status='timeout') AS timeouts,
+                COUNT(*) FILTER (WHERE status='abandoned') AS abandoned,
+                AVG(total_ms) FILTER (WHERE status='finished' AND total_ms IS NOT NULL) AS avg_total,
+                AVG(wrong_count) FILTER (WHERE status='finished') AS avg_wrong,
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY total_ms)
+                    FILTER (WHERE status='finished' AND total_ms IS NOT NULL) AS p50_total,
+                percentile_cont(0.95) WITHIN GROUP (ORDER BY total_ms)
+                    FILTER (WHERE status='finished' AND total_ms IS NOT NULL) AS p95_total,
+                COUNT(*) FILTER (WHERE started_ts >= %s) AS attempts_24h,
+                MIN(started_ts) AS first_started_ts
+            FROM attempts
+        """, (now_ts() - 86400,))
+        return await cur.fetchone()
+
+async def stats_overview_text() -> str:
+    # результат общий для всех админов, пока не истёк OVERVIEW_CACHE_TTL_S
+    cached = _OVERVIEW_CACHE["text"]
+    if cached is not None and time.monotonic() - _OVERVIEW_CACHE["ts"] < OVERVIEW_CACHE_TTL_S:
+        return cached
+
+    r = await stats_overview_row()
+    users = int(r["users"])
+    attempts = int(r["attempts"])
+    finished = int(r["finished"])
+
+    def ms_or_dash(v) -> str:
+        return fmt_ms(int(v)) if v is not None else "—"
+
+    avg_wrong_s = f"{float(r['avg_wrong']):.2f}" if r["avg_wrong"] is not None else "—"
+    completion_s = f"{100.0 * finished / attempts:.1f}%" if attempts else "—"
+    if r["first_started_ts"] is not None:
+        days = max(1.0, (now_ts() - int(r["first_started_ts"])) / 86400)
+        per_day_s = f"{attempts / days:.1f}"
+    else:
+        per_day_s = "—"
 
-    return (
+    text = (
         "Сводка\n\n"
         f"Пользователей: {users}\n"
         f"Попыток: {attempts}\n"
         f"Завершили: {finished}\n"
-        f"Сдались: {quits}\n"
-        f"Среднее итоговое время: {avg_total_s}\n"
+        f"Сдались: {int(r['quits'])}\n"
+        f"Брошены (timeout): {int(r['timeouts'])}\n"
+        f"Брошены (простой): {int(r['abandoned'])}\n"
+        f"Доля завершивших: {completion_s}\n"
+        f"Среднее итоговое время: {ms_or_dash(r['avg_total'])}\n"
+        f"Медиана (p50): {ms_or_dash(r['p50_total'])}, p95: {ms_or_dash(r['p95_total'])}\n"
         f"Среднее ошибок: {avg_wrong_s}\n"
+        f"Попыток в день: {per_day_s} (за 24ч: {int(r['attempts_24h'])})\n"
         f"Вопросов за тест: {QUESTIONS_PER_RUN}\n"
         f"Штраф за ошибку: {WRONG_PENALTY_MS/1000:.0f} сек\n"
     )
-
-def stats_users_text(limit: int = 20) -> str:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("""
+    _OVERVIEW_CACHE["text"] = text
+    _OVERVIEW_CACHE["ts"] = time.monotonic()
+    return text
+
+@timed_db
+async def stats_users_text(limit: int = 20) -> str:
+    async with db_read_connect() as con, con.cursor() as cur:
+        await cur.execute("""
             SELECT COALESCE(username, full_name, user_id::text) AS name, last_seen_ts
             FROM users
             ORDER BY last_seen_ts DESC
             LIMIT %s
         """, (limit,))
-        rows = cur.fetchall()
+        rows = await cur.fetchall()
 
     lines = [f"Пользователи (последние {limit})"]
     for r in rows:
@@ -496,9 +2245,10 @@ def stats_users_text(limit: int = 20) -> str:
         lines.append(f"- {r['name']} (last: {last_s})")
     return "\n".join(lines)
 
-def stats_attempts_text(limit: int = 20) -> str:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("""
+@timed_db
+async def stats_attempts_text(limit: int = 20) -> str:
+    async with db_read_connect() as con, con.cursor() as cur:
+        await cur.execute("""
             SELECT a.id,
                    COALESCE(u.username, u.full_name, u.user_id::text) AS name,
                    a.status, a.total_ms, a.wrong_count, a.penalty_ms
@@ -507,7 +2257,7 @@ def stats_attempts_text(limit: int = 20) -> str:
             ORDER BY a.id DESC
             LIMIT %s
         """, (limit,))
-        rows = cur.fetchall()
+        rows = await cur.fetchall()
 
     lines = [f"Попытки (последние {limit})"]
     for r in rows:
@@ -515,32 +2265,53 @@ def stats_attempts_text(limit: int = 20) -> str:
         lines.append(f"- #{r['id']} {r['name']} — {r['status']} — {total} — wrong:{r['wrong_count']} penalty:{fmt_ms(int(r['penalty_ms']))}")
     return "\n".join(lines)
 
-def stats_hard_text(limit: int = 10) -> str:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("""
-            SELECT question_index,
-                   SUM(CASE WHEN is_correct=false THEN 1 ELSE 0 END) AS wrongs,
-                   COUNT(*) AS total
-            FROM answers
-            GROUP BY question_index
-            ORDER BY wrongs DESC, total DESC
-            LIMIT %s
-        """, (limit,))
-        rows = cur.fetchall()
+@timed_db
+async def stats_hard_text(limit: int = 10, window_s: Optional[int] = None, label: str = "") -> str:
+    # счётчики ведёт record_answer; окно (24ч/7д) — сумма почасовых строк, сырые answers не читаем.
+    # Показываем текущий банк: индексы других версий означают другие вопросы
+    content = CONTENT
+    async with db_read_connect() as con, con.cursor() as cur:
+        if window_s is None:
+            await cur.execute("""
+                SELECT question_index, answers, wrongs, first_try_correct, corrects, ttc_count, ttc_sum_ms
+                FROM question_stats
+                WHERE bank_version = %s
+                ORDER BY wrongs DESC, answers DESC
+                LIMIT %s
+            """, (content.version, limit))
+        else:
+            await cur.execute("""
+                SELECT question_index,
+                       SUM(answers) AS answers, SUM(wrongs) AS wrongs, SUM(first_try_correct) AS first_try_correct,
+                       SUM(corrects) AS corrects, SUM(ttc_count) AS ttc_count, SUM(ttc_sum_ms) AS ttc_sum_ms
+                FROM question_stats_hourly
+                WHERE bank_version = %s AND hour_ts >= %s
+                GROUP BY question_index
+                ORDER BY wrongs DESC, answers DESC
+                LIMIT %s
+            """, (content.version, now_ts() - window_s, limit))
+        rows = await cur.fetchall()
 
     if not rows:
-        return "Сложные вопросы\n\nПока нет данных (нужно, чтобы кто-то отвечал)."
+        return f"Сложные вопросы{label}\n\nПока нет данных по банку {content.version} (нужно, чтобы кто-то отвечал)."
 
-    lines = ["Сложные вопросы (по ошибкам):"]
+    lines = [f"Сложные вопросы{label} (по ошибкам), банк {content.version}:"]
     for r in rows:
         qi = int(r["question_index"])
-        title = QUESTIONS[qi].text if 0 <= qi < len(QUESTIONS) else f"Вопрос #{qi}"
-        lines.append(f"- {title}\n  Ошибок: {int(r['wrongs'])} из {int(r['total'])}")
+        title = content.question_title(qi)
+        corrects = int(r["corrects"])
+        first_try_s = f"{100.0 * int(r['first_try_correct']) / corrects:.0f}%" if corrects else "—"
+        ttc_s = fmt_ms(int(r["ttc_sum_ms"]) // int(r["ttc_count"])) if int(r["ttc_count"]) else "—"
+        lines.append(
+            f"- {title}\n  Ошибок: {int(r['wrongs'])} из {int(r['answers'])}"
+            f" · с первой попытки: {first_try_s} · до верного: {ttc_s}"
+        )
     return "\n".join(lines)
 
-def stats_events_text(limit: int = 25) -> str:
-    with db_connect() as con, con.cursor() as cur:
-        cur.execute("""
+@timed_db
+async def stats_events_text(limit: int = 25) -> str:
+    async with db_read_connect() as con, con.cursor() as cur:
+        await cur.execute("""
             SELECT e.ts,
                    COALESCE(u.username, u.full_name, u.user_id::text) AS name,
                    e.event_type
@@ -549,7 +2320,7 @@ def stats_events_text(limit: int = 25) -> str:
             ORDER BY e.id DESC
             LIMIT %s
         """, (limit,))
-        rows = cur.fetchall()
+        rows = await cur.fetchall()
 
     lines = [f"События (последние {limit})"]
     for r in rows:
@@ -557,46 +2328,97 @@ def stats_events_text(limit: int = 25) -> str:
         lines.append(f"- {ts_s} — {r['name']} — {r['event_type']}")
     return "\n".join(lines)
 
-def export_csv_bytes() -> Tuple[bytes, str]:
-    with db_connect() as con, con.cursor() as cur:
-        out = io.StringIO()
-        w = csv.writer(out)
-
-        out.write("=== USERS ===\n")
-        w.writerow(["user_id", "username", "full_name", "first_seen_ts", "last_seen_ts"])
-        cur.execute("SELECT user_id, username, full_name, first_seen_ts, last_seen_ts FROM users ORDER BY last_seen_ts DESC")
-        for r in cur.fetchall():
-            w.writerow([r["user_id"], r["username"], r["full_name"], r["first_seen_ts"], r["last_seen_ts"]])
-
-        out.write("\n=== ATTEMPTS ===\n")
-        w.writerow(["id", "user_id", "status", "started_ts", "ended_ts", "wrong_count", "penalty_ms", "elapsed_ms", "total_ms", "questions_per_run", "wrong_penalty_ms"])
-        cur.execute("""
-            SELECT id, user_id, status, started_ts, ended_ts, wrong_count, penalty_ms, elapsed_ms, total_ms, questions_per_run, wrong_penalty_ms
-            FROM attempts
-            ORDER BY id DESC
-        """)
-        for r in cur.fetchall():
-            w.writerow([r["id"], r["user_id"], r["status"], r["started_ts"], r["ended_ts"], r["wrong_count"], r["penalty_ms"],
-                        r["elapsed_ms"], r["total_ms"], r["questions_per_run"], r["wrong_penalty_ms"]])
-
-        out.write("\n=== ANSWERS ===\n")
-        w.writerow(["id", "attempt_id", "user_id", "ts", "pos", "question_index", "option_index", "is_correct", "penalty_ms_after", "total_ms_now"])
-        cur.execute("""
-            SELECT id, attempt_id, user_id, ts, pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now
-            FROM answers
-            ORDER BY id DESC
-        """)
-        for r in cur.fetchall():
-            w.writerow([r["id"], r["attempt_id"], r["user_id"], r["ts"], r["pos"], r["question_index"], r["option_index"],
-                        r["is_correct"], r["penalty_ms_after"], r["total_ms_now"]])
+# экспорт: каждая таблица — отдельный csv.gz внутри zip; строки идут из COPY TO STDOUT
+# кусками в gzip, архив копится во временном файле (в памяти только до EXPORT_SPOOL_BYTES).
+# Сжатие и запись идут в отдельном потоке пачками по EXPORT_WRITE_BATCH: event loop
+# только читает COPY. Уровень gzip низкий — CSV и так хорошо жмётся, а CPU дороже
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+EXPORT_WRITE_BATCH = 1024 * 1024
+EXPORT_GZIP_LEVEL = 1
+
+EXPORT_TABLES = [
+    ("users", """
+        SELECT user_id, username, full_name, first_seen_ts, last_seen_ts
+        FROM users
+        WHERE last_seen_ts >= %(ts_from)s AND first_seen_ts < %(ts_to)s
+        ORDER BY last_seen_ts DESC
+    """),
+    ("attempts", """
+        SELECT id, user_id, status, started_ts, ended_ts, wrong_count, penalty_ms, elapsed_ms, total_ms, questions_per_run, wrong_penalty_ms
+        FROM attempts
+        WHERE started_ts >= %(ts_from)s AND started_ts < %(ts_to)s
+        ORDER BY id DESC
+    """),
+    ("answers", """
+        SELECT id, attempt_id, user_id, ts, pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now
+        FROM answers
+        WHERE ts >= %(ts_from)s AND ts < %(ts_to)s
+        ORDER BY id DESC
+    """),
+]
 
-    data = out.getvalue().encode("utf-8")
-    filename = f"bot_stats_export_{int(time.time())}.csv.txt"
-    return data, filename
+class ExportWriter:
+    # zip из <table>.csv.gz; методы блокирующие — вызываются через asyncio.to_thread
+    def __init__(self, out):
+        self.zf = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.entry = None
+        self.gz: Optional[gzip.GzipFile] = None
+
+    def begin(self, table: str) -> None:
+        self.entry = self.zf.open(f"{table}.csv.gz", "w", force_zip64=True)
+        self.gz = gzip.GzipFile(filename=f"{table}.csv", mode="wb", fileobj=self.entry,
+                                compresslevel=EXPORT_GZIP_LEVEL)
+
+    def write(self, data: bytes) -> None:
+        self.gz.write(data)
+
+    def end(self) -> None:
+        self.gz.close()
+        self.entry.close()
+        self.gz = self.entry = None
+
+    def close(self) -> None:
+        self.zf.close()
+
+@timed_db
+async def export_archive(ts_from: Optional[int] = None, ts_to: Optional[int] = None):
+    params = {"ts_from": ts_from or 0, "ts_to": ts_to or 2**62}
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    pending: Optional[asyncio.Future] = None    # предыдущая пачка ещё пишется, пока читаем следующую
+    try:
+        writer = ExportWriter(out)
+        async with db_read_connect(EXPORT_STATEMENT_TIMEOUT_MS) as con, con.cursor() as cur:
+            for table, query in EXPORT_TABLES:
+                await asyncio.to_thread(writer.begin, table)
+                buf = bytearray()
+                async with cur.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", params) as copy:
+                    async for chunk in copy:
+                        buf += chunk
+                        if len(buf) >= EXPORT_WRITE_BATCH:
+                            if pending is not None:
+                                await pending
+                            pending = asyncio.ensure_future(asyncio.to_thread(writer.write, bytes(buf)))
+                            buf.clear()
+                if pending is not None:
+                    await pending
+                    pending = None
+                if buf:
+                    await asyncio.to_thread(writer.write, bytes(buf))
+                await asyncio.to_thread(writer.end)
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)   # поток не должен писать в закрытый файл
+        out.close()
+        raise
+    out.seek(0)
+    filename = f"bot_stats_export_{int(time.time())}.zip"
+    return out, filename
 
 # ==========================================================
 # ====================== UI КНОПКИ =========================
 # ==========================================================
+@lru_cache(maxsize=None)
 def main_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("Начать тест", callback_data="start_quiz")],
@@ -605,6 +2427,7 @@ def main_menu_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("Как играть", callback_data="help")],
     ])
 
+@lru_cache(maxsize=None)
 def theory_kb(page: int, total: int) -> InlineKeyboardMarkup:
     prev_btn = InlineKeyboardButton("⬅️", callback_data=f"theory:{page-1}") if page > 0 else InlineKeyboardButton(" ", callback_data="noop")
     next_btn = InlineKeyboardButton("➡️", callback_data=f"theory:{page+1}") if page < total - 1 else InlineKeyboardButton(" ", callback_data="noop")
@@ -613,12 +2436,13 @@ def theory_kb(page: int, total: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton("Начать тест", callback_data="start_quiz")],
     ])
 
-def quiz_kb(current_q_index: int, options: List[str]) -> InlineKeyboardMarkup:
+def quiz_kb(current_q_index: int, options: Tuple[str, ...]) -> InlineKeyboardMarkup:
     rows = [[InlineKeyboardButton(opt, callback_data=f"ans:{current_q_index}:{i}")] for i, opt in enumerate(options)]
     rows.append([InlineKeyboardButton("Сдаться", callback_data="quit"), InlineKeyboardButton("Меню", callback_data="menu")])
     rows.append([InlineKeyboardButton("Лидеры", callback_data="leaderboard")])
     return InlineKeyboardMarkup(rows)
 
+@lru_cache(maxsize=None)
 def finish_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("Пройти ещё раз", callback_data="start_quiz")],
@@ -627,34 +2451,180 @@ def finish_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("Меню", callback_data="menu")],
     ])
 
+@lru_cache(maxsize=None)
 def stats_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("Сводка", callback_data="stats:overview")],
         [InlineKeyboardButton("Пользователи", callback_data="stats:users")],
         [InlineKeyboardButton("Попытки", callback_data="stats:attempts")],
         [InlineKeyboardButton("Сложные вопросы", callback_data="stats:hard")],
+        [InlineKeyboardButton("Сложные за 24ч", callback_data="stats:hard24h"),
+         InlineKeyboardButton("Сложные за 7д", callback_data="stats:hard7d")],
         [InlineKeyboardButton("События", callback_data="stats:events")],
         [InlineKeyboardButton("Экспорт CSV", callback_data="stats:export")],
         [InlineKeyboardButton("Очистить статистику", callback_data="stats:clear_confirm")],
         [InlineKeyboardButton("Меню", callback_data="menu")],
     ])
 
+@lru_cache(maxsize=None)
 def clear_confirm_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("ДА, очистить", callback_data="stats:clear_yes")],
         [InlineKeyboardButton("Отмена", callback_data="stats:clear_no")],
     ])
 
+# ==========================================================
+# ====================== КОНТЕНТ ===========================
+# Всё, что не меняется между показами (страницы теории, клавиатуры
+# вопросов, тексты ответов), собирается один раз при старте
+# ==========================================================
+@dataclass(frozen=True, slots=True)
+class CompiledQuestion:
+    index: int
+    text: str
+    options: Tuple[str, ...]
+    correct: int
+    photo_path: Optional[str]
+    kb: InlineKeyboardMarkup
+    right_text: str              # "Верно!" + пояснение
+    wrong_text: str              # "Неверно!" + подсказка
+
+@dataclass(frozen=True, slots=True)
+class ContentStore:
+    version: str
+    questions: Tuple[CompiledQuestion, ...]
+    theory_pages: Tuple[str, ...]
+
+    def question_title(self, qi: int) -> str:
+        return self.questions[qi].text if 0 <= qi < len(self.questions) else f"Вопрос #{qi}"
+
+def content_digest(questions: List[Question], theory_text: str) -> str:
+    raw = json.dumps({"theory": theory_text, "questions": [asdict(q) for q in questions]},
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def compile_content(questions: List[Question], theory_text: str, version: str) -> ContentStore:
+    compiled = []
+    for i, q in enumerate(questions):
+        options = tuple(q.options)
+        compiled.append(CompiledQuestion(
+            index=i,
+            text=q.text,
+            options=options,
+            correct=q.correct,
+            photo_path=q.photo_path,
+            kb=quiz_kb(i, options),
+            right_text="Верно!\n" + q.explain_right,
+            wrong_text=(
+                f"Неверно! +{int(WRONG_PENALTY_MS/1000)} сек штраф.\n"
+                f"Подсказка: {q.hint_wrong}\n"
+                "Попробуй ещё раз."
+            ),
+        ))
+    pages = tuple(chunk_text(theory_text))
+    for page in range(len(pages)):
+        theory_kb(page, len(pages))   # прогреваем кэш клавиатур теории
+    return ContentStore(version=version, questions=tuple(compiled), theory_pages=pages)
+
+# версия встроенного банка — хэш содержимого, как у файлового: после правки
+# QUESTIONS сессии, начатые на старом списке, не получат чужие индексы
+CONTENT = compile_content(QUESTIONS, THEORY_TEXT, version=f"builtin:{content_digest(QUESTIONS, THEORY_TEXT)[:8]}")
+
+# ==========================================================
+# ====================== БАНК ВОПРОСОВ =====================
+# Формат файла QUESTION_BANK_PATH:
+#   {"version": "...", "theory": "...",
+#    "questions": [{"text", "options", "correct", "hint_wrong", "explain_right", "photo_path"?}]}
+# Админ командой /reload подменяет банк на лету; начатые попытки
+# доигрываются на той версии, с которой стартовали.
+# ==========================================================
+BANKS: dict = {CONTENT.version: CONTENT}   # version -> ContentStore
+
+def parse_bank(raw) -> Tuple[str, List[Question], str]:
+    if not isinstance(raw, dict):
+        raise ValueError("банк вопросов: ожидается JSON-объект")
+    version = str(raw.get("version") or "").strip()
+    if not version:
+        raise ValueError("банк вопросов: не задан version")
+    theory = raw.get("theory", "")
+    if not isinstance(theory, str):
+        raise ValueError("банк вопросов: theory должен быть строкой")
+    items = raw.get("questions")
+    if not isinstance(items, list) or not items:
+        raise ValueError("банк вопросов: questions должен быть непустым списком")
+
+    questions: List[Question] = []
+    for i, item in enumerate(items, 1):
+        where = f"банк вопросов: вопрос #{i}"
+        if not isinstance(item, dict):
+            raise ValueError(f"{where}: ожидается объект")
+        for key in ("text", "hint_wrong", "explain_right"):
+            if not isinstance(item.get(key), str) or not item[key].strip():
+                raise ValueError(f"{where}: поле {key} должно быть непустой строкой")
+        options = item.get("options")
+        if not isinstance(options, list) or len(options) < 2 or not all(isinstance(o, str) and o for o in options):
+            raise ValueError(f"{where}: options — список минимум из 2 непустых строк")
+        correct = item.get("correct")
+        if not isinstance(correct, int) or isinstance(correct, bool) or not 0 <= correct < len(options):
+            raise ValueError(f"{where}: correct должен быть индексом в options")
+        photo_path = item.get("photo_path")
+        if photo_path is not None and not isinstance(photo_path, str):
+            raise ValueError(f"{where}: photo_path должен быть строкой")
+        questions.append(Question(
+            text=item["text"],
+            options=list(options),
+            correct=correct,
+            hint_wrong=item["hint_wrong"],
+            explain_right=item["explain_right"],
+            photo_path=photo_path or None,
+        ))
+    return version, questions, theory
+
+def load_bank(path: str) -> ContentStore:
+    # к версии из файла добавляем sha256 содержимого: правка без смены version
+    # даёт новую версию, и начатые попытки не получат чужие индексы
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    version, questions, theory = parse_bank(json.loads(data.decode("utf-8")))
+    return compile_content(questions, theory, version=f"{version}:{digest[:8]}")
+
+def install_bank(store: ContentStore) -> None:
+    global CONTENT
+    BANKS[store.version] = store
+    CONTENT = store   # одно присваивание — новые попытки сразу видят новый банк
+
+async def prune_banks(app: Application, keep: Optional[str] = None) -> None:
+    # старые версии держим, пока на них есть незавершённые попытки
+    used = {ud.get("bank_version") for ud in app.user_data.values() if ud.get("order")}
+    if MULTI_WORKER:
+        # в памяти только те, кто заходил в этот процесс: остальных видно лишь в sessions.
+        # keep — версия, которую сменили только что: воркер, ещё не получивший NOTIFY,
+        # мог начать на ней попытку, которая в sessions пока не записана
+        async with db_connect() as con, con.cursor() as cur:
+            await cur.execute("SELECT DISTINCT data->>'bank_version' AS version FROM sessions WHERE data ? 'order'")
+            used |= {r["version"] for r in await cur.fetchall()}
+        used.add(keep)
+    for version in list(BANKS):
+        if version != CONTENT.version and version not in used:
+            BANKS.pop(version, None)
+
+def session_content(context: ContextTypes.DEFAULT_TYPE) -> Optional[ContentStore]:
+    version = context.user_data.get("bank_version")
+    if version is None:
+        return CONTENT
+    return BANKS.get(version)
+
 # ==========================================================
 # ====================== ЭКРАНЫ ============================
 # ==========================================================
 async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "menu_open")
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "menu_open")
 
-    await send(
+    await show(
         update,
         f"Привет!\n\n"
         f"Тест: {QUESTIONS_PER_RUN} вопросов (случайно из общего списка)\n"
@@ -666,10 +2636,10 @@ async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "help_open")
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "help_open")
 
-    await send(
+    await show(
         update,
         "Как играть:\n\n"
         "1) Нажми «Начать тест»\n"
@@ -683,12 +2653,12 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_theory(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int):
     u = update.effective_user
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "theory_open", payload_json=f'{{"page":{page}}}')
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "theory_open", page=page)
 
-    pages = chunk_text(THEORY_TEXT)
+    pages = CONTENT.theory_pages
     page = max(0, min(page, len(pages) - 1))
-    await send(
+    await show(
         update,
         f"Теория ({page+1}/{len(pages)})\n\n{pages[page]}",
         reply_markup=theory_kb(page, len(pages)),
@@ -697,18 +2667,15 @@ async def show_theory(update: Update, context: ContextTypes.DEFAULT_TYPE, page:
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "leaderboard_open")
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "leaderboard_open")
 
-    rows = leaderboard_top(10)
-    if not rows:
-        await send(update, "Пока нет результатов. Нажми «Начать тест».", reply_markup=main_menu_kb())
+    text = await LEADERBOARD_CACHE.text()
+    if text is None:
+        await show(update, "Пока нет результатов. Нажми «Начать тест».", reply_markup=main_menu_kb())
         return
 
-    lines = ["Лидеры (лучшее итоговое время):"]
-    for i, (name, ms) in enumerate(rows, 1):
-        lines.append(f"{i}. {name} — {fmt_ms(ms)}")
-    await send(update, "\n".join(lines), reply_markup=main_menu_kb())
+    await show(update, text, reply_markup=main_menu_kb())
 
 # ==========================================================
 # ====================== ТЕСТ ==============================
@@ -716,35 +2683,47 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "quiz_start_clicked")
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "quiz_start_clicked")
 
     order = build_quiz_order()
+    context.user_data["bank_version"] = CONTENT.version
     context.user_data["order"] = order
     context.user_data["pos"] = 0
     context.user_data["t0"] = time.time()
     context.user_data["penalty_ms"] = 0
     context.user_data["wrong_count"] = 0
+    context.user_data.pop("wrong_opts", None)
+    context.user_data.pop("q_shown_at", None)
 
     attempt_id = None
     if u:
-        attempt_id = attempt_start(int(u.id))
+        attempt_id = await attempt_start(int(u.id))
         context.user_data["attempt_id"] = attempt_id
-        log_event(int(u.id), "attempt_started", payload_json=f'{{"attempt_id":{attempt_id}}}')
+        await log_event(int(u.id), "attempt_started", attempt_id=attempt_id)
 
+    if EDIT_IN_PLACE:
+        await show_question(update, context, note="Поехали!")
+        return
     await send(update, "Поехали!", reply_markup=None)
     await show_question(update, context)
 
-async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE, note: str = ""):
+    # note — отклик на прошлый ответ; при EDIT_IN_PLACE он идёт в тот же экран
     order: List[int] = context.user_data.get("order", [])
     pos = int(context.user_data.get("pos", 0))
 
     if not order or pos >= len(order):
-        await finish_quiz(update, context, status="finished")
+        await finish_quiz(update, context, status="finished", note=note)
+        return
+
+    content = session_content(context)
+    if content is None:
+        await drop_stale_session(update, context)
         return
 
     q_index = order[pos]
-    q = QUESTIONS[q_index]
+    q = content.questions[q_index]
 
     total_now = total_time_ms(context)
     penalty = int(context.user_data.get("penalty_ms", 0))
@@ -753,19 +2732,28 @@ async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Время сейчас: {fmt_ms(total_now)} (штраф: {fmt_ms(penalty)})\n\n"
         f"{q.text}"
     )
-
-    kb = quiz_kb(q_index, q.options)
+    limit = CAPTION_MAX_CHARS if q.photo_path else TEXT_MAX_CHARS
+    if note and len(note) + 2 + len(caption) <= limit:
+        caption = f"{note}\n\n{caption}"
+    elif note:
+        # с откликом подпись не влезает в лимит — отклик отдельным сообщением
+        await send(update, note)
+    caption = clip_text(caption, limit)
+
+    kb = q.kb
+    # тот же вопрос может перерисовываться (отклик на ошибку) — время показа не сбрасываем
+    context.user_data.setdefault("q_shown_at", time.time())
 
     if q.photo_path:
         try:
-            await send_photo(update, q.photo_path, caption=caption, reply_markup=kb)
+            await show(update, caption, reply_markup=kb, photo_path=q.photo_path)
             return
         except FileNotFoundError:
             caption += "\n\n(Картинка не найдена)"
 
-    await send(update, caption, reply_markup=kb)
+    await show(update, caption, reply_markup=kb)
 
-async def finish_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, status: str):
+async def finish_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, status: str, note: str = ""):
     u = update.effective_user
     attempt_id = context.user_data.get("attempt_id")
 
@@ -775,36 +2763,67 @@ async def finish_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, status
     total = elapsed + penalty
 
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "attempt_ended", payload_json=f'{{"status":"{status}","wrong":{wrong},"penalty_ms":{penalty},"total_ms":{total}}}')
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "attempt_ended", attempt_id=attempt_id, status=status, wrong=wrong, penalty_ms=penalty, total_ms=total)
 
     if attempt_id is not None:
-        attempt_finish(int(attempt_id), status=status, elapsed_ms=elapsed, penalty_ms=penalty, wrong_count=wrong)
+        await attempt_finish(int(attempt_id), status=status, elapsed_ms=elapsed, penalty_ms=penalty, wrong_count=wrong)
 
     # очистим сессию
-    for k in ["order", "pos", "t0", "penalty_ms", "wrong_count", "attempt_id"]:
+    for k in SESSION_KEYS:
         context.user_data.pop(k, None)
 
+    if note:
+        note += "\n\n"
+
     if status == "quit":
-        await send(update, "Ок, попытка остановлена.", reply_markup=main_menu_kb())
+        await show(update, note + "Ок, попытка остановлена.", reply_markup=main_menu_kb())
         return
 
     # Финальная фраза (как ты просил)
-    await send(
+    await show(
         update,
+        note +
         "Уровень пройден! Ты разблокировал профессию «Инженер-дефектоскопист»\n\n"
         f"Итоговое время: {fmt_ms(total)}\n"
         f"Ошибок: {wrong} (штраф: {fmt_ms(penalty)})",
         reply_markup=finish_kb(),
     )
 
+async def drop_stale_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # версия банка, на которой начата попытка, больше не загружена (например, после рестарта)
+    attempt_id = context.user_data.get("attempt_id")
+    if attempt_id is not None:
+        elapsed = int((time.time() - float(context.user_data.get("t0", time.time()))) * 1000)
+        await attempt_finish(int(attempt_id), status="quit", elapsed_ms=elapsed,
+                             penalty_ms=int(context.user_data.get("penalty_ms", 0)),
+                             wrong_count=int(context.user_data.get("wrong_count", 0)))
+    for k in SESSION_KEYS:
+        context.user_data.pop(k, None)
+    await show(update, "Вопросы обновились, эта попытка закрыта. Нажми «Начать тест».", reply_markup=main_menu_kb())
+
 async def quit_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "quiz_quit_clicked")
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "quiz_quit_clicked")
     await finish_quiz(update, context, status="quit")
 
+async def save_answer(u, attempt_id, pos: int, q_index: int, opt: int, is_correct: bool,
+                      context: ContextTypes.DEFAULT_TYPE, total_ms_now: int) -> None:
+    penalty_after = int(context.user_data.get("penalty_ms", 0))
+    wrong_count = int(context.user_data.get("wrong_count", 0))
+    if attempt_id is None:
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "answer_clicked", q=q_index, opt=opt)
+        return
+
+    first_try = is_correct and not context.user_data.get("wrong_opts")
+    shown_at = context.user_data.get("q_shown_at")
+    ttc_ms = int((time.time() - float(shown_at)) * 1000) if is_correct and shown_at is not None else None
+    await record_answer(u, int(attempt_id), pos, q_index, opt, is_correct, wrong_count, penalty_after, total_ms_now,
+                        context.user_data.get("bank_version") or CONTENT.version, first_try=first_try, time_to_correct_ms=ttc_ms)
+
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, q_index: int, opt: int):
     query = update.callback_query
     u = update.effective_user
@@ -822,61 +2841,69 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, q_in
         await query.message.reply_text("Это старые кнопки. Начни тест заново.")
         return
 
-    q = QUESTIONS[current_q_index]
+    content = session_content(context)
+    if content is None:
+        await drop_stale_session(update, context)
+        return
+    q = content.questions[current_q_index]
     total_before = total_time_ms(context)
 
-    if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "answer_clicked", payload_json=f'{{"q":{current_q_index},"opt":{opt}}}')
-
     if opt == q.correct:
-        if u and attempt_id is not None:
-            penalty_after = int(context.user_data.get("penalty_ms", 0))
-            log_answer(int(attempt_id), int(u.id), pos, current_q_index, opt, True, penalty_after, total_before)
+        if u:
+            await save_answer(u, attempt_id, pos, current_q_index, opt, True, context, total_before)
 
         context.user_data["pos"] = pos + 1
-        await query.message.reply_text("Верно!\n" + q.explain_right)
+        context.user_data.pop("wrong_opts", None)
+        context.user_data.pop("q_shown_at", None)
+        if EDIT_IN_PLACE:
+            await show_question(update, context, note=q.right_text)
+            return
+        await query.message.reply_text(q.right_text)
         await show_question(update, context)
         return
 
+    # тот же неверный вариант повторно (двойной клик) — штраф второй раз не начисляем
+    wrong_opts: List[int] = context.user_data.setdefault("wrong_opts", [])
+    if opt in wrong_opts:
+        if EDIT_IN_PLACE:
+            await show_question(update, context, note="Этот вариант уже выбран — он неверный. Попробуй другой.")
+            return
+        await query.message.reply_text("Этот вариант уже выбран — он неверный. Попробуй другой.")
+        return
+    wrong_opts.append(opt)
+
     # неверно -> штраф
     context.user_data["penalty_ms"] = int(context.user_data.get("penalty_ms", 0)) + WRONG_PENALTY_MS
     context.user_data["wrong_count"] = int(context.user_data.get("wrong_count", 0)) + 1
 
-    penalty_after = int(context.user_data.get("penalty_ms", 0))
-    wrong_count = int(context.user_data.get("wrong_count", 0))
-
-    if attempt_id is not None:
-        attempt_update_progress(int(attempt_id), wrong_count, penalty_after)
-
-    total_after = total_time_ms(context)
-
-    if u and attempt_id is not None:
-        log_answer(int(attempt_id), int(u.id), pos, current_q_index, opt, False, penalty_after, total_after)
+    if u:
+        await save_answer(u, attempt_id, pos, current_q_index, opt, False, context, total_time_ms(context))
 
-    await query.message.reply_text(
-        f"Неверно! +{int(WRONG_PENALTY_MS/1000)} сек штраф.\n"
-        f"Подсказка: {q.hint_wrong}\n"
-        "Попробуй ещё раз."
-    )
+    if EDIT_IN_PLACE:
+        # перерисовываем тот же вопрос: отклик сверху, время уже со штрафом
+        await show_question(update, context, note=q.wrong_text)
+        return
+    await query.message.reply_text(q.wrong_text)
 
 # ==========================================================
 # ====================== ADMIN COMMANDS ====================
 # ==========================================================
+@timed_handler("cmd_myid")
 async def cmd_myid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if not u:
         return
-    uid, _, _ = upsert_user(u)
-    log_event(uid, "cmd_myid")
+    uid, _, _ = await upsert_user(u)
+    await log_event(uid, "cmd_myid")
     await update.message.reply_text(f"Твой user_id: {uid}")
 
+@timed_handler("cmd_stats")
 async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if not u:
         return
-    uid, _, _ = upsert_user(u)
-    log_event(uid, "cmd_stats")
+    uid, _, _ = await upsert_user(u)
+    await log_event(uid, "cmd_stats")
 
     if not is_admin(update):
         await update.message.reply_text("Нет доступа.")
@@ -884,29 +2911,91 @@ async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text("Меню статистики (только админ):", reply_markup=stats_menu_kb())
 
+@timed_handler("cmd_reload")
+async def cmd_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    u = update.effective_user
+    if not u:
+        return
+    uid, _, _ = await upsert_user(u)
+    await log_event(uid, "cmd_reload")
+
+    if not is_admin(update):
+        await update.message.reply_text("Нет доступа.")
+        return
+    if not QUESTION_BANK_PATH:
+        await update.message.reply_text("QUESTION_BANK_PATH не задан — вопросы встроены в код.")
+        return
+
+    try:
+        store = await asyncio.to_thread(load_bank, QUESTION_BANK_PATH)
+    except (OSError, ValueError) as e:
+        await update.message.reply_text(f"Банк не загружен, остаётся {CONTENT.version}.\nОшибка: {e}")
+        return
+    if len(store.questions) < QUESTIONS_PER_RUN:
+        await update.message.reply_text(f"В банке {len(store.questions)} вопросов, нужно минимум {QUESTIONS_PER_RUN}. Остаётся {CONTENT.version}.")
+        return
+
+    old_version = CONTENT.version
+    install_bank(store)
+    await prune_banks(context.application, keep=old_version)
+    await notify_workers("bank", version=store.version)
+    await update.message.reply_text(
+        f"Банк обновлён: {old_version} -> {store.version}\n"
+        f"Вопросов: {len(store.questions)}, страниц теории: {len(store.theory_pages)}"
+    )
+
+def parse_day(s: str) -> int:
+    return int(datetime.strptime(s, "%Y-%m-%d").timestamp())
+
+async def send_export(update: Update, ts_from: Optional[int] = None, ts_to: Optional[int] = None):
+    archive, filename = await export_archive(ts_from, ts_to)
+    target = update.callback_query.message if update.callback_query else update.message
+    with archive:
+        await target.reply_document(document=InputFile(archive, filename=filename), caption="Экспорт статистики")
+
+@timed_handler("cmd_export")
+async def cmd_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /export [с YYYY-MM-DD] [по YYYY-MM-DD включительно]
+    u = update.effective_user
+    if not u:
+        return
+    uid, _, _ = await upsert_user(u)
+    await log_event(uid, "cmd_export")
+
+    if not is_admin(update):
+        await update.message.reply_text("Нет доступа.")
+        return
+
+    args = context.args or []
+    try:
+        ts_from = parse_day(args[0]) if len(args) >= 1 else None
+        ts_to = int((datetime.fromtimestamp(parse_day(args[1])) + timedelta(days=1)).timestamp()) if len(args) >= 2 else None
+    except ValueError:
+        await update.message.reply_text("Формат: /export [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    await send_export(update, ts_from, ts_to)
+
 async def handle_stats_action(update: Update, action: str):
     if not is_admin(update):
         await send(update, "Нет доступа.")
         return
 
     if action == "overview":
-        await send(update, stats_overview_text(), reply_markup=stats_menu_kb())
+        await send(update, await stats_overview_text(), reply_markup=stats_menu_kb())
     elif action == "users":
-        await send(update, stats_users_text(20), reply_markup=stats_menu_kb())
+        await send(update, await stats_users_text(20), reply_markup=stats_menu_kb())
     elif action == "attempts":
-        await send(update, stats_attempts_text(20), reply_markup=stats_menu_kb())
+        await send(update, await stats_attempts_text(20), reply_markup=stats_menu_kb())
     elif action == "hard":
-        await send(update, stats_hard_text(10), reply_markup=stats_menu_kb())
+        await send(update, await stats_hard_text(10), reply_markup=stats_menu_kb())
+    elif action == "hard24h":
+        await send(update, await stats_hard_text(10, window_s=86400, label=" за 24ч"), reply_markup=stats_menu_kb())
+    elif action == "hard7d":
+        await send(update, await stats_hard_text(10, window_s=7 * 86400, label=" за 7д"), reply_markup=stats_menu_kb())
     elif action == "events":
-        await send(update, stats_events_text(25), reply_markup=stats_menu_kb())
+        await send(update, await stats_events_text(25), reply_markup=stats_menu_kb())
     elif action == "export":
-        data, filename = export_csv_bytes()
-        bio = io.BytesIO(data)
-        bio.name = filename
-        if update.callback_query:
-            await update.callback_query.message.reply_document(document=InputFile(bio, filename=filename), caption="Экспорт статистики")
-        else:
-            await update.message.reply_document(document=InputFile(bio, filename=filename), caption="Экспорт статистики")
+        await send_export(update)
     elif action == "clear_confirm":
         await send(
             update,
@@ -914,7 +3003,7 @@ async def handle_stats_action(update: Update, action: str):
             reply_markup=clear_confirm_kb(),
         )
     elif action == "clear_yes":
-        db_clear_all()
+        await db_clear_all()
         await send(update, "Статистика очищена.", reply_markup=stats_menu_kb())
     elif action == "clear_no":
         await send(update, "Ок, отменено.", reply_markup=stats_menu_kb())
@@ -923,16 +3012,50 @@ async def handle_stats_action(update: Update, action: str):
 
 # ==========================================================
 # ====================== ROUTER ============================
+# Апдейты разных пользователей обрабатываются параллельно,
+# одного пользователя — по очереди (иначе гонка на pos/penalty_ms)
 # ==========================================================
+class UserLocks:
+    def __init__(self):
+        self._locks: dict = {}   # user_id -> [lock, сколько держат/ждут]
+
+    @asynccontextmanager
+    async def hold(self, user_id: int):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(user_id, None)
+
+USER_LOCKS = UserLocks()
+
 async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    data = query.data
+    action = callback_action(query.data or "")
+    with HANDLER_SECONDS.labels(action).time():
+        await query.answer()
+
+        u = update.effective_user
+        if u is None:
+            await route_callback(update, context)
+            return
+        async with user_turn(context.application, int(u.id)):
+            await route_callback(update, context)
+
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    data = update.callback_query.data
 
     u = update.effective_user
-    if u:
-        uid, _, _ = upsert_user(u)
-        log_event(uid, "callback", payload_json=f'{{"data":"{data}"}}')
+    # для ответов касание пользователя и событие пишет record_answer
+    if u and not data.startswith("ans:"):
+        uid, _, _ = await upsert_user(u)
+        await log_event(uid, "callback", data=data)
 
     if data == "noop":
         return
@@ -965,43 +3088,139 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_answer(update, context, int(q_index_s), int(opt_s))
         return
 
+@timed_handler("cmd_start")
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_menu(update, context)
 
+@timed_handler("text")
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_menu(update, context)
 
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
     # ошибки будут видны в Railway logs
     print("ERROR:", repr(context.error))
+    HANDLER_ERRORS.labels(type(context.error).__name__).inc()
 
 def ensure_ready():
     print("BOOT: BOT_TOKEN:", bool(BOT_TOKEN))
     print("BOOT: DATABASE_URL:", bool(DATABASE_URL))
+    print("BOOT: DATABASE_READ_URL:", bool(DATABASE_READ_URL), "MAX_LAG_S:", DB_READ_MAX_LAG_S,
+          "STATEMENT_TIMEOUT_MS:", DB_READ_STATEMENT_TIMEOUT_MS, "export:", EXPORT_STATEMENT_TIMEOUT_MS)
     print("BOOT: ADMIN_IDS:", ADMIN_IDS)
-    print("BOOT: QUESTIONS:", len(QUESTIONS))
+    print("BOOT: QUESTIONS:", len(CONTENT.questions), "THEORY_PAGES:", len(CONTENT.theory_pages), "BANK:", CONTENT.version)
     print("BOOT: QUESTIONS_PER_RUN:", QUESTIONS_PER_RUN)
+    print("BOOT: BOT_MODE:", BOT_MODE, "UPDATE_CONCURRENCY:", UPDATE_CONCURRENCY)
+    print("BOOT: MULTI_WORKER:", MULTI_WORKER, "WORKER_ID:", WORKER_ID)
+    print("BOOT: METRICS_PORT:", METRICS_PORT, "EDIT_IN_PLACE:", EDIT_IN_PLACE)
+    print("BOOT: SEND_RATE_GLOBAL:", SEND_RATE_GLOBAL, "SEND_RATE_PER_CHAT:", SEND_RATE_PER_CHAT, "burst", SEND_BURST_PER_CHAT)
+    if BOT_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"BOT_MODE={BOT_MODE!r}: допустимо polling или webhook.")
+    if BOT_MODE == "webhook" and METRICS_PORT == WEBHOOK_PORT:
+        raise RuntimeError("METRICS_PORT совпадает с WEBHOOK_PORT.")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL.startswith("https://"):
+        # без адреса PTB регистрирует http://<listen>:<port>/..., Telegram такой не примет
+        raise RuntimeError("BOT_MODE=webhook: WEBHOOK_URL должен быть публичным https:// адресом.")
+    if BOT_MODE == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET or ""):
+        # без секрета любой, кто знает адрес, пришлёт апдейт от имени админа
+        raise RuntimeError("BOT_MODE=webhook: WEBHOOK_SECRET обязателен (1-256 символов A-Z, a-z, 0-9, _, -).")
+    if SEND_RATE_GLOBAL <= 0 or SEND_RATE_PER_CHAT <= 0:
+        raise RuntimeError("SEND_RATE_GLOBAL и SEND_RATE_PER_CHAT должны быть > 0.")
+    if SESSION_MAX_USERS < 1 or SESSION_IDLE_TTL_S < 1:
+        raise RuntimeError("SESSION_MAX_USERS и SESSION_IDLE_TTL_S должны быть >= 1.")
+    if MULTI_WORKER and BOT_MODE != "webhook":
+        raise RuntimeError("MULTI_WORKER работает только с BOT_MODE=webhook (getUpdates допускает один процесс).")
+    if UPDATE_CONCURRENCY < 1:
+        raise RuntimeError("UPDATE_CONCURRENCY должен быть >= 1.")
+    if EVENTS_PARTITIONS_AHEAD_DAYS < 1:
+        # при 0 события после полуночи до очередного обслуживания уходят в events_default
+        raise RuntimeError("EVENTS_PARTITIONS_AHEAD_DAYS должен быть >= 1.")
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не задан (Railway Variables).")
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL не задан (Railway Variables).")
-    if len(QUESTIONS) < QUESTIONS_PER_RUN:
+    if len(CONTENT.questions) < QUESTIONS_PER_RUN:
         raise RuntimeError("Недостаточно вопросов в QUESTIONS.")
 
-def main():
-    ensure_ready()
-    db_init()
-    print("BOOT: db_init OK")
-
-    app = Application.builder().token(BOT_TOKEN).build()
+BACKGROUND_TASKS: List[asyncio.Task] = []
+
+async def post_init(app: Application) -> None:
+    await db_startup()
+    await PHOTO_CACHE.load()
+
+    global WRITER
+    WRITER = WriteBehind(WRITE_BUFFER_MAX, WRITE_FLUSH_ROWS, WRITE_FLUSH_MS)
+    WRITER.start()
+
+    BACKGROUND_TASKS.append(asyncio.create_task(reaper_loop(app)))
+    BACKGROUND_TASKS.append(asyncio.create_task(events_maintenance_loop()))
+    BACKGROUND_TASKS.append(asyncio.create_task(session_janitor_loop(app)))
+    if MULTI_WORKER:
+        BACKGROUND_TASKS.append(asyncio.create_task(cache_listener_loop(app)))
+
+async def post_shutdown(app: Application) -> None:
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    await asyncio.gather(*BACKGROUND_TASKS, return_exceptions=True)
+    BACKGROUND_TASKS.clear()
+
+    global WRITER
+    if WRITER is not None:
+        await WRITER.close()
+        WRITER = None
+    await db_pool_close()
+
+def build_application(base_url: Optional[str] = None) -> Application:
+    # base_url — адрес Bot API (для нагрузочного теста подставляется фейковый сервер)
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .context_types(ContextTypes(user_data=QuizSession))
+        .persistence(PostgresPersistence(SESSION_FLUSH_INTERVAL_S))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # тот же HTTPXRequest, что PTB собирает по умолчанию, но с таймингами вызовов
+        .request(MetricsRequest(connection_pool_size=256))
+        .get_updates_request(MetricsRequest(connection_pool_size=1))
+        .rate_limiter(SendLimiter(SEND_RATE_GLOBAL, SEND_RATE_PER_CHAT, SEND_BURST_PER_CHAT, SEND_MAX_RETRIES))
+    )
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_url)
+    app = builder.build()
     app.add_error_handler(on_error)
 
+    app.add_handler(TypeHandler(Update, on_any_update), group=-1)
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("myid", cmd_myid))
     app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("reload", cmd_reload))
+    app.add_handler(CommandHandler("export", cmd_export))
 
     app.add_handler(CallbackQueryHandler(on_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    return app
+
+
+def main():
+    if QUESTION_BANK_PATH:
+        install_bank(load_bank(QUESTION_BANK_PATH))
+    ensure_ready()
+    db_pool_create()
+    metrics_start()
+    app = build_application()
+
+    if BOT_MODE == "webhook":
+        webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+        print("BOOT: webhook start", f"{WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}", "->", webhook_url)
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        return
 
     print("BOOT: polling start")
     app.run_polling()
@@ -0,0 +1,814 @@
+# -*- coding: utf-8 -*-
+# Нагрузочный стенд: поднимает фейковый Bot API, локальный Postgres (если не задан
+# DATABASE_URL) и прогоняет через приложение N пользователей, проходящих тест.
+#
+#   python loadtest.py --users 500 --concurrency 64 --wrong-rate 0.3
+#   python loadtest.py --memory --users 100000      # память сессий, без БД
+#   python loadtest.py --render                      # подготовка экранов: как было и из CONTENT
+#   python loadtest.py --users 2000 --workers 4      # 4 процесса MULTI_WORKER на одной базе
+#   python loadtest.py --users 200 --workers 3 --cross-workers   # один пользователь — во все процессы
+#   python loadtest.py --users 2000 --workers 4 --scaling        # 1 процесс против 4 на тех же --users
+#
+# В конце печатает updates/sec, p50/p99 времени обработки апдейта, число
+# обращений к БД на апдейт и число вызовов Bot API по методам.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+FAKE_TOKEN = "123456:LOADTEST"
+FAKE_BOT_ID = 123456
+
+# ==========================================================
+# ====================== ФЕЙКОВЫЙ BOT API ==================
+# ==========================================================
+API_CALLS: Counter = Counter()
+API_REQUESTS: deque = deque(maxlen=10_000)   # (метод, параметры) последних вызовов — для тестов
+_MESSAGE_ID = 0
+
+def next_message_id() -> int:
+    global _MESSAGE_ID
+    _MESSAGE_ID += 1
+    return _MESSAGE_ID
+
+def parse_params(content_type: str, body: bytes) -> Dict[str, str]:
+    # обычные вызовы PTB шлёт формой, загрузку файлов — multipart
+    if content_type.startswith("multipart/form-data"):
+        params: Dict[str, str] = {}
+        boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+        for part in body.split(b"--" + boundary):
+            head, _, value = part.partition(b"\r\n\r\n")
+            if b'name="' not in head or b"filename=" in head:
+                continue
+            name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+            params[name] = value.rstrip(b"\r\n").decode("utf-8", "replace")
+        return params
+    if content_type.startswith("application/json"):
+        return {k: str(v) for k, v in (json.loads(body or b"{}") or {}).items()}
+    return {k: v[0] for k, v in parse_qs(body.decode("utf-8", "replace")).items()}
+
+def fake_message(chat_id: int, params: Dict[str, str], photo: bool = False) -> dict:
+    msg = {
+        "message_id": next_message_id(),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+    }
+    if photo:
+        msg["photo"] = [{"file_id": "PHOTO", "file_unique_id": "PHOTO", "width": 640, "height": 480}]
+        if "caption" in params:
+            msg["caption"] = params["caption"]
+    elif "text" in params:
+        msg["text"] = params["text"]
+    return msg
+
+def fake_error(method: str, params: Dict[str, str]) -> Optional[str]:
+    # те же лимиты длины, что у настоящего Bot API
+    caption = params.get("caption")
+    if caption is None and "media" in params:
+        caption = json.loads(params["media"]).get("caption")
+    if caption is not None and len(caption) > 1024:
+        return "Bad Request: message caption is too long"
+    if len(params.get("text", "")) > 4096:
+        return "Bad Request: message is too long"
+    return None
+
+def fake_result(method: str, params: Dict[str, str]):
+    chat_id = int(params.get("chat_id") or 0)
+    if method == "getme":
+        return {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+    if method in ("sendmessage", "senddocument"):
+        return fake_message(chat_id, params)
+    if method == "sendphoto":
+        return fake_message(chat_id, params, photo=True)
+    if method.startswith("edit"):
+        return fake_message(chat_id, params, photo=method == "editmessagemedia")
+    return True
+
+async def handle_api_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # минимальный HTTP/1.1 с keep-alive: ровно то, что нужно httpx
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            _, path, _ = request_line.decode().split(" ", 2)
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = line.decode().partition(":")
+                headers[k.strip().lower()] = v.strip()
+
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                body = b""
+                while True:
+                    size = int((await reader.readline()).strip() or b"0", 16)
+                    if size == 0:
+                        await reader.readline()
+                        break
+                    body += await reader.readexactly(size)
+                    await reader.readline()
+            else:
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+            method = path.rstrip("/").rsplit("/", 1)[-1].lower()
+            API_CALLS[method] += 1
+            params = parse_params(headers.get("content-type", ""), body)
+            API_REQUESTS.append((method, params))
+            error = fake_error(method, params)
+            if error:
+                status = b"400 Bad Request"
+                payload = json.dumps({"ok": False, "error_code": 400, "description": error}).encode()
+            else:
+                status = b"200 OK"
+                payload = json.dumps({"ok": True, "result": fake_result(method, params)}).encode()
+
+            writer.write(
+                b"HTTP/1.1 " + status + b"\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: " + str(len(payload)).encode() + b"\r\n"
+                b"\r\n" + payload
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+# ==========================================================
+# ====================== ЛОКАЛЬНЫЙ POSTGRES ================
+# ==========================================================
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_local_postgres() -> Tuple[str, str]:
+    # временный кластер в tmp: trust-авторизация, сокет в том же каталоге
+    if not (shutil.which("initdb") and shutil.which("pg_ctl")):
+        raise RuntimeError("DATABASE_URL не задан, а initdb/pg_ctl не найдены в PATH.")
+    root = tempfile.mkdtemp(prefix="quizbot-pg-")
+    data_dir = os.path.join(root, "data")
+    port = free_port()
+    subprocess.run(
+        ["initdb", "-D", data_dir, "-U", "postgres", "-A", "trust", "--no-sync",
+         "-E", "UTF8", "--locale=C"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        ["pg_ctl", "-D", data_dir, "-l", os.path.join(root, "pg.log"), "-w",
+         "-o", f"-p {port} -k {root} -c fsync=off -c max_connections=200", "start"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    print("LOADTEST: local postgres", data_dir, "port", port)
+    return f"postgresql://postgres@127.0.0.1:{port}/postgres", root
+
+def stop_local_postgres(root: str) -> None:
+    subprocess.run(
+        ["pg_ctl", "-D", os.path.join(root, "data"), "-m", "fast", "-w", "stop"],
+        check=False, stdout=subprocess.DEVNULL,
+    )
+    shutil.rmtree(root, ignore_errors=True)
+
+# ==========================================================
+# ====================== СЧЁТЧИК ОБРАЩЕНИЙ К БД ============
+# ==========================================================
+DB_CALLS: Counter = Counter()
+
+def count_db_roundtrips() -> Callable[[], None]:
+    # считаем сетевые обращения: внутри pipeline execute/commit не уходят
+    # на сервер по одному, поэтому там считаем только сам pipeline.
+    # commit вне транзакции (выход из pool.connection() после своего commit) в сеть не ходит;
+    # проверка соединения пулом (SELECT 1 при выдаче) считается отдельно — pool_check.
+    # Вызывать до db_pool_create: пул запоминает check при создании.
+    # Возвращает функцию, снимающую счётчики (для тестов)
+    from psycopg import AsyncConnection, AsyncCursor, pq
+    from psycopg_pool import AsyncConnectionPool
+
+    originals = [(cls, name, cls.__dict__[name]) for cls, name in (
+        (AsyncCursor, "execute"), (AsyncCursor, "executemany"), (AsyncCursor, "copy"),
+        (AsyncConnection, "commit"), (AsyncConnection, "pipeline"),
+        (AsyncConnectionPool, "check_connection"),
+    )]
+
+    def restore() -> None:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+    def in_pipeline(con) -> bool:
+        return getattr(con, "_pipeline", None) is not None
+
+    def in_check(con) -> bool:
+        return getattr(con, "_loadtest_check", False)
+
+    def wrap(cls, name, key, conn_of, needs_transaction=False):
+        original = getattr(cls, name)
+
+        async def wrapper(self, *args, **kwargs):
+            con = conn_of(self)
+            idle = con.info.transaction_status == pq.TransactionStatus.IDLE
+            if not in_pipeline(con) and not in_check(con) and not (needs_transaction and idle):
+                DB_CALLS[key] += 1
+            return await original(self, *args, **kwargs)
+
+        setattr(cls, name, wrapper)
+
+    wrap(AsyncCursor, "execute", "execute", lambda cur: cur.connection)
+    wrap(AsyncCursor, "executemany", "executemany", lambda cur: cur.connection)
+    wrap(AsyncConnection, "commit", "commit", lambda con: con, needs_transaction=True)
+
+    original_check = AsyncConnectionPool.check_connection
+
+    async def check_connection(conn) -> None:
+        DB_CALLS["pool_check"] += 1
+        conn._loadtest_check = True
+        try:
+            await original_check(conn)
+        finally:
+            conn._loadtest_check = False
+
+    AsyncConnectionPool.check_connection = staticmethod(check_connection)
+
+    original_copy = AsyncCursor.copy
+
+    @asynccontextmanager
+    async def copy(self, *args, **kwargs):
+        DB_CALLS["copy"] += 1
+        async with original_copy(self, *args, **kwargs) as cp:
+            yield cp
+
+    AsyncCursor.copy = copy
+
+    original_pipeline = AsyncConnection.pipeline
+
+    @asynccontextmanager
+    async def pipeline(self):
+        if not in_pipeline(self):
+            DB_CALLS["pipeline"] += 1
+        async with original_pipeline(self) as p:
+            yield p
+
+    AsyncConnection.pipeline = pipeline
+    return restore
+
+# ==========================================================
+# ====================== ПОЛЬЗОВАТЕЛИ ======================
+# ==========================================================
+_UPDATE_ID = 0
+
+def callback_update(bot_module, app, user_id: int, data: str, photo: bool = False):
+    # photo — кнопка под сообщением с картинкой (вопрос с фото), иначе под текстом
+    global _UPDATE_ID
+    _UPDATE_ID += 1
+    user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"}
+    message = {
+        "message_id": next_message_id(),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "LoadTest"},
+    }
+    if photo:
+        message["photo"] = [{"file_id": "PHOTO", "file_unique_id": "PHOTO", "width": 640, "height": 480}]
+    else:
+        message["text"] = "-"
+    payload = {
+        "update_id": _UPDATE_ID,
+        "callback_query": {
+            "id": str(_UPDATE_ID),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        },
+    }
+    return bot_module.Update.de_json(payload, app.bot)
+
+def message_update(bot_module, app, user_id: int, text: str):
+    # текст от пользователя; команда (/reload) — с entity bot_command, как шлёт Telegram
+    global _UPDATE_ID
+    _UPDATE_ID += 1
+    message = {
+        "message_id": next_message_id(),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return bot_module.Update.de_json({"update_id": _UPDATE_ID, "message": message}, app.bot)
+
+async def simulate_user(bot_module, app, user_id: int, wrong_rate: float, latencies: List[float]):
+    # апдейты одного пользователя идут строго по очереди, как из реального чата
+    async def push(data: str):
+        t0 = time.perf_counter()
+        await app.process_update(callback_update(bot_module, app, user_id, data))
+        latencies.append(time.perf_counter() - t0)
+
+    await push("start_quiz")
+    while True:
+        session = app.user_data.get(user_id) or {}
+        order = session.get("order") or []
+        pos = int(session.get("pos", 0))
+        if not order or pos >= len(order):
+            break
+        q_index = order[pos]
+        q = bot_module.CONTENT.questions[q_index]
+        wrong = [i for i in range(len(q.options)) if i != q.correct]
+        tried = set(session.get("wrong_opts") or [])
+        wrong = [i for i in wrong if i not in tried]
+        opt = random.choice(wrong) if wrong and random.random() < wrong_rate else q.correct
+        await push(f"ans:{q_index}:{opt}")
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p * (len(ordered) - 1)))))
+    return ordered[k]
+
+# ==========================================================
+# ====================== ЗАПУСК =============================
+# ==========================================================
+@asynccontextmanager
+async def bot_application():
+    # бот на фейковом Bot API, как в проде, только апдейты подаём сами
+    server = await asyncio.start_server(handle_api_client, "127.0.0.1", 0)
+    api_port = server.sockets[0].getsockname()[1]
+    print("LOADTEST: fake Bot API on port", api_port)
+
+    import bot  # env уже выставлен в main()
+
+    if bot.QUESTION_BANK_PATH:
+        bot.install_bank(bot.load_bank(bot.QUESTION_BANK_PATH))
+    bot.db_pool_create()
+    app = bot.build_application(base_url=f"http://127.0.0.1:{api_port}/bot")
+    await app.initialize()
+    await bot.post_init(app)
+    # start() нужен ради фонового сброса персистентности
+    await app.start()
+    try:
+        yield bot, app
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await bot.post_shutdown(app)
+        server.close()
+        await server.wait_closed()
+
+async def run(args) -> None:
+    count_db_roundtrips()
+    async with bot_application() as (bot, app):
+        await run_users(args, bot, app)
+
+async def run_users(args, bot, app) -> None:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    # у каждого воркера свои пользователи
+    first_uid = 10_000_000 + (args.worker or 0) * args.users
+
+    async def one(uid: int):
+        async with semaphore:
+            await simulate_user(bot, app, uid, args.wrong_rate, latencies)
+
+    API_CALLS.clear()
+    DB_CALLS.clear()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(first_uid + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - t0
+    # дожимаем буфер событий, чтобы его COPY попал в счётчик
+    await bot.writer().close()
+    bot.WRITER = None
+
+    updates = len(latencies)
+    db_total = sum(DB_CALLS.values())
+    if args.worker is not None:
+        # для родительского процесса (--workers): одна строка с итогом
+        print("RESULT", json.dumps({
+            "worker": args.worker, "updates": updates, "elapsed": elapsed,
+            "p50": percentile(latencies, 0.50), "p99": percentile(latencies, 0.99), "db": db_total,
+        }))
+        return
+    print()
+    print(f"users:            {args.users} (concurrency {args.concurrency}, wrong-rate {args.wrong_rate})")
+    print(f"updates:          {updates} in {elapsed:.2f}s -> {updates / elapsed if elapsed else 0:.1f} updates/sec")
+    print(f"latency p50/p99:  {percentile(latencies, 0.50) * 1000:.1f} / {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"db round trips:   {db_total} ({db_total / updates if updates else 0:.2f} per update)")
+    for key, n in sorted(DB_CALLS.items()):
+        print(f"  {key:<22}{n}")
+    print(f"bot api calls:    {sum(API_CALLS.values())}")
+    for method, n in API_CALLS.most_common():
+        print(f"  {method:<22}{n}")
+
+def run_workers(args, workers: Optional[int] = None) -> float:
+    # N процессов бота (MULTI_WORKER) на одной базе; пользователи делятся поровну.
+    # Возвращает суммарную пропускную способность, updates/sec
+    workers = workers or args.workers
+    per_worker = max(1, args.users // workers)
+    procs = []
+    for i in range(workers):
+        env = dict(os.environ, MULTI_WORKER="1", WORKER_ID=f"loadtest-{i}")
+        cmd = [sys.executable, os.path.abspath(__file__), "--users", str(per_worker),
+               "--concurrency", str(args.concurrency), "--wrong-rate", str(args.wrong_rate), "--worker", str(i)]
+        if args.seed is not None:
+            cmd += ["--seed", str(args.seed + i)]
+        procs.append(subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, text=True))
+
+    results = []
+    for p in procs:
+        out, _ = p.communicate()
+        for line in out.splitlines():
+            if line.startswith("RESULT "):
+                results.append(json.loads(line[len("RESULT "):]))
+        if p.returncode:
+            print("LOADTEST: worker exited with", p.returncode)
+
+    print()
+    print(f"workers:          {workers} x {per_worker} users (concurrency {args.concurrency} each)")
+    for r in sorted(results, key=lambda r: r["worker"]):
+        print(f"  worker {r['worker']}: {r['updates']} updates in {r['elapsed']:.2f}s "
+              f"({r['updates'] / r['elapsed'] if r['elapsed'] else 0:.1f}/s), "
+              f"p50/p99 {r['p50'] * 1000:.1f}/{r['p99'] * 1000:.1f} ms, db {r['db']}")
+    if len(results) < workers:
+        return 0.0
+    total = sum(r["updates"] for r in results)
+    wall = max(r["elapsed"] for r in results)
+    rate = total / wall if wall else 0.0
+    print(f"total:            {total} updates, {rate:.1f} updates/sec")
+    return rate
+
+def run_scaling(args) -> int:
+    # тот же --users через 1 и через N процессов MULTI_WORKER (путь апдейта одинаковый:
+    # лок пользователя, чтение и запись sessions) — во сколько раз выросла пропускная способность.
+    # Процессы делят ядра с Postgres: на машине с одним-двумя CPU роста не будет
+    base = run_workers(args, 1)
+    scaled = run_workers(args, args.workers)
+    speedup = scaled / base if base else 0.0
+    print()
+    print(f"scaling:          1 -> {args.workers} workers: {base:.1f} -> {scaled:.1f} updates/sec, "
+          f"x{speedup:.2f} (CPU: {os.cpu_count()})")
+    if speedup < args.min_speedup:
+        print(f"LOADTEST: speedup x{speedup:.2f} < --min-speedup {args.min_speedup}")
+        return 1
+    return 0
+
+# ==========================================================
+# ====================== ПЕРЕКРЁСТНЫЕ ВОРКЕРЫ ==============
+# --workers N --cross-workers: апдейты одного пользователя по очереди уходят в
+# разные процессы (как webhook за балансировщиком). Дочерний процесс читает из
+# stdin строки {"id", "user", "data"} (нажатие) или {"id", "user", "text"} (сообщение,
+# например /reload) и на каждую отвечает "REPLY {...}" с сессией
+# после обработки; родитель сверяет pos/penalty_ms и итоговую строку attempts.
+# ==========================================================
+async def serve_updates() -> None:
+    async with bot_application() as (bot, app):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+
+        async def handle(cmd: dict) -> None:
+            uid = int(cmd["user"])
+            try:
+                if "text" in cmd:
+                    update = message_update(bot, app, uid, cmd["text"])
+                else:
+                    update = callback_update(bot, app, uid, cmd["data"])
+                await app.process_update(update)
+                ud = app.user_data.get(uid)
+                reply = {"id": cmd["id"], "session": ud.to_dict() if ud is not None else {}}
+            except Exception as e:
+                reply = {"id": cmd["id"], "error": repr(e)}
+            print("REPLY", json.dumps(reply), flush=True)
+
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            task = asyncio.create_task(handle(json.loads(line)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+class WorkerProcess:
+    # дочерний процесс бота: click() — один апдейт, ответ — сессия пользователя
+    def __init__(self, proc: asyncio.subprocess.Process, name: str):
+        self.proc = proc
+        self.name = name
+        self.waiters: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.reader = asyncio.create_task(self._read_replies())
+
+    @classmethod
+    async def start(cls, index: int) -> "WorkerProcess":
+        env = dict(os.environ, MULTI_WORKER="1", WORKER_ID=f"loadtest-cross-{index}")
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--serve",
+            env=env, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        )
+        return cls(proc, f"worker {index}")
+
+    async def _read_replies(self) -> None:
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            if line.startswith(b"REPLY "):
+                reply = json.loads(line[len(b"REPLY "):])
+                fut = self.waiters.pop(reply["id"], None)
+                if fut is not None and not fut.done():
+                    fut.set_result(reply)
+        for fut in self.waiters.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"{self.name} exited"))
+
+    async def click(self, user_id: int, data: str) -> dict:
+        return await self._send({"user": user_id, "data": data})
+
+    async def message(self, user_id: int, text: str) -> dict:
+        return await self._send({"user": user_id, "text": text})
+
+    async def _send(self, cmd: dict) -> dict:
+        self.next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[self.next_id] = fut
+        self.proc.stdin.write((json.dumps({"id": self.next_id, **cmd}) + "\n").encode())
+        await self.proc.stdin.drain()
+        reply = await fut
+        if "error" in reply:
+            raise RuntimeError(f"{self.name}: {reply['error']}")
+        return reply["session"]
+
+    async def close(self) -> int:
+        self.proc.stdin.close()
+        await self.reader
+        return await self.proc.wait()
+
+async def cross_user(bot, workers: List[WorkerProcess], user_id: int, wrong_rate: float,
+                     stats: Counter, problems: List[str]) -> Optional[Tuple[int, int, int]]:
+    # нажатия пользователя идут в воркеры по кругу; неверный ответ шлём сразу в два
+    # воркера — штраф должен начислиться один раз. Возвращает (attempt_id, penalty, wrong).
+    turn = user_id
+
+    def next_worker() -> WorkerProcess:
+        nonlocal turn
+        turn += 1
+        return workers[turn % len(workers)]
+
+    def check(cond: bool, what: str) -> None:
+        stats["checks"] += 1
+        if not cond:
+            problems.append(f"user {user_id}: {what}")
+
+    s = await next_worker().click(user_id, "start_quiz")
+    stats["updates"] += 1
+    attempt_id = s.get("attempt_id")
+    check(attempt_id is not None and s.get("pos") == 0, f"start_quiz -> {s}")
+    penalty = wrong_count = 0
+    while s.get("order") and s["pos"] < len(s["order"]):
+        order, pos = s["order"], s["pos"]
+        q_index = order[pos]
+        q = bot.CONTENT.questions[q_index]
+        tried = set(s.get("wrong_opts") or [])
+        wrong = [i for i in range(len(q.options)) if i != q.correct and i not in tried]
+        if wrong and random.random() < wrong_rate:
+            data = f"ans:{q_index}:{random.choice(wrong)}"
+            replies = await asyncio.gather(next_worker().click(user_id, data), next_worker().click(user_id, data))
+            stats["updates"] += 2
+            stats["duplicates"] += 1
+            penalty += bot.WRONG_PENALTY_MS
+            wrong_count += 1
+            for r in replies:
+                check(r.get("pos") == pos and r.get("penalty_ms") == penalty,
+                      f"wrong answer at pos {pos}: pos {r.get('pos')}, penalty_ms {r.get('penalty_ms')} != {penalty}")
+            s = replies[-1]
+        else:
+            s = await next_worker().click(user_id, f"ans:{q_index}:{q.correct}")
+            stats["updates"] += 1
+            if s.get("order"):
+                check(s.get("pos") == pos + 1 and s.get("penalty_ms", 0) == penalty,
+                      f"correct answer at pos {pos}: pos {s.get('pos')}, penalty_ms {s.get('penalty_ms')} != {penalty}")
+            else:
+                check(pos == len(order) - 1 and not s.get("attempt_id"), f"finished at pos {pos} -> {s}")
+    return (attempt_id, penalty, wrong_count) if attempt_id is not None else None
+
+async def run_cross(args) -> int:
+    import bot
+    import psycopg
+
+    workers = [await WorkerProcess.start(i) for i in range(args.workers)]
+    stats: Counter = Counter()
+    problems: List[str] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    first_uid = 20_000_000
+
+    async def one(uid: int):
+        async with semaphore:
+            try:
+                return await cross_user(bot, workers, uid, args.wrong_rate, stats, problems)
+            except Exception as e:
+                problems.append(f"user {uid}: {e!r}")
+                return None
+
+    t0 = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(one(first_uid + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - t0
+    finally:
+        codes = [await w.close() for w in workers]
+
+    # итог в базе: попытка завершена, штраф и ошибки — ровно по одному на неверный ответ
+    async with await psycopg.AsyncConnection.connect(os.environ["DATABASE_URL"]) as con:
+        for attempt_id, penalty, wrong_count in filter(None, results):
+            cur = await con.execute("SELECT status, penalty_ms, wrong_count FROM attempts WHERE id=%s", (attempt_id,))
+            row = await cur.fetchone()
+            stats["checks"] += 1
+            if row != ("finished", penalty, wrong_count):
+                problems.append(f"attempt {attempt_id}: {row} != ('finished', {penalty}, {wrong_count})")
+
+    print()
+    print(f"cross-workers:    {args.workers} processes, {args.users} users (concurrency {args.concurrency})")
+    print(f"updates:          {stats['updates']} in {elapsed:.2f}s -> {stats['updates'] / elapsed if elapsed else 0:.1f} updates/sec")
+    print(f"duplicate clicks: {stats['duplicates']} (wrong answer sent to two workers at once)")
+    print(f"checks:           {stats['checks']}, mismatches: {len(problems)}")
+    for line in problems[:20]:
+        print("  " + line)
+    if any(codes):
+        print("LOADTEST: worker exit codes", codes)
+    return 1 if problems or any(codes) else 0
+
+# ==========================================================
+# ====================== ПАМЯТЬ СЕССИЙ =====================
+# ==========================================================
+def memory_benchmark(users: int) -> None:
+    # без БД и сети: сколько занимают сессии N пользователей (половина посреди теста)
+    # в виде dict и QuizSession, и сколько их остаётся после выселения по лимиту
+    import tracemalloc
+    import bot
+
+    def fill(factory) -> dict:
+        store = {}
+        for uid in range(users):
+            ud = store[uid] = factory()
+            if uid % 2:
+                ud["order"] = random.sample(range(50), k=bot.QUESTIONS_PER_RUN)
+                ud["pos"] = uid % bot.QUESTIONS_PER_RUN
+                ud["t0"] = time.time()
+                ud["penalty_ms"] = 5000
+                ud["wrong_count"] = 1
+                ud["attempt_id"] = uid
+                ud["bank_version"] = bot.CONTENT.version
+                ud["q_shown_at"] = time.time()
+        return store
+
+    for name, factory in (("dict", dict), ("QuizSession", bot.QuizSession)):
+        tracemalloc.start()
+        store = fill(factory)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<12} {users} users: {current / 2**20:.1f} MiB ({current / users:.0f} B/user)")
+
+    janitor = bot.SessionJanitor(bot.SESSION_IDLE_TTL_S, bot.SESSION_MAX_USERS)
+    for uid in store:
+        janitor.touch(uid)
+    for uid, _ in janitor.victims(store.keys()):
+        store.pop(uid, None)
+        janitor.forget(uid)
+    print(f"after eviction (SESSION_MAX_USERS={bot.SESSION_MAX_USERS}): {len(store)} sessions in memory")
+
+# ==========================================================
+# ====================== ОТРИСОВКА ЭКРАНОВ =================
+# ==========================================================
+def render_benchmark(renders: int) -> Dict[str, Dict[str, float]]:
+    # без БД и сети: во что обходится подготовка одного экрана — как было (теория
+    # режется chunk_text на каждый показ, клавиатуры собираются заново) и из CONTENT
+    import timeit
+    import tracemalloc
+    import bot
+
+    pages = bot.CONTENT.theory_pages
+    questions = bot.CONTENT.questions
+    fresh = {name: getattr(bot, name).__wrapped__ for name in ("theory_kb", "main_menu_kb", "finish_kb")}
+
+    def theory_before(i: int):
+        chunks = bot.chunk_text(bot.THEORY_TEXT)
+        page = i % len(chunks)
+        return chunks[page], fresh["theory_kb"](page, len(chunks))
+
+    def theory_after(i: int):
+        page = i % len(pages)
+        return pages[page], bot.theory_kb(page, len(pages))
+
+    def question_before(i: int):
+        q = bot.QUESTIONS[i % len(bot.QUESTIONS)]
+        return q.text, bot.quiz_kb(i % len(bot.QUESTIONS), tuple(q.options)), "Верно!\n" + q.explain_right
+
+    def question_after(i: int):
+        q = questions[i % len(questions)]
+        return q.text, q.kb, q.right_text
+
+    def menus_before(i: int):
+        return fresh["main_menu_kb"](), fresh["finish_kb"]()
+
+    def menus_after(i: int):
+        return bot.main_menu_kb(), bot.finish_kb()
+
+    def peak_bytes(render) -> float:
+        # пик памяти внутри одного показа: всё, что он успевает навыделять
+        samples = []
+        tracemalloc.start()
+        for i in range(min(renders, 200)):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            render(i)
+            samples.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        return sum(samples) / len(samples)
+
+    def cpu_us(render) -> float:
+        it = iter(range(10**12))
+        return timeit.timeit(lambda: render(next(it)), number=renders) / renders * 1e6
+
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'screen':<10}{'before, us':>12}{'after, us':>12}{'before, B':>12}{'after, B':>12}   ({renders} renders)")
+    for name, before, after in (("theory", theory_before, theory_after),
+                                ("question", question_before, question_after),
+                                ("menus", menus_before, menus_after)):
+        r = results[name] = {
+            "before_us": cpu_us(before), "after_us": cpu_us(after),
+            "before_bytes": peak_bytes(before), "after_bytes": peak_bytes(after),
+        }
+        print(f"{name:<10}{r['before_us']:>12.1f}{r['after_us']:>12.2f}{r['before_bytes']:>12.0f}{r['after_bytes']:>12.0f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон quiz-бота на фейковом Bot API.")
+    parser.add_argument("--users", type=int, default=200, help="сколько пользователей проходят тест")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько пользователей активны одновременно")
+    parser.add_argument("--wrong-rate", type=float, default=0.3, help="доля неверных ответов (0..1)")
+    parser.add_argument("--seed", type=int, default=None, help="seed для random")
+    parser.add_argument("--memory", action="store_true", help="только замер памяти сессий (без БД и Bot API)")
+    parser.add_argument("--render", action="store_true",
+                        help="только замер подготовки экранов: chunk_text и сборка клавиатур против CONTENT (без БД)")
+    parser.add_argument("--renders", type=int, default=5000, help="с --render: сколько показов на каждый экран")
+    parser.add_argument("--workers", type=int, default=1, help="сколько процессов бота (MULTI_WORKER) на одной базе")
+    parser.add_argument("--cross-workers", action="store_true",
+                        help="с --workers: нажатия одного пользователя по очереди идут в разные процессы")
+    parser.add_argument("--scaling", action="store_true",
+                        help="с --workers N: прогнать те же --users через 1 и через N процессов и сравнить")
+    parser.add_argument("--min-speedup", type=float, default=0.0,
+                        help="с --scaling: код выхода 1, если N процессов быстрее одного меньше чем во столько раз")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)   # номер дочернего процесса
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)      # дочерний процесс --cross-workers
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.memory:
+        memory_benchmark(args.users)
+        return
+    if args.render:
+        render_benchmark(args.renders)
+        return
+
+    pg_root: Optional[str] = None
+    if not os.environ.get("DATABASE_URL"):
+        os.environ["DATABASE_URL"], pg_root = start_local_postgres()
+    os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+    os.environ.setdefault("UPDATE_CONCURRENCY", str(max(args.concurrency, 1)))
+    os.environ.setdefault("DB_POOL_MAX_SIZE", "20")
+    os.environ.setdefault("METRICS_PORT", "0")
+    # лимиты Telegram к фейковому API не относятся: иначе меряем SendLimiter, а не бота
+    os.environ.setdefault("SEND_RATE_GLOBAL", "1000000")
+    os.environ.setdefault("SEND_RATE_PER_CHAT", "1000000")
+    os.environ.setdefault("SEND_BURST_PER_CHAT", "1000000")
+    # задержка персистентности не должна копить сессии весь прогон
+    os.environ.setdefault("SESSION_FLUSH_INTERVAL_S", "1")
+
+    try:
+        if args.serve:
+            asyncio.run(serve_updates())
+        elif args.cross_workers:
+            return asyncio.run(run_cross(args))
+        elif args.scaling:
+            return run_scaling(args)
+        elif args.workers > 1:
+            run_workers(args)
+        else:
+            asyncio.run(run(args))
+    finally:
+        if pg_root:
+            stop_local_postgres(pg_root)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Общие фикстуры: Postgres, свежая база на каждый тест и бот на фейковом Bot API
+# из loadtest.py.
+#
+# Сервер Postgres берётся из TEST_DATABASE_URL (нужны права на CREATE DATABASE),
+# реплика этого сервера для тестов аналитики — из TEST_DATABASE_READ_URL. Если
+# TEST_DATABASE_URL не задан, а initdb/pg_ctl есть в PATH, поднимается временный
+# кластер (и реплика к нему через pg_basebackup). Иначе тесты с базой пропускаются.
+
+import os
+import sys
+import uuid
+import shutil
+import asyncio
+import subprocess
+from contextlib import asynccontextmanager
+from typing import List
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import loadtest  # noqa: E402
+
+# env читается при импорте bot — выставляем до него
+os.environ.setdefault("BOT_TOKEN", loadtest.FAKE_TOKEN)
+os.environ["METRICS_PORT"] = "0"
+os.environ["SEND_RATE_GLOBAL"] = "1000000"
+os.environ["SEND_RATE_PER_CHAT"] = "1000000"
+os.environ["SEND_BURST_PER_CHAT"] = "1000000"
+os.environ["SESSION_FLUSH_INTERVAL_S"] = "1"
+os.environ["UPDATE_CONCURRENCY"] = "32"
+os.environ["DB_POOL_MAX_SIZE"] = "10"
+
+import psycopg  # noqa: E402
+from psycopg.conninfo import make_conninfo  # noqa: E402
+
+import bot  # noqa: E402
+
+# ==========================================================
+# ====================== POSTGRES ==========================
+# ==========================================================
+def start_local_replica(primary_url: str, root: str) -> str:
+    # потоковая реплика временного кластера: pg_basebackup -R пишет standby.signal
+    port = loadtest.free_port()
+    data_dir = os.path.join(root, "replica")
+    primary = psycopg.conninfo.conninfo_to_dict(primary_url)
+    subprocess.run(
+        ["pg_basebackup", "-h", primary["host"], "-p", str(primary["port"]), "-U", "postgres",
+         "-D", data_dir, "-R", "-X", "stream", "--no-sync"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        ["pg_ctl", "-D", data_dir, "-l", os.path.join(root, "replica.log"), "-w",
+         "-o", f"-p {port} -k {root} -c fsync=off -c hot_standby_feedback=on", "start"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    return f"postgresql://postgres@127.0.0.1:{port}/postgres"
+
+@pytest.fixture(scope="session")
+def pg_server():
+    url = os.environ.get("TEST_DATABASE_URL")
+    read_url = os.environ.get("TEST_DATABASE_READ_URL")
+    root = None
+    if not url:
+        if not (shutil.which("initdb") and shutil.which("pg_ctl")) or os.geteuid() == 0:
+            pytest.skip("нужен TEST_DATABASE_URL или initdb/pg_ctl (не от root)")
+        url, root = loadtest.start_local_postgres()
+        if shutil.which("pg_basebackup"):
+            read_url = start_local_replica(url, root)
+    try:
+        yield {"url": url, "read_url": read_url}
+    finally:
+        if root:
+            if read_url:
+                subprocess.run(["pg_ctl", "-D", os.path.join(root, "replica"), "-m", "fast", "-w", "stop"],
+                               check=False, stdout=subprocess.DEVNULL)
+            loadtest.stop_local_postgres(root)
+
+@pytest.fixture
+def database(pg_server):
+    # своя база на тест: миграции с нуля, никаких следов соседних тестов
+    name = f"quizbot_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(pg_server["url"], autocommit=True) as con:
+        con.execute(f'CREATE DATABASE "{name}"')
+    read_url = make_conninfo(pg_server["read_url"], dbname=name) if pg_server["read_url"] else None
+    try:
+        yield {"url": make_conninfo(pg_server["url"], dbname=name), "read_url": read_url}
+    finally:
+        with psycopg.connect(pg_server["url"], autocommit=True) as con:
+            con.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+
+# ==========================================================
+# ====================== БОТ ===============================
+# ==========================================================
+class BotHarness:
+    def __init__(self, app):
+        self.app = app
+
+    async def click(self, user_id: int, data: str, photo: bool = False) -> None:
+        await self.app.process_update(loadtest.callback_update(bot, self.app, user_id, data, photo=photo))
+
+    def session(self, user_id: int) -> dict:
+        ud = self.app.user_data.get(user_id)
+        return ud.to_dict() if ud is not None else {}
+
+    def answer_for(self, user_id: int, correct: bool = True) -> str:
+        # callback_data ответа на текущий вопрос пользователя
+        s = self.session(user_id)
+        q_index = s["order"][s["pos"]]
+        q = bot.BANKS[s["bank_version"]].questions[q_index]
+        opt = q.correct if correct else next(
+            i for i in range(len(q.options)) if i != q.correct and i not in s.get("wrong_opts", []))
+        return f"ans:{q_index}:{opt}"
+
+    async def fetch(self, sql: str, params=None) -> List[dict]:
+        async with bot.db_connect() as con, con.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
+
+    @staticmethod
+    def sent(*methods: str) -> List[dict]:
+        return [p for m, p in loadtest.API_REQUESTS if not methods or m in methods]
+
+@pytest.fixture
+def quizbot(database, monkeypatch):
+    # async with quizbot(EDIT_IN_PLACE=True) as h: ... — настройки подменяются в модуле bot
+    @asynccontextmanager
+    async def start(read_replica: bool = False, **settings):
+        monkeypatch.setattr(bot, "DATABASE_URL", database["url"])
+        monkeypatch.setattr(bot, "DATABASE_READ_URL", (database["read_url"] or "") if read_replica else "")
+        for name, value in settings.items():
+            assert hasattr(bot, name), name
+            monkeypatch.setattr(bot, name, value)
+        monkeypatch.setattr(bot, "SESSIONS", bot.SessionJanitor(bot.SESSION_IDLE_TTL_S, bot.SESSION_MAX_USERS))
+        monkeypatch.setattr(bot, "BANKS", dict(bot.BANKS))
+        monkeypatch.setattr(bot, "CONTENT", bot.CONTENT)
+        bot.drop_local_caches()
+        loadtest.API_REQUESTS.clear()
+
+        server = await asyncio.start_server(loadtest.handle_api_client, "127.0.0.1", 0)
+        api_port = server.sockets[0].getsockname()[1]
+        bot.db_pool_create()
+        app = bot.build_application(base_url=f"http://127.0.0.1:{api_port}/bot")
+        await app.initialize()
+        await bot.post_init(app)
+        await app.start()
+        try:
+            yield BotHarness(app)
+        finally:
+            await app.stop()
+            await app.shutdown()
+            await bot.post_shutdown(app)
+            server.close()
+            await server.wait_closed()
+            bot.drop_local_caches()
+
+    return start
+
+@pytest.fixture
+def db_only(database, monkeypatch):
+    # только пулы и миграции, без Application: для тестов запросов
+    @asynccontextmanager
+    async def start(read_replica: bool = False, **settings):
+        monkeypatch.setattr(bot, "DATABASE_URL", database["url"])
+        monkeypatch.setattr(bot, "DATABASE_READ_URL", (database["read_url"] or "") if read_replica else "")
+        for name, value in settings.items():
+            assert hasattr(bot, name), name
+            monkeypatch.setattr(bot, name, value)
+        bot.drop_local_caches()
+        bot.db_pool_create()
+        try:
+            await bot.db_startup()
+            yield bot
+        finally:
+            await bot.db_pool_close()
+            bot.drop_local_caches()
+
+    return start
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Апдейты одного пользователя обрабатываются строго по очереди (UserLocks),
+# поэтому быстрые повторные нажатия не начисляют штраф и не двигают pos дважды.
+
+import asyncio
+
+import bot
+
+UID = 40_000_001
+
+async def attempt_row(h) -> dict:
+    rows = await h.fetch("SELECT * FROM attempts WHERE id=%s", (h.session(UID)["attempt_id"],))
+    return rows[0]
+
+async def answer_rows(h) -> list:
+    return await h.fetch(
+        "SELECT pos, option_index, is_correct FROM answers WHERE attempt_id=%s ORDER BY id",
+        (h.session(UID)["attempt_id"],),
+    )
+
+def test_duplicate_wrong_answer_is_penalized_once(quizbot):
+    async def scenario():
+        async with quizbot() as h:
+            await h.click(UID, "start_quiz")
+            data = h.answer_for(UID, correct=False)
+            await asyncio.gather(*(h.click(UID, data) for _ in range(5)))
+
+            s = h.session(UID)
+            assert s["pos"] == 0
+            assert s["penalty_ms"] == bot.WRONG_PENALTY_MS
+            assert s["wrong_count"] == 1
+            assert s["wrong_opts"] == [int(data.rsplit(":", 1)[1])]
+            row = await attempt_row(h)
+            assert row["penalty_ms"] == bot.WRONG_PENALTY_MS
+            assert row["wrong_count"] == 1
+            assert len(await answer_rows(h)) == 1
+
+    asyncio.run(scenario())
+
+def test_duplicate_correct_answer_advances_once(quizbot):
+    async def scenario():
+        async with quizbot() as h:
+            await h.click(UID, "start_quiz")
+            data = h.answer_for(UID)
+            await asyncio.gather(*(h.click(UID, data) for _ in range(5)))
+
+            s = h.session(UID)
+            assert s["pos"] == 1
+            assert s["penalty_ms"] == 0
+            assert await answer_rows(h) == [{"pos": 0, "option_index": int(data.rsplit(":", 1)[1]), "is_correct": True}]
+            stale = [p["text"] for p in h.sent("sendmessage") if p["text"].startswith("Это старые кнопки")]
+            assert len(stale) == 4
+
+    asyncio.run(scenario())
+
+def test_rapid_mixed_clicks_keep_session_consistent(quizbot):
+    # вперемешку: неверный, тот же неверный, верный, снова верный (уже старые кнопки)
+    async def scenario():
+        async with quizbot() as h:
+            await h.click(UID, "start_quiz")
+            wrong = h.answer_for(UID, correct=False)
+            right = h.answer_for(UID)
+            await asyncio.gather(*(h.click(UID, d) for d in (wrong, wrong, right, right, wrong)))
+
+            s = h.session(UID)
+            assert s["pos"] == 1
+            assert s["wrong_count"] in (0, 1)   # неверный мог успеть раньше верного
+            assert s["penalty_ms"] == s["wrong_count"] * bot.WRONG_PENALTY_MS
+            rows = await answer_rows(h)
+            assert sum(r["is_correct"] for r in rows) == 1
+            assert len(rows) == 1 + s["wrong_count"]
+            row = await attempt_row(h)
+            assert row["penalty_ms"] == s["penalty_ms"]
+
+    asyncio.run(scenario())
+
+def test_reaper_waits_for_user_lock(quizbot):
+    async def scenario():
+        async with quizbot() as h:
+            await h.click(UID, "start_quiz")
+            attempt_id = h.session(UID)["attempt_id"]
+            await h.fetch("UPDATE attempts SET started_ts = started_ts - %s WHERE id=%s RETURNING id",
+                          (bot.ATTEMPT_TIMEOUT_S + 60, attempt_id))
+
+            async with bot.USER_LOCKS.hold(UID):
+                reap = asyncio.create_task(bot.reap_stale_attempts(h.app))
+                await asyncio.sleep(0.3)
+                # попытка в базе уже закрыта, но сессию в памяти не трогаем, пока идёт апдейт
+                assert not reap.done()
+                assert h.session(UID)["attempt_id"] == attempt_id
+            assert await reap == 1
+            assert h.session(UID) == {}
+            row = (await h.fetch("SELECT status FROM attempts WHERE id=%s", (attempt_id,)))[0]
+            assert row["status"] == "timeout"
+
+    asyncio.run(scenario())
+
+def test_finish_does_not_reopen_closed_attempt(quizbot):
+    # reaper другого воркера уже закрыл попытку как timeout, а сессия дожила у этого
+    async def scenario():
+        async with quizbot() as h:
+            await h.click(UID, "start_quiz")
+            attempt_id = h.session(UID)["attempt_id"]
+            await h.fetch("UPDATE attempts SET status='timeout', ended_ts=%s WHERE id=%s RETURNING id",
+                          (bot.now_ts(), attempt_id))
+            while h.session(UID).get("order"):
+                await h.click(UID, h.answer_for(UID))
+
+            row = (await h.fetch("SELECT status, total_ms FROM attempts WHERE id=%s", (attempt_id,)))[0]
+            assert row == {"status": "timeout", "total_ms": None}
+            assert await h.fetch("SELECT * FROM best_scores WHERE user_id=%s", (UID,)) == []
+
+    asyncio.run(scenario())
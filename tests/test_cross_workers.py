@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# MULTI_WORKER: нажатия одного пользователя по очереди обрабатывают разные процессы
+# (loadtest.py --cross-workers); pos/penalty_ms не теряются и не задваиваются.
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from dataclasses import asdict
+
+import psycopg
+
+import bot
+import loadtest
+
+def test_callbacks_alternate_between_workers(database):
+    env = dict(os.environ, DATABASE_URL=database["url"])
+    env.pop("DATABASE_READ_URL", None)
+    proc = subprocess.run(
+        [sys.executable, loadtest.__file__, "--workers", "3", "--cross-workers",
+         "--users", "12", "--concurrency", "6", "--wrong-rate", "0.5", "--seed", "1"],
+        env=env, capture_output=True, text=True, timeout=300,
+    )
+    assert proc.returncode == 0, proc.stdout[-3000:] + proc.stderr[-3000:]
+    assert "mismatches: 0" in proc.stdout
+    assert "duplicate clicks: 0 " not in proc.stdout
+
+def test_throughput_with_more_workers(database):
+    # те же пользователи через 1 и через 2 процесса MULTI_WORKER. Процессы делят CPU с Postgres:
+    # рост требуем, только если ядер хватает; на 1-2 ядрах — лишь отсутствие провала
+    # (лок-конвои, ожидание advisory-локов), который выдал бы себя падением в разы
+    min_speedup = 1.3 if (os.cpu_count() or 1) >= 4 else 0.5
+    env = dict(os.environ, DATABASE_URL=database["url"])
+    env.pop("DATABASE_READ_URL", None)
+    proc = subprocess.run(
+        [sys.executable, loadtest.__file__, "--workers", "2", "--scaling", "--min-speedup", str(min_speedup),
+         "--users", "40", "--concurrency", "10", "--seed", "1"],
+        env=env, capture_output=True, text=True, timeout=300,
+    )
+    assert proc.returncode == 0, proc.stdout[-3000:] + proc.stderr[-3000:]
+    assert "scaling:          1 -> 2 workers" in proc.stdout
+
+ADMIN = 60_000_001
+PLAYER = 60_000_002
+FRESH = 60_000_003
+
+def write_bank(path, version: str) -> None:
+    raw = {"version": version, "theory": bot.THEORY_TEXT, "questions": [asdict(q) for q in bot.QUESTIONS]}
+    path.write_text(json.dumps(raw, ensure_ascii=False), encoding="utf-8")
+
+def test_reload_on_one_worker_keeps_attempt_running_on_another(database, tmp_path, monkeypatch):
+    # попытка начата на B; админ дважды делает /reload на A (v1 -> v2 -> v3),
+    # следующее нажатие приходит в A — банк v1 должен остаться, попытка — продолжиться.
+    # После второго /reload v1 держится уже только строкой sessions, а не keep
+    bank = tmp_path / "bank.json"
+    write_bank(bank, "v1")
+    monkeypatch.setenv("DATABASE_URL", database["url"])
+    monkeypatch.delenv("DATABASE_READ_URL", raising=False)
+    monkeypatch.setenv("QUESTION_BANK_PATH", str(bank))
+    monkeypatch.setenv("ADMIN_IDS", str(ADMIN))
+
+    def answer(s: dict) -> str:
+        q_index = s["order"][s["pos"]]
+        return f"ans:{q_index}:{bot.QUESTIONS[q_index].correct}"
+
+    async def scenario():
+        a, b = await loadtest.WorkerProcess.start(0), await loadtest.WorkerProcess.start(1)
+        try:
+            s = await b.click(PLAYER, "start_quiz")
+            assert s["bank_version"].startswith("v1:")
+            s = await b.click(PLAYER, answer(s))
+            assert s["pos"] == 1
+
+            for version in ("v2", "v3"):
+                write_bank(bank, version)
+                await a.message(ADMIN, "/reload")
+            # A действительно перешёл на v3: новые попытки начинаются на нём
+            fresh = await a.click(FRESH, "start_quiz")
+            assert fresh["bank_version"].startswith("v3:")
+
+            s = await a.click(PLAYER, answer(s))
+            assert s.get("pos") == 2 and s["bank_version"].startswith("v1:"), f"попытка сброшена: {s}"
+            while s.get("order"):
+                s = await (a if s["pos"] % 2 else b).click(PLAYER, answer(s))
+        finally:
+            await a.close()
+            await b.close()
+
+        async with await psycopg.AsyncConnection.connect(database["url"]) as con:
+            cur = await con.execute("SELECT status FROM attempts WHERE user_id=%s", (PLAYER,))
+            assert await cur.fetchall() == [("finished",)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Медленный запрос одного пользователя не должен задерживать остальных:
+# все обращения к Postgres неблокирующие, event loop в это время свободен.
+
+import asyncio
+import time
+
+import psycopg
+
+import bot
+
+SLOW_UID = 20_000_001
+OTHER_UIDS = range(20_000_100, 20_000_130)
+
+def test_slow_db_path_does_not_block_other_users(quizbot, database):
+    async def scenario():
+        async with quizbot() as h:
+            # чужая транзакция держит строку users медленного пользователя:
+            # его upsert_user будет ждать, пока она не завершится
+            blocker = await psycopg.AsyncConnection.connect(database["url"])
+            try:
+                await blocker.execute(
+                    "INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts) VALUES(%s, 'slow', 'slow', 0, 0)",
+                    (SLOW_UID,),
+                )
+                slow = asyncio.create_task(h.click(SLOW_UID, "start_quiz"))
+                await asyncio.sleep(0.3)
+                assert not slow.done()
+
+                async def play(uid: int):
+                    await h.click(uid, "start_quiz")
+                    await h.click(uid, h.answer_for(uid))
+
+                t0 = time.perf_counter()
+                await asyncio.wait_for(asyncio.gather(*(play(uid) for uid in OTHER_UIDS)), timeout=15)
+                elapsed = time.perf_counter() - t0
+
+                assert not slow.done(), "медленный пользователь должен всё ещё ждать свою строку"
+                for uid in OTHER_UIDS:
+                    assert h.session(uid)["pos"] == 1
+                print(f"{len(OTHER_UIDS)} users x 2 updates in {elapsed:.2f}s while one update was blocked")
+            finally:
+                await blocker.rollback()
+                await blocker.close()
+
+            await asyncio.wait_for(slow, timeout=15)
+            assert h.session(SLOW_UID)["pos"] == 0
+            assert h.session(SLOW_UID)["attempt_id"] is not None
+
+    asyncio.run(scenario())
+
+def test_event_loop_stays_responsive_during_slow_query(quizbot):
+    # пока один запрос спит в Postgres, таймер event loop не должен опаздывать
+    async def scenario():
+        async with quizbot():
+            async def slow_query():
+                async with bot.db_connect() as con:
+                    await con.execute("SELECT pg_sleep(1.0)")
+
+            slow = asyncio.create_task(slow_query())
+            lags = []
+            while not slow.done():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.05)
+                lags.append(time.perf_counter() - t0 - 0.05)
+            await slow
+            assert len(lags) >= 10
+            assert max(lags) < 0.25
+
+    asyncio.run(scenario())
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Обслуживание events: дневные партиции создаются и тогда, когда в events_default
+# уже лежат строки за эти дни (например, после увеличения EVENTS_PARTITIONS_AHEAD_DAYS).
+
+import asyncio
+import calendar
+from datetime import datetime, timedelta, timezone
+
+import bot
+
+UID = 90_000_001
+
+def test_partition_created_over_rows_in_default(db_only, monkeypatch):
+    async def scenario():
+        async with db_only():
+            today = datetime.fromtimestamp(bot.now_ts(), timezone.utc).date()
+            day = today + timedelta(days=bot.EVENTS_PARTITIONS_AHEAD_DAYS + 1)
+            day_ts = calendar.timegm(day.timetuple())
+            partition = "events_p" + day.strftime("%Y%m%d")
+
+            async with bot.db_connect() as con, con.cursor() as cur:
+                for i in range(3):
+                    await cur.execute("INSERT INTO events(ts, user_id, event_type, q) VALUES(%s, %s, 'answer_clicked', %s)",
+                                      (day_ts + i * 3600, UID, i))
+                await cur.execute("SELECT COUNT(*) AS n FROM events_default")
+                assert (await cur.fetchone())["n"] == 3
+                await con.commit()
+
+            monkeypatch.setattr(bot, "EVENTS_PARTITIONS_AHEAD_DAYS", bot.EVENTS_PARTITIONS_AHEAD_DAYS + 1)
+            assert await bot.events_maintenance() == (0, 0)
+
+            async with bot.db_connect() as con, con.cursor() as cur:
+                await cur.execute("SELECT COUNT(*) AS n FROM events_default")
+                assert (await cur.fetchone())["n"] == 0
+                await cur.execute(f"SELECT user_id, q FROM {partition} ORDER BY q")
+                assert await cur.fetchall() == [{"user_id": UID, "q": i} for i in range(3)]
+
+    asyncio.run(scenario())
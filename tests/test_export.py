@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Экспорт: zip из csv.gz по таблицам, строки из COPY, сжатие в отдельном потоке.
+
+import asyncio
+import csv
+import gzip
+import io
+import time
+import zipfile
+
+import bot
+
+ROWS = 60_000   # несколько мегабайт CSV — больше EXPORT_WRITE_BATCH
+
+async def seed(now: int) -> None:
+    async with bot.db_connect() as con, con.cursor() as cur:
+        await cur.execute(
+            "INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts) VALUES(1, 'u', 'Юзер', 0, %s)",
+            (now,))
+        await cur.execute(
+            """
+            INSERT INTO answers(attempt_id, user_id, ts, pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now)
+            SELECT g, 1, %s - g, g %% 10, g %% 40, g %% 4, g %% 4 = 0, 0, g
+            FROM generate_series(1, %s) g
+            """,
+            (now, ROWS))
+        await con.commit()
+
+def read_table(archive, table: str):
+    archive.seek(0)
+    with zipfile.ZipFile(archive) as zf:
+        raw = zf.read(f"{table}.csv.gz")
+    return raw, list(csv.reader(io.StringIO(gzip.decompress(raw).decode("utf-8"))))
+
+def test_export_archive_contents(db_only):
+    async def scenario():
+        async with db_only():
+            now = bot.now_ts()
+            await seed(now)
+            archive, filename = await bot.export_archive()
+            with archive:
+                assert filename.endswith(".zip")
+                raw, answers = read_table(archive, "answers")
+                assert answers[0][:3] == ["id", "attempt_id", "user_id"]
+                assert len(answers) == ROWS + 1
+                assert raw[8] == 4   # XFL=4: gzip самого быстрого уровня
+                _, users = read_table(archive, "users")
+                assert users[1][2] == "Юзер"
+
+            # диапазон: строки с ts в последние 1000 секунд (g = 1..1000)
+            archive, _ = await bot.export_archive(ts_from=now - 1000, ts_to=now)
+            with archive:
+                _, answers = read_table(archive, "answers")
+                assert len(answers) == 1000 + 1
+
+    asyncio.run(scenario())
+
+def test_export_does_not_stall_event_loop(db_only):
+    async def scenario():
+        async with db_only():
+            await seed(bot.now_ts())
+            export = asyncio.create_task(bot.export_archive())
+            lags = []
+            while not export.done():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - t0 - 0.01)
+            archive, _ = await export
+            archive.close()
+            assert max(lags) < 0.2, f"event loop stalled for {max(lags):.3f}s"
+
+    asyncio.run(scenario())
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Индексы из миграций действительно используются: на засеянной базе берём те же
+# запросы, что шлют хелперы бота, и проверяем план через EXPLAIN (FORMAT JSON).
+
+import asyncio
+from contextlib import contextmanager
+from typing import List, Set, Tuple
+
+import pytest
+from psycopg import AsyncCursor
+
+import bot
+
+SEED_SQL = [
+    """
+    INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts)
+    SELECT g, 'u' || g, 'User ' || g, %(now)s - 86400 * 30, %(now)s - g
+    FROM generate_series(1, 5000) g
+    """,
+    """
+    INSERT INTO attempts(user_id, started_ts, ended_ts, status, questions_per_run, wrong_penalty_ms,
+                         wrong_count, penalty_ms, elapsed_ms, total_ms)
+    SELECT 1 + g %% 5000, %(now)s - g, %(now)s - g + 60,
+           CASE WHEN g %% 500 = 0 THEN 'started' ELSE 'finished' END,
+           10, 5000, g %% 3, (g %% 3) * 5000, 60000 + g %% 9000, 60000 + g %% 9000 + (g %% 3) * 5000
+    FROM generate_series(1, 20000) g
+    """,
+    """
+    INSERT INTO answers(attempt_id, user_id, ts, pos, question_index, option_index, is_correct, penalty_ms_after, total_ms_now)
+    SELECT 1 + g %% 20000, 1 + g %% 5000, %(now)s - g, g %% 10, g %% 40, g %% 4, g %% 4 = 0, 0, 1000
+    FROM generate_series(1, 100000) g
+    """,
+    """
+    INSERT INTO events(ts, user_id, event_type, attempt_id)
+    SELECT %(now)s - g %% 3600, 1 + g %% 5000, 'callback', 1 + g %% 20000
+    FROM generate_series(1, 20000) g
+    """,
+    """
+    INSERT INTO best_scores(user_id, best_total_ms, attempt_id, achieved_ts)
+    SELECT g, 60000 + (g * 7919) %% 100000, g, %(now)s FROM generate_series(1, 5000) g
+    """,
+    """
+    INSERT INTO question_stats_hourly(bank_version, question_index, hour_ts, answers)
+    SELECT 'v', q, %(hour)s - h * 3600, 1
+    FROM generate_series(0, 39) q, generate_series(0, %(keep_hours)s + 2) h
+    """,
+]
+
+@contextmanager
+def captured_sql():
+    # запросы хелпера, как они ушли в psycopg: (sql, params)
+    statements: List[Tuple[str, object]] = []
+    original = AsyncCursor.execute
+
+    async def execute(self, query, params=None, **kwargs):
+        statements.append((query, params))
+        return await original(self, query, params, **kwargs)
+
+    AsyncCursor.execute = execute
+    try:
+        yield statements
+    finally:
+        AsyncCursor.execute = original
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+async def explain(sql: str, params=None) -> Set[str]:
+    # имена индексов, которые планировщик выбрал для запроса
+    async with bot.db_connect() as con, con.cursor() as cur:
+        await cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = (await cur.fetchone())["QUERY PLAN"][0]["Plan"]
+        await con.rollback()
+    return {n["Index Name"] for n in plan_nodes(plan) if "Index Name" in n}
+
+@pytest.fixture
+def seeded(db_only):
+    async def seed():
+        now = bot.now_ts()
+        async with bot.db_connect() as con, con.cursor() as cur:
+            for sql in SEED_SQL:
+                await cur.execute(sql, {"now": now, "hour": now - now % 3600,
+                                        "keep_hours": bot.QUESTION_STATS_KEEP_DAYS * 24})
+            await con.commit()
+        async with bot.db_connect() as con:
+            await con.set_autocommit(True)
+            await con.execute("ANALYZE")
+            await con.set_autocommit(False)
+    return db_only, seed
+
+HELPER_CASES = [
+    ("leaderboard_top", lambda app: bot.leaderboard_top(10), "best_scores_best_total_ms_idx"),
+    ("stats_users_text", lambda app: bot.stats_users_text(20), "users_last_seen_ts_idx"),
+    ("stats_attempts_text", lambda app: bot.stats_attempts_text(20), "attempts_pkey"),
+    ("reap_stale_attempts", lambda app: bot.reap_stale_attempts(app), "attempts_started_idx"),
+    ("prune_question_stats_hourly", lambda app: bot.prune_question_stats_hourly(), "question_stats_hourly_hour_ts_idx"),
+]
+
+class NoSessions:
+    user_data: dict = {}
+
+@pytest.mark.parametrize("name,call,index", HELPER_CASES, ids=[c[0] for c in HELPER_CASES])
+def test_helper_queries_use_indexes(seeded, name, call, index):
+    start, seed = seeded
+
+    async def scenario():
+        async with start():
+            await seed()
+            with captured_sql() as statements:
+                await call(NoSessions())
+            main = [(sql, params) for sql, params in statements if not str(sql).lstrip().upper().startswith("SET")]
+            assert main, f"{name}: нет запросов"
+            used = set()
+            for sql, params in main:
+                used |= await explain(sql, params)
+            assert index in used, f"{name}: {index} не в плане, использованы {sorted(used)}"
+
+    asyncio.run(scenario())
+
+# точечные выборки по ключам, для которых миграция 2 завела индексы
+KEY_CASES = [
+    ("attempts by user", "SELECT * FROM attempts WHERE user_id = %s", (42,), "attempts_user_id_idx"),
+    ("answers by attempt", "SELECT * FROM answers WHERE attempt_id = %s", (4242,), "answers_attempt_id_idx"),
+    ("answers by question", "SELECT COUNT(*) FROM answers WHERE question_index = %s AND ts > %s",
+     (7, 0), "answers_question_index_idx"),
+    ("best attempts", "SELECT id FROM attempts WHERE status = 'finished' ORDER BY total_ms LIMIT 10", None,
+     "attempts_status_total_ms_idx"),
+]
+
+@pytest.mark.parametrize("name,sql,params,index", KEY_CASES, ids=[c[0] for c in KEY_CASES])
+def test_key_lookups_use_indexes(seeded, name, sql, params, index):
+    start, seed = seeded
+
+    async def scenario():
+        async with start():
+            await seed()
+            indexes = await explain(sql, params)
+            assert index in indexes, f"{name}: {index} не в плане, использованы {sorted(indexes)}"
+
+    asyncio.run(scenario())
+
+def test_events_by_user_use_partition_indexes(seeded):
+    # у секционированной events индекс по user_id свой у каждой секции
+    start, seed = seeded
+
+    async def scenario():
+        async with start():
+            await seed()
+            indexes = await explain("SELECT * FROM events WHERE user_id = %s", (42,))
+            assert any(i.endswith("user_id_idx") for i in indexes), sorted(indexes)
+
+    asyncio.run(scenario())
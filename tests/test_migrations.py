@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Миграции на пустой базе: несколько процессов (MULTI_WORKER, рестарт с rolling deploy)
+# стартуют одновременно — применяется каждая ровно один раз, никто не падает.
+
+import asyncio
+
+import bot
+
+def test_concurrent_db_init_on_empty_database(database, monkeypatch):
+    monkeypatch.setattr(bot, "DATABASE_URL", database["url"])
+    monkeypatch.setattr(bot, "DATABASE_READ_URL", "")
+    monkeypatch.setattr(bot, "DB_POOL_MIN_SIZE", 8)   # все init стартуют сразу, а не по очереди за соединением
+
+    async def scenario():
+        bot.db_pool_create()
+        try:
+            await bot.db_pool_open()
+            await asyncio.gather(*(bot.db_init() for _ in range(8)))
+            async with bot.db_connect() as con, con.cursor() as cur:
+                await cur.execute("SELECT version FROM schema_version ORDER BY version")
+                applied = [r["version"] for r in await cur.fetchall()]
+        finally:
+            await bot.db_pool_close()
+        assert applied == [version for version, _, _ in bot.MIGRATIONS]
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Аналитика с реплики: два настоящих Postgres (основной + потоковая реплика).
+# Реплика берётся из TEST_DATABASE_READ_URL или поднимается conftest'ом.
+
+import asyncio
+import time
+
+import psycopg
+import pytest
+from psycopg.errors import QueryCanceled
+
+import bot
+import loadtest
+
+async def wait_replica_caught_up(database, timeout_s: float = 15.0) -> None:
+    # база создана на основном сервере и мигрирована — ждём, пока реплика это проиграет
+    deadline = time.monotonic() + timeout_s
+    async with await psycopg.AsyncConnection.connect(database["url"], autocommit=True) as primary:
+        lsn = (await (await primary.execute("SELECT pg_current_wal_lsn()")).fetchone())[0]
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(database["read_url"], autocommit=True) as replica:
+                cur = await replica.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (str(lsn),))
+                if (await cur.fetchone())[0]:
+                    return
+        except psycopg.OperationalError:
+            pass   # базы на реплике ещё нет
+        if time.monotonic() > deadline:
+            raise TimeoutError("реплика не догнала основной сервер")
+        await asyncio.sleep(0.1)
+
+async def read_target(timeout_ms=None) -> tuple:
+    # куда ушёл запрос аналитики и с каким statement_timeout
+    async with bot.db_read_connect(timeout_ms) as con, con.cursor() as cur:
+        await cur.execute("SELECT pg_is_in_recovery() AS replica, current_setting('statement_timeout') AS timeout")
+        r = await cur.fetchone()
+    return ("replica" if r["replica"] else "primary"), r["timeout"]
+
+@pytest.fixture
+def replica(database, monkeypatch):
+    if not database["read_url"]:
+        pytest.skip("нет реплики: задай TEST_DATABASE_READ_URL или pg_basebackup в PATH")
+    # проверяем отставание на каждом запросе, а не раз в 10 сек
+    monkeypatch.setattr(bot.READ_ROUTER, "check_interval_s", 0)
+    monkeypatch.setattr(bot.READ_ROUTER, "max_lag_s", 0.5)
+    return database
+
+def test_stats_read_from_replica(db_only, replica):
+    async def scenario():
+        async with db_only(read_replica=True):
+            async with bot.db_connect() as con:
+                await con.execute(
+                    "INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts) "
+                    "VALUES(7, 'replicated', 'R', 0, %s)", (bot.now_ts(),))
+            await wait_replica_caught_up(replica)
+
+            assert await read_target() == ("replica", "30s")
+            assert "replicated" in await bot.stats_users_text()
+            assert "Пользователей: 1" in await bot.stats_overview_text()
+
+    asyncio.run(scenario())
+
+def test_lagging_replica_falls_back_to_primary(db_only, replica):
+    async def scenario():
+        async with db_only(read_replica=True):
+            await wait_replica_caught_up(replica)
+            assert (await read_target())[0] == "replica"
+
+            async with await psycopg.AsyncConnection.connect(replica["read_url"], autocommit=True) as standby:
+                await standby.execute("SELECT pg_wal_replay_pause()")
+                try:
+                    async with bot.db_connect() as con:
+                        await con.execute(
+                            "INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts) "
+                            "VALUES(8, 'fresh', 'F', 0, %s)", (bot.now_ts(),))
+                    await asyncio.sleep(1.0)
+                    # реплика отстаёт больше max_lag_s: читаем с основной и видим свежую строку
+                    assert (await read_target())[0] == "primary"
+                    assert "fresh" in await bot.stats_users_text()
+                finally:
+                    await standby.execute("SELECT pg_wal_replay_resume()")
+
+            await wait_replica_caught_up(replica)
+            assert (await read_target())[0] == "replica"
+
+    asyncio.run(scenario())
+
+def test_unreachable_replica_falls_back_to_primary(db_only, monkeypatch):
+    # реплика не нужна: адрес, на котором никто не слушает
+    async def scenario():
+        async with db_only(DATABASE_READ_URL=f"postgresql://postgres@127.0.0.1:{loadtest.free_port()}/x"):
+            assert (await read_target())[0] == "primary"
+            assert "Пользователей: 0" in await bot.stats_overview_text()
+            assert bot.READ_ROUTER.healthy is False
+
+    monkeypatch.setattr(bot.READ_ROUTER, "check_interval_s", 0)
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("use_replica", [False, True], ids=["primary", "replica"])
+def test_export_has_its_own_statement_timeout(db_only, database, use_replica, monkeypatch):
+    if use_replica and not database["read_url"]:
+        pytest.skip("нет реплики")
+    monkeypatch.setattr(bot.READ_ROUTER, "check_interval_s", 0)
+
+    async def scenario():
+        async with db_only(read_replica=use_replica, DB_READ_STATEMENT_TIMEOUT_MS=50, EXPORT_STATEMENT_TIMEOUT_MS=0):
+            if use_replica:
+                await wait_replica_caught_up(database)
+            target = "replica" if use_replica else "primary"
+            assert await read_target() == (target, "50ms")
+            assert await read_target(bot.EXPORT_STATEMENT_TIMEOUT_MS) == (target, "0")
+
+            # обычная аналитика упирается в лимит, экспорт — нет
+            with pytest.raises(QueryCanceled):
+                async with bot.db_read_connect() as con:
+                    await con.execute("SELECT pg_sleep(0.3)")
+            async with bot.db_read_connect(bot.EXPORT_STATEMENT_TIMEOUT_MS) as con:
+                await con.execute("SELECT pg_sleep(0.3)")
+            archive, _ = await bot.export_archive()
+            archive.close()
+
+            # лимит был только на транзакцию: соединение из пула вернулось без него
+            assert await read_target(bot.EXPORT_STATEMENT_TIMEOUT_MS) == (target, "0")
+
+    asyncio.run(scenario())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Обращения к БД на один неверный ответ: прежний путь (upsert_user + log_event в роутере
+# и в обработчике, attempt_update_progress, log_answer — каждый своей транзакцией)
+# против record_answer — одного CTE, который уходит в pipeline вместе с BEGIN/COMMIT.
+
+import asyncio
+
+import pytest
+from telegram import User
+
+import bot
+import loadtest
+
+UID = 70_000_001
+
+def old_wrong_click(attempt_id: int, q: int, opt: int) -> list:
+    # транзакции прежнего пути, как их слали хелперы до record_answer
+    ts = bot.now_ts()
+    upsert = [
+        ("SELECT user_id FROM users WHERE user_id=%s", (UID,)),
+        ("UPDATE users SET username=%s, full_name=%s, last_seen_ts=%s WHERE user_id=%s", ("u", "U", ts, UID)),
+    ]
+    return [
+        upsert,                                                       # роутер: upsert_user
+        [("INSERT INTO events(ts, user_id, event_type, payload) VALUES(%s, %s, 'callback', %s)",
+          (ts, UID, f'{{"data": "ans:{q}:{opt}"}}'))],                # роутер: log_event
+        upsert,                                                       # обработчик: upsert_user
+        [("INSERT INTO events(ts, user_id, event_type, attempt_id, q, opt) VALUES(%s, %s, 'answer_clicked', %s, %s, %s)",
+          (ts, UID, attempt_id, q, opt))],                            # log_event
+        [("UPDATE attempts SET wrong_count=%s, penalty_ms=%s WHERE id=%s",
+          (1, bot.WRONG_PENALTY_MS, attempt_id))],                    # attempt_update_progress
+        [("INSERT INTO answers(attempt_id, user_id, ts, pos, question_index, option_index, is_correct, "
+          "penalty_ms_after, total_ms_now) VALUES(%s, %s, %s, 0, %s, %s, false, %s, 1000)",
+          (attempt_id, UID, ts, q, opt, bot.WRONG_PENALTY_MS))],      # log_answer
+    ]
+
+@pytest.fixture
+def roundtrips():
+    restore = loadtest.count_db_roundtrips()
+    loadtest.DB_CALLS.clear()
+    yield loadtest.DB_CALLS
+    restore()
+
+async def measure(calls, coro) -> dict:
+    calls.clear()
+    await coro
+    return dict(calls)
+
+def test_wrong_answer_is_one_pipeline(db_only, roundtrips):
+    async def scenario():
+        async with db_only():
+            await bot.upsert_user(User(UID, "U", False, username="u"))
+            attempt_id = await bot.attempt_start(UID)
+            q, opt = 3, 1
+
+            async def old_path():
+                for tx in old_wrong_click(attempt_id, q, opt):
+                    async with bot.db_connect() as con, con.cursor() as cur:
+                        for sql, params in tx:
+                            await cur.execute(sql, params)
+                        await con.commit()
+
+            before = await measure(roundtrips, old_path())
+            after = await measure(roundtrips, bot.record_answer(
+                User(UID, "U", False, username="u"), attempt_id, 0, q, opt, False,
+                1, bot.WRONG_PENALTY_MS, 1000, bank_version=bot.CONTENT.version))
+
+            print(f"\nround trips per wrong click: before {sum(before.values())} {before}, "
+                  f"after {sum(after.values())} {after}")
+            # на каждое соединение из пула — ещё проверка SELECT 1 (check_connection)
+            assert before == {"pool_check": 6, "execute": 8, "commit": 6}
+            assert after == {"pool_check": 1, "pipeline": 1}
+
+            # и правда всё записано: прогресс, ответ, событие
+            async with bot.db_connect() as con, con.cursor() as cur:
+                await cur.execute("SELECT wrong_count, penalty_ms FROM attempts WHERE id=%s", (attempt_id,))
+                assert await cur.fetchone() == {"wrong_count": 1, "penalty_ms": bot.WRONG_PENALTY_MS}
+                await cur.execute("SELECT COUNT(*) AS n FROM answers WHERE attempt_id=%s", (attempt_id,))
+                assert (await cur.fetchone())["n"] == 2
+                await cur.execute("SELECT COUNT(*) AS n FROM events WHERE attempt_id=%s AND event_type='answer_clicked'",
+                                  (attempt_id,))
+                assert (await cur.fetchone())["n"] == 2
+
+    asyncio.run(scenario())
+
+def test_wrong_click_through_handler_is_one_pipeline(quizbot, roundtrips):
+    # весь апдейт целиком: роутер для ans: не трогает users/events отдельно
+    async def scenario():
+        async with quizbot() as h:
+            await h.click(UID, "start_quiz")
+            calls = await measure(roundtrips, h.click(UID, h.answer_for(UID, correct=False)))
+            assert calls == {"pool_check": 1, "pipeline": 1}
+            assert h.session(UID)["penalty_ms"] == bot.WRONG_PENALTY_MS
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# EDIT_IN_PLACE: отклик на ответ встраивается в экран вопроса, но подпись к фото
+# не может быть длиннее 1024 символов — тогда отклик уходит отдельным сообщением.
+
+import asyncio
+import json
+
+import loadtest
+import bot
+
+UID = 30_000_001
+
+def photo_bank(tmp_path, text_len: int) -> "bot.ContentStore":
+    photo = tmp_path / "q.png"
+    photo.write_bytes(b"\x89PNG\r\n\x1a\n")
+    q = bot.Question(
+        text="Д" * text_len,
+        options=["верный", "неверный"],
+        correct=0,
+        hint_wrong="п" * 200,
+        explain_right="пояснение",
+        photo_path=str(photo),
+    )
+    return bot.compile_content([q], "Теория", version=f"test:{text_len}")
+
+def media_caption(params: dict) -> str:
+    return json.loads(params["media"])["caption"]
+
+def assert_within_limits():
+    bad = [(m, p) for m, p in loadtest.API_REQUESTS if loadtest.fake_error(m, p)]
+    assert not bad, bad
+
+def test_long_caption_sends_note_separately(quizbot, tmp_path):
+    store = photo_bank(tmp_path, text_len=900)   # вопрос влезает в подпись, с откликом — нет
+
+    async def scenario():
+        async with quizbot(EDIT_IN_PLACE=True, QUESTIONS_PER_RUN=1) as h:
+            bot.install_bank(store)
+            await h.click(UID, "start_quiz")
+            await h.click(UID, "ans:0:1", photo=True)
+
+            assert h.session(UID)["penalty_ms"] == bot.WRONG_PENALTY_MS
+            assert_within_limits()
+            notes = [p["text"] for p in h.sent("sendmessage")]
+            assert notes == [store.questions[0].wrong_text]
+            edits = h.sent("editmessagemedia")
+            assert len(edits) == 1
+            assert media_caption(edits[0]).endswith("Д" * 900)
+
+    asyncio.run(scenario())
+
+def test_short_caption_keeps_note_inline(quizbot, tmp_path):
+    store = photo_bank(tmp_path, text_len=100)
+
+    async def scenario():
+        async with quizbot(EDIT_IN_PLACE=True, QUESTIONS_PER_RUN=1) as h:
+            bot.install_bank(store)
+            await h.click(UID, "start_quiz")
+            await h.click(UID, "ans:0:1", photo=True)
+
+            assert_within_limits()
+            assert not h.sent("sendmessage")
+            edits = h.sent("editmessagemedia")
+            assert len(edits) == 1
+            assert media_caption(edits[0]).startswith(store.questions[0].wrong_text)
+
+    asyncio.run(scenario())
+
+def test_caption_longer_than_limit_is_clipped(quizbot, tmp_path):
+    store = photo_bank(tmp_path, text_len=1500)
+
+    async def scenario():
+        async with quizbot(EDIT_IN_PLACE=False, QUESTIONS_PER_RUN=1) as h:
+            bot.install_bank(store)
+            await h.click(UID, "start_quiz")
+
+            assert_within_limits()
+            photos = h.sent("sendphoto")
+            assert len(photos) == 1
+            assert len(photos[0]["caption"]) == bot.CAPTION_MAX_CHARS
+            assert photos[0]["caption"].endswith("…")
+
+    asyncio.run(scenario())
+
+def test_precompiled_screens_are_cheaper_than_rebuilding():
+    # loadtest.py --render: страницы теории и клавиатуры из CONTENT против
+    # chunk_text и сборки InlineKeyboardMarkup на каждый показ
+    results = loadtest.render_benchmark(300)
+    for screen, r in results.items():
+        assert r["after_us"] * 5 < r["before_us"], (screen, r)
+        assert r["after_bytes"] * 5 < r["before_bytes"], (screen, r)
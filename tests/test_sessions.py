@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Выселение сессий сверх SESSION_MAX_USERS: в одном процессе попытка закрывается
+# как abandoned, в MULTI_WORKER забывается только локальная копия.
+
+import asyncio
+import time
+
+import bot
+
+USERS = (50_000_001, 50_000_002, 50_000_003)
+
+async def wait_evicted(h, uid: int, timeout_s: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while uid in h.app.user_data:
+        assert time.monotonic() < deadline, f"сессия {uid} не выселена"
+        await asyncio.sleep(0.01)
+
+def test_eviction_abandons_attempt_in_single_worker(quizbot):
+    async def scenario():
+        async with quizbot(SESSION_MAX_USERS=2) as h:
+            first = USERS[0]
+            await h.click(first, "start_quiz")
+            attempt_id = h.session(first)["attempt_id"]
+            for uid in USERS[1:]:
+                await h.click(uid, "start_quiz")
+            await wait_evicted(h, first)
+            await h.app.update_persistence()
+
+            assert set(h.app.user_data) == set(USERS[1:])
+            assert await h.fetch("SELECT 1 FROM sessions WHERE user_id=%s", (first,)) == []
+            row = (await h.fetch("SELECT status FROM attempts WHERE id=%s", (attempt_id,)))[0]
+            assert row["status"] == "abandoned"
+
+    asyncio.run(scenario())
+
+def test_eviction_keeps_shared_session_in_multi_worker(quizbot):
+    async def scenario():
+        async with quizbot(MULTI_WORKER=True, SESSION_MAX_USERS=2) as h:
+            first = USERS[0]
+            await h.click(first, "start_quiz")
+            await h.click(first, h.answer_for(first))
+            attempt_id = h.session(first)["attempt_id"]
+            for uid in USERS[1:]:
+                await h.click(uid, "start_quiz")
+            await wait_evicted(h, first)
+            await h.app.update_persistence()
+
+            # строка sessions общая для воркеров: остаётся, попытка продолжается
+            rows = await h.fetch("SELECT data FROM sessions WHERE user_id=%s", (first,))
+            assert rows and rows[0]["data"]["pos"] == 1
+            row = (await h.fetch("SELECT status FROM attempts WHERE id=%s", (attempt_id,)))[0]
+            assert row["status"] == "started"
+
+            # следующий апдейт поднимает сессию из базы
+            await h.click(first, "noop")
+            await h.click(first, h.answer_for(first))
+            assert h.session(first)["attempt_id"] == attempt_id
+            assert h.session(first)["pos"] == 2
+
+    asyncio.run(scenario())
+
+def test_sweep_errors_are_logged(quizbot, monkeypatch, capsys):
+    async def broken(app, victims):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        async with quizbot(SESSION_MAX_USERS=1) as h:
+            monkeypatch.setattr(bot, "evict_sessions", broken)
+            for uid in USERS:
+                await h.click(uid, "start_quiz")
+            task = bot.SESSIONS._sweep_task
+            assert task is not None
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert "ERROR: session sweep: RuntimeError('boom')" in capsys.readouterr().out
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Сводка для админа считается одним запросом с FILTER; сверяем её с прежними
+# отдельными COUNT/AVG (как было до объединения) на засеянных данных.
+
+import asyncio
+import math
+import random
+
+import pytest
+
+import bot
+
+# прежняя сводка: по запросу на метрику
+OLD_OVERVIEW_QUERIES = {
+    "users": "SELECT COUNT(*) AS v FROM users",
+    "attempts": "SELECT COUNT(*) AS v FROM attempts",
+    "finished": "SELECT COUNT(*) AS v FROM attempts WHERE status='finished'",
+    "quits": "SELECT COUNT(*) AS v FROM attempts WHERE status='quit'",
+    "avg_total": "SELECT AVG(total_ms) AS v FROM attempts WHERE status='finished' AND total_ms IS NOT NULL",
+    "avg_wrong": "SELECT AVG(wrong_count) AS v FROM attempts WHERE status='finished'",
+}
+
+STATUSES = ["finished"] * 6 + ["quit", "timeout", "abandoned", "started"]
+
+def percentile_cont(values, p: float) -> float:
+    # как percentile_cont в Postgres: линейная интерполяция между соседними
+    v = sorted(values)
+    k = (len(v) - 1) * p
+    lo = math.floor(k)
+    hi = min(lo + 1, len(v) - 1)
+    return v[lo] + (v[hi] - v[lo]) * (k - lo)
+
+async def seed(rng: random.Random) -> list:
+    now = bot.now_ts()
+    rows = []
+    for i in range(600):
+        status = rng.choice(STATUSES)
+        started = now - rng.randint(0, 10 * 86400)
+        wrong = rng.randint(0, 5)
+        total = rng.randint(30_000, 300_000) if status == "finished" and rng.random() > 0.05 else None
+        rows.append((1 + i % 150, started, status, wrong, wrong * 5000, total))
+    async with bot.db_connect() as con, con.cursor() as cur:
+        await cur.executemany(
+            "INSERT INTO users(user_id, username, full_name, first_seen_ts, last_seen_ts) VALUES(%s, NULL, 'u', 0, 0)",
+            [(uid,) for uid in range(1, 151)],
+        )
+        await cur.executemany(
+            """
+            INSERT INTO attempts(user_id, started_ts, status, questions_per_run, wrong_penalty_ms,
+                                 wrong_count, penalty_ms, total_ms)
+            VALUES(%s, %s, %s, 10, 5000, %s, %s, %s)
+            """,
+            rows,
+        )
+        await con.commit()
+    return rows
+
+async def old_overview() -> dict:
+    out = {}
+    async with bot.db_connect() as con, con.cursor() as cur:
+        for key, sql in OLD_OVERVIEW_QUERIES.items():
+            await cur.execute(sql)
+            out[key] = (await cur.fetchone())["v"]
+    return out
+
+@pytest.mark.parametrize("seed_value", [1, 2, 3])
+def test_overview_matches_old_queries(db_only, seed_value):
+    async def scenario():
+        async with db_only():
+            rows = await seed(random.Random(seed_value))
+            new = await bot.stats_overview_row()
+            old = await old_overview()
+
+            for key in ("users", "attempts", "finished", "quits"):
+                assert int(new[key]) == int(old[key]), key
+            for key in ("avg_total", "avg_wrong"):
+                assert float(new[key]) == pytest.approx(float(old[key])), key
+
+            # новые метрики того же прохода — по сырым строкам
+            totals = [r[5] for r in rows if r[2] == "finished" and r[5] is not None]
+            assert new["p50_total"] == pytest.approx(percentile_cont(totals, 0.5))
+            assert new["p95_total"] == pytest.approx(percentile_cont(totals, 0.95))
+            assert new["timeouts"] == sum(r[2] == "timeout" for r in rows)
+            assert new["abandoned"] == sum(r[2] == "abandoned" for r in rows)
+            assert new["attempts_24h"] == sum(r[1] >= bot.now_ts() - 86400 for r in rows)
+            assert new["first_started_ts"] == min(r[1] for r in rows)
+
+    asyncio.run(scenario())
+
+def test_overview_on_empty_database(db_only):
+    async def scenario():
+        async with db_only():
+            new = await bot.stats_overview_row()
+            old = await old_overview()
+            assert new["attempts"] == old["attempts"] == 0
+            assert new["avg_total"] is None and old["avg_total"] is None
+            assert new["p50_total"] is None
+            text = await bot.stats_overview_text()
+            assert "Попыток: 0" in text
+            assert "Доля завершивших: —" in text
+
+    asyncio.run(scenario())
+
+def test_overview_text_is_cached_until_invalidated(db_only):
+    async def scenario():
+        async with db_only():
+            await seed(random.Random(7))
+            first = await bot.stats_overview_text()
+            attempts = (await old_overview())["attempts"]
+            assert f"Попыток: {attempts}\n" in first
+
+            async with bot.db_connect() as con:
+                await con.execute(
+                    "INSERT INTO attempts(user_id, started_ts, status, questions_per_run, wrong_penalty_ms) "
+                    "VALUES(1, %s, 'started', 10, 5000)", (bot.now_ts(),))
+            assert await bot.stats_overview_text() == first
+
+            bot.drop_local_caches()
+            assert f"Попыток: {attempts + 1}\n" in await bot.stats_overview_text()
+
+    asyncio.run(scenario())
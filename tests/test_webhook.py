@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# BOT_MODE=webhook: встроенный сервер PTB принимает апдейты POST'ом, но только
+# с заголовком X-Telegram-Bot-Api-Secret-Token = WEBHOOK_SECRET. setWebhook уходит
+# в фейковый Bot API (loadtest.fake_result отвечает True на любой метод).
+
+import asyncio
+import time
+
+import httpx
+
+import bot
+import loadtest
+
+SECRET = "test-webhook-secret_1"
+UID = 80_000_001
+STRANGER = 80_000_002
+
+def recorded_callback(update_id: int, user_id: int, data: str) -> dict:
+    # апдейт в том виде, в каком его POST'ит Telegram
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": f"{user_id}{update_id}",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Web", "username": f"web{user_id}",
+                     "language_code": "ru"},
+            "message": {
+                "message_id": 10,
+                "from": {"id": loadtest.FAKE_BOT_ID, "is_bot": True, "first_name": "LoadTest"},
+                "chat": {"id": user_id, "first_name": "Web", "type": "private"},
+                "date": int(time.time()),
+                "text": "Привет!",
+            },
+            "chat_instance": "-7311",
+            "data": data,
+        },
+    }
+
+async def wait_for(cond, timeout_s: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while not cond():
+        assert time.monotonic() < deadline, "апдейт не обработан"
+        await asyncio.sleep(0.02)
+
+def test_webhook_accepts_only_requests_with_secret(quizbot):
+    async def scenario():
+        async with quizbot() as h:
+            port = loadtest.free_port()
+            await h.app.updater.start_webhook(
+                listen="127.0.0.1",
+                port=port,
+                url_path=bot.WEBHOOK_PATH,
+                webhook_url=f"https://bot.example.org/{bot.WEBHOOK_PATH}",
+                secret_token=SECRET,
+            )
+            try:
+                set_webhook = h.sent("setwebhook")
+                assert set_webhook and set_webhook[-1]["secret_token"] == SECRET
+
+                url = f"http://127.0.0.1:{port}/{bot.WEBHOOK_PATH}"
+                async with httpx.AsyncClient() as client:
+                    r = await client.post(url, json=recorded_callback(1, STRANGER, "start_quiz"))
+                    assert r.status_code == 403
+                    r = await client.post(url, json=recorded_callback(2, STRANGER, "start_quiz"),
+                                          headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+                    assert r.status_code == 403
+                    r = await client.post(url, json=recorded_callback(3, UID, "start_quiz"),
+                                          headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+                    assert r.status_code == 200
+
+                await wait_for(lambda: h.session(UID).get("attempt_id") is not None)
+            finally:
+                await h.app.updater.stop()
+
+            assert h.session(STRANGER) == {}
+            assert await h.fetch("SELECT user_id FROM users WHERE user_id=%s", (STRANGER,)) == []
+            rows = await h.fetch("SELECT status FROM attempts WHERE user_id=%s", (UID,))
+            assert rows == [{"status": "started"}]
+
+    asyncio.run(scenario())